@@ -1,3 +1,3 @@
-__version__ = "0.1"
-__all__ = ["convert", "simulate", "generate", "utils"]
+__version__ = "0.1.6"
+__all__ = ["aio", "analyze", "backends", "cache", "chunked", "convert", "simulate", "generate", "lut", "pipeline", "profiles", "utils", "vector"]
 from .main import main
@@ -0,0 +1,142 @@
+"""asyncio wrappers of the simulation functions.
+
+Simulating a large image blocks for hundreds of milliseconds, which would
+freeze an event loop. AsyncSimulator runs the decoding, the simulation and
+the encoding in an executor instead. Images are processed by horizontal
+tiles, so a cancelled task stops at the next tile boundary and the float32
+temporaries of simulate_cvd stay proportional to the tile size instead of
+the full frame.
+
+    simulator = aio.AsyncSimulator(simulate.Simulator_Machado2009(), max_concurrency=4)
+    out = await simulator.simulate_cvd(im, simulate.Deficiency.DEUTAN, 0.8)
+"""
+
+import asyncio
+import contextvars
+import io
+import weakref
+from pathlib import Path
+
+import numpy as np
+from PIL import Image
+
+from daltonlens import simulate
+
+class AsyncSimulator:
+    """Run a simulator from asyncio code without blocking the event loop.
+
+    Parameters
+    ==========
+    simulator : simulate.Simulator
+        The simulator to use. Simulators are stateless, so concurrent calls
+        can share the same AsyncSimulator.
+
+    executor : concurrent.futures.Executor
+        Where the work runs. None uses the default executor of the loop.
+
+    max_concurrency : int
+        Maximum number of images processed at the same time. Other calls
+        wait for their turn, which bounds the memory used by the
+        decoded images and the temporaries.
+
+    tile_rows : int
+        Number of image rows simulated per executor job.
+    """
+
+    def __init__(self, simulator: simulate.Simulator, executor=None, max_concurrency: int = 4, tile_rows: int = 256):
+        self.simulator = simulator
+        self.executor = executor
+        self.max_concurrency = max_concurrency
+        self.tile_rows = tile_rows
+        # Event loop -> semaphore. asyncio primitives are bound to a loop, and
+        # the same instance can be used by successive asyncio.run calls.
+        self._semaphores = weakref.WeakKeyDictionary()
+
+    def _get_semaphore(self):
+        loop = asyncio.get_running_loop()
+        semaphore = self._semaphores.get(loop)
+        if semaphore is None:
+            semaphore = self._semaphores[loop] = asyncio.Semaphore(self.max_concurrency)
+        return semaphore
+
+    def _run(self, func, *args):
+        # Carry the context, e.g. backends.use_backend, to the executor thread.
+        context = contextvars.copy_context()
+        return asyncio.get_running_loop().run_in_executor(self.executor, context.run, func, *args)
+
+    async def _simulate_tiles(self, image_srgb_uint8, deficiency: simulate.Deficiency, severity: float):
+        simulator = self.simulator
+        out = np.empty_like(image_srgb_uint8)
+        for start in range(0, image_srgb_uint8.shape[0], self.tile_rows):
+            tile = image_srgb_uint8[start:start+self.tile_rows]
+            out[start:start+tile.shape[0]] = await self._run(simulator.simulate_cvd, tile, deficiency, severity)
+        return out
+
+    async def simulate_cvd(self, image_srgb_uint8, deficiency: simulate.Deficiency, severity: float):
+        """Async version of simulate.Simulator.simulate_cvd.
+
+        Parameters
+        ==========
+        image_srgb_uint8 : array of shape (M,N,3) with dtype uint8
+            The input sRGB image.
+
+        deficiency : Deficiency
+            The deficiency to simulate.
+
+        severity : float
+            The severity between 0 (normal vision) and 1 (complete dichromacy).
+
+        Returns
+        =======
+        im : array of shape (M,N,3) with dtype uint8
+            The simulated sRGB image.
+        """
+        async with self._get_semaphore():
+            return await self._simulate_tiles(np.asarray(image_srgb_uint8), deficiency, severity)
+
+    async def simulate_cvd_batch(self, images, deficiency: simulate.Deficiency, severity: float):
+        """Simulate several images concurrently, within the max_concurrency limit.
+
+        Returns
+        =======
+        images : list of arrays
+            The simulated images, in the input order.
+        """
+        return list(await asyncio.gather(*[self.simulate_cvd(im, deficiency, severity) for im in images]))
+
+    async def simulate_cvd_file(self, input_image, deficiency: simulate.Deficiency, severity: float,
+                                output_path=None, format: str = 'PNG'):
+        """Decode an image, simulate it and encode the result.
+
+        Parameters
+        ==========
+        input_image : str, Path or bytes
+            Path to the image, or its encoded content.
+
+        output_path : str or Path
+            Where to save the output. If None the encoded image is returned.
+
+        format : str
+            PIL format of the output when output_path is None.
+
+        Returns
+        =======
+        output : bytes or None
+            The encoded image when output_path is None.
+        """
+        def decode():
+            source = input_image if isinstance(input_image, (str, Path)) else io.BytesIO(input_image)
+            return np.asarray(Image.open(source).convert('RGB'))
+
+        def encode(im):
+            if output_path is not None:
+                Image.fromarray(im).save(output_path)
+                return None
+            output = io.BytesIO()
+            Image.fromarray(im).save(output, format=format)
+            return output.getvalue()
+
+        async with self._get_semaphore():
+            im = await self._run(decode)
+            out = await self._simulate_tiles(im, deficiency, severity)
+            return await self._run(encode, out)
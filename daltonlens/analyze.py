@@ -0,0 +1,148 @@
+from collections import namedtuple
+from pathlib import Path
+
+import numpy as np
+
+from daltonlens import convert, simulate
+
+ConfusionScore = namedtuple('ConfusionScore', [
+    'score',                    # max of the two losses, in [0,1], 0 means no information is lost
+    'distinct_color_loss',      # fraction of the distinct colors that collapse together
+    'contrast_loss',            # weighted loss of perceptual distance between the dominant colors
+    'num_distinct_colors',      # number of distinct colors in the original image
+    'num_distinct_colors_cvd',  # number of distinct colors in the simulated image
+])
+
+def _quantized_bins(colors_uint8, bits: int):
+    shift = 8 - bits
+    q = (colors_uint8 >> shift).astype(np.int64)
+    return (q[:,0] << (2*bits)) | (q[:,1] << bits) | q[:,2]
+
+def confusion_score(image_srgb_uint8,
+                    simulator: simulate.Simulator,
+                    deficiency: simulate.Deficiency,
+                    severity: float = 1.0,
+                    max_samples: int = 65536,
+                    quantization_bits: int = 5,
+                    min_color_fraction: float = 0.001,
+                    num_dominant_colors: int = 32,
+                    distinct_delta_E: float = 10.0,
+                    seed: int = 0):
+    """Estimate how much color information is lost for a CVD viewer.
+
+    The image is summarized by a color histogram computed on a random subset
+    of its pixels, so the cost does not depend much on the image resolution.
+    Only the colors of the histogram are simulated, with simulate_cvd_palette.
+    Two measures are then computed:
+
+    - The distinct color collapse: how many of the significant histogram
+      bins end up in the same bin after the simulation.
+
+    - The contrast loss: for each pair of dominant colors that are
+      distinguishable in the original image (CIELAB distance above
+      distinct_delta_E), how much of their perceptual distance is lost after
+      the simulation. Pairs are weighted by the frequency of both colors.
+
+    Parameters
+    ==========
+    image_srgb_uint8 : array of shape (M,N,3) with dtype uint8
+        The input sRGB image.
+
+    simulator : simulate.Simulator
+        The simulator to use, e.g. simulate.Simulator_AutoSelect().
+
+    deficiency : Deficiency
+        The deficiency to evaluate.
+
+    severity : float
+        The severity between 0 (normal vision) and 1 (complete dichromacy).
+
+    max_samples : int
+        Maximum number of pixels used to compute the histogram.
+
+    quantization_bits : int
+        Number of bits per channel of the histogram bins.
+
+    min_color_fraction : float
+        Bins with less pixels than that fraction are ignored (antialiasing, noise).
+
+    num_dominant_colors : int
+        Number of most frequent colors used to compute the contrast loss.
+
+    distinct_delta_E : float
+        CIELAB distance above which two colors are considered distinct.
+
+    seed : int
+        Seed of the pixel sampling, to get reproducible scores.
+
+    Returns
+    =======
+    score : ConfusionScore
+        score is the max of distinct_color_loss and contrast_loss.
+    """
+    pixels = np.asarray(image_srgb_uint8).reshape(-1,3)
+    if pixels.shape[0] > max_samples:
+        rng = np.random.default_rng(seed)
+        pixels = pixels[rng.integers(0, pixels.shape[0], max_samples)]
+
+    # Histogram of the colors. Each bin is represented by the mean color of its pixels.
+    num_bins = 1 << (3*quantization_bits)
+    bins = _quantized_bins(pixels, quantization_bits)
+    counts = np.bincount(bins, minlength=num_bins)
+    significant_bins = np.flatnonzero(counts >= max(1, min_color_fraction*pixels.shape[0]))
+    if significant_bins.size == 0:
+        return ConfusionScore(0.0, 0.0, 0.0, 0, 0)
+    mean_colors = np.stack([np.bincount(bins, weights=pixels[:,c], minlength=num_bins)[significant_bins] for c in range(3)], axis=-1)
+    colors = np.round(mean_colors / counts[significant_bins,np.newaxis]).astype(np.uint8)
+    weights = counts[significant_bins] / np.sum(counts[significant_bins])
+
+    colors_cvd = simulator.simulate_cvd_palette(colors, deficiency, severity)
+
+    num_distinct_colors = significant_bins.size
+    num_distinct_colors_cvd = np.unique(_quantized_bins(colors_cvd, quantization_bits)).size
+    distinct_color_loss = 1.0 - num_distinct_colors_cvd / num_distinct_colors
+
+    dominant = np.argsort(-weights, kind='stable')[:num_dominant_colors]
+    linear_rgb_table = convert.linearRGB_table_from_uint8(convert.ImageEncoding.SRGB)
+    lab = convert.Lab_from_linearRGB(linear_rgb_table[colors[dominant]])
+    lab_cvd = convert.Lab_from_linearRGB(linear_rgb_table[colors_cvd[dominant]])
+    dE = convert.delta_E76(lab[:,np.newaxis,:], lab[np.newaxis,:,:])
+    dE_cvd = convert.delta_E76(lab_cvd[:,np.newaxis,:], lab_cvd[np.newaxis,:,:])
+
+    pair_weights = weights[dominant,np.newaxis] * weights[np.newaxis,dominant]
+    pair_weights = np.where(dE > distinct_delta_E, pair_weights, 0.0)
+    contrast_loss = 0.0
+    if np.sum(pair_weights) > 0:
+        with np.errstate(divide='ignore', invalid='ignore'):
+            pair_loss = np.clip((dE - dE_cvd) / dE, 0.0, 1.0)
+        contrast_loss = float(np.sum(np.nan_to_num(pair_loss) * pair_weights) / np.sum(pair_weights))
+
+    score = max(distinct_color_loss, contrast_loss)
+    return ConfusionScore(score, distinct_color_loss, contrast_loss, num_distinct_colors, num_distinct_colors_cvd)
+
+def confusion_scores(images,
+                     simulator: simulate.Simulator,
+                     deficiency: simulate.Deficiency,
+                     severity: float = 1.0,
+                     **kwargs):
+    """Batch version of confusion_score.
+
+    Parameters
+    ==========
+    images : iterable of arrays or paths
+        The images, either as sRGB uint8 arrays or as image files.
+
+    kwargs
+        Extra options passed to confusion_score.
+
+    Returns
+    =======
+    scores : list of ConfusionScore
+    """
+    scores = []
+    for im in images:
+        if isinstance(im, (str, Path)):
+            from PIL import Image
+            im = np.asarray(Image.open(im).convert('RGB'))
+        scores.append(confusion_score(im, simulator, deficiency, severity, **kwargs))
+    return scores
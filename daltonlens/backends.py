@@ -0,0 +1,448 @@
+"""Swappable implementations of the per-pixel kernels of the simulators.
+
+The simulators are written as chains of NumPy expressions, and each step
+materializes a full image. A backend provides the per-pixel kernels (transfer
+functions, 3x3 color transforms, Brettel's two-plane projection and the
+CoblisV2 chromaticity math) so they can be replaced by fused loops.
+
+- 'numpy' is the reference implementation and the default.
+- 'numba' compiles fused parallel loops with Numba, if it is installed
+  (`pip install numba`).
+
+Select a backend at runtime with:
+
+    from daltonlens import backends
+    backends.set_backend('numba')
+
+    # or only for a block of code
+    with backends.use_backend('numba'):
+        out = simulator.simulate_cvd(im, simulate.Deficiency.PROTAN, 1.0)
+
+Backends are validated against the reference on generate.rgb_span the first
+time they get selected. set_backend changes the default of the whole process,
+use_backend only the current thread or asyncio task (it is a context variable,
+copy the context to carry it to executor threads).
+"""
+
+import contextvars
+from contextlib import contextmanager
+
+import numpy as np
+
+from daltonlens import convert
+
+class NumpyBackend:
+    """Reference implementation of the kernels, with plain NumPy."""
+
+    name = 'numpy'
+
+    def linearRGB_from_encoding(self, im, encoding: convert.ImageEncoding):
+        return convert.linearRGB_from_encoding(im, encoding)
+
+    def encoding_from_linearRGB(self, im, encoding: convert.ImageEncoding):
+        return convert.encoding_from_linearRGB(im, encoding)
+
+    def apply_color_matrix(self, im, m):
+        return convert.apply_color_matrix(im, m)
+
+    def brettel_projection(self, im_linear_rgb, LMS_from_linearRGB, H1, H2, n_sep_plane, linearRGB_from_LMS):
+        """Project the LMS colors on the plane H1, or H2 when they are on the negative side of n_sep_plane."""
+        im_lms = convert.apply_color_matrix(im_linear_rgb, LMS_from_linearRGB)
+        im_H1 = convert.apply_color_matrix(im_lms, H1)
+        im_H2 = convert.apply_color_matrix(im_lms, H2)
+        H2_indices = np.dot(im_lms, np.asarray(n_sep_plane, dtype=im_lms.dtype)) < 0
+
+        # Start with H1, then overwrite the pixels that are closer to plane 2 with im_H2
+        im_H = im_H1
+        im_H[H2_indices] = im_H2[H2_indices]
+        return convert.apply_color_matrix(im_H, linearRGB_from_LMS)
+
+    def coblis_v2_dichromacy(self, im_linear_rgb, cpu: float, cpv: float, am: float, ayi: float):
+        """CoblisV2 / HCIRN projection on the confusion lines in the xy chromaticity plane."""
+        # Implementation adapted from https://github.com/jkulesza/peacock by
+        # moving it to numpy and restoring the original issue with large values.
+        # TODO: we're allocating way too many arrays.
+        # But kept it this way for clarity.
+        wx = 0.312713
+        wy = 0.329016
+        wz = 0.358271
+
+        crgb = im_linear_rgb
+        cxyz = convert.apply_color_matrix(crgb, coblis_v2_rgb2xyz)
+        cx = cxyz[...,0]
+        cy = cxyz[...,1]
+        sum_xyz = np.sum(cxyz, axis=-1)
+
+        with np.errstate(divide='ignore', invalid='ignore'):
+            cu = cx / sum_xyz
+            cv = cy / sum_xyz
+            np.nan_to_num(cu, copy=False)
+            np.nan_to_num(cv, copy=False)
+
+        nx = wx * cy / wy
+        nz = wz * cy / wy
+
+        clm = (cpv - cv) / (cpu - cu)
+        # clm[cu >= cpu] *= -1.0
+
+        clyi = cv - np.multiply(cu, clm)
+        du = np.divide((ayi - clyi), (clm - am))
+        dv = np.multiply(clm, du) + clyi
+
+        sxyz = np.zeros_like(cxyz)
+        sx = sxyz[...,0] = np.divide(np.multiply(du, cy), dv)
+        sy = sxyz[...,1] = cy
+        sz = sxyz[...,2] = np.divide(np.multiply((1.0 - (du + dv)), cy), dv)
+
+        srgb = convert.apply_color_matrix(sxyz, coblis_v2_xyz2rgb)
+
+        dxyz = np.zeros_like(sxyz)
+        dx = dxyz[...,0] = nx - sx
+        dy = dxyz[...,1] # = 0
+        dz = dxyz[...,2] = nz - sz
+
+        drgb = convert.apply_color_matrix(dxyz, coblis_v2_xyz2rgb)
+
+        adjrgb = np.zeros_like(drgb)
+        # Note: peacock fixed some issues with large values by doing drgb > 0.0 instead.
+        # It's unclear to me whether it can have drawbacks, but sticking to the original
+        # behavior that only avoids exact zero for comparison purposes.
+        with np.errstate(divide='ignore'):
+            adjrgb = np.divide((np.where(srgb < 0.0, srgb.dtype.type(0.0), srgb.dtype.type(1.0)) - srgb), drgb)
+        np.nan_to_num(adjrgb, copy=False)
+
+        adjust = adjrgb
+        adjust[np.logical_or(adjrgb > 1.0, adjrgb < 0.0)] = 0.0
+        adjust = np.amax(adjust, -1) # becomes (M,N,1) here
+        srgb = srgb + np.multiply(drgb, adjust[..., np.newaxis])
+        return srgb
+
+    # Optional fused kernel for the whole uint8 -> uint8 simulation of the
+    # piecewise linear simulators, with signature
+    # (image_srgb_uint8, encoding, T1, T2, n) -> image_srgb_uint8.
+    # See Simulator._piecewise_linear_rgb_matrices for T1, T2 and n.
+    simulate_piecewise_linear_uint8 = None
+
+coblis_v2_rgb2xyz = np.array([[0.430574, 0.341550, 0.178325],
+                              [0.222015, 0.706655, 0.071330],
+                              [0.020183, 0.129553, 0.939180]])
+
+coblis_v2_xyz2rgb = np.array([[ 3.063218, -1.393325, -0.475802],
+                              [-0.969243,  1.875966,  0.041555],
+                              [ 0.067871, -0.228834,  1.069251]])
+
+def _make_numba_backend():
+    from numba import njit, prange
+
+    # Codes of the transfer functions in the kernels.
+    LINEAR, SRGB, GAMMA_22 = 0, 1, 2
+    def transfer_code(encoding):
+        if encoding == convert.ImageEncoding.SRGB: return SRGB
+        if encoding == convert.ImageEncoding.GAMMA_22: return GAMMA_22
+        if encoding == convert.ImageEncoding.LINEAR_RGB: return LINEAR
+        # No kernel for the other transfer functions.
+        return None
+
+    kernel = njit(parallel=True, fastmath=False, error_model='numpy', cache=False)
+    scalar = njit(inline='always', error_model='numpy')
+
+    @scalar
+    def to_linear(v, code):
+        if code == SRGB:
+            return v / 12.92 if v < 0.04045 else ((v + 0.055) / 1.055) ** 2.4
+        if code == GAMMA_22:
+            return v ** 2.2
+        return v
+
+    @scalar
+    def from_linear(v, code):
+        if code == LINEAR:
+            return v
+        v = min(max(v, 0.0), 1.0)
+        if code == SRGB:
+            return v * 12.92 if v < 0.0031308 else v ** (1.0 / 2.4) * 1.055 - 0.055
+        return v ** (1.0 / 2.2)
+
+    @kernel
+    def to_linear_kernel(flat, code, out):
+        for i in prange(flat.shape[0]):
+            out[i] = to_linear(flat[i], code)
+
+    @kernel
+    def from_linear_kernel(flat, code, out):
+        for i in prange(flat.shape[0]):
+            out[i] = from_linear(flat[i], code)
+
+    @kernel
+    def color_matrix_kernel(pixels, m, out):
+        for i in prange(pixels.shape[0]):
+            r, g, b = pixels[i,0], pixels[i,1], pixels[i,2]
+            for c in range(3):
+                out[i,c] = m[c,0]*r + m[c,1]*g + m[c,2]*b
+
+    @kernel
+    def piecewise_kernel(pixels, T1, T2, n, out):
+        for i in prange(pixels.shape[0]):
+            r, g, b = np.float64(pixels[i,0]), np.float64(pixels[i,1]), np.float64(pixels[i,2])
+            T = T2 if (n[0]*r + n[1]*g + n[2]*b) < 0 else T1
+            for c in range(3):
+                out[i,c] = T[c,0]*r + T[c,1]*g + T[c,2]*b
+
+    @kernel
+    def piecewise_uint8_kernel(pixels, decode, T1, T2, n, code, out):
+        for i in prange(pixels.shape[0]):
+            r, g, b = decode[pixels[i,0]], decode[pixels[i,1]], decode[pixels[i,2]]
+            T = T2 if (n[0]*r + n[1]*g + n[2]*b) < 0 else T1
+            for c in range(3):
+                v = from_linear(T[c,0]*r + T[c,1]*g + T[c,2]*b, code)
+                out[i,c] = np.uint8(min(max(v, 0.0), 1.0) * 255.0)
+
+    @kernel
+    def coblis_v2_kernel(pixels, cpu, cpv, am, ayi, rgb2xyz, xyz2rgb, out):
+        wx = 0.312713
+        wy = 0.329016
+        wz = 0.358271
+        for i in prange(pixels.shape[0]):
+            r, g, b = np.float64(pixels[i,0]), np.float64(pixels[i,1]), np.float64(pixels[i,2])
+            cx = rgb2xyz[0,0]*r + rgb2xyz[0,1]*g + rgb2xyz[0,2]*b
+            cy = rgb2xyz[1,0]*r + rgb2xyz[1,1]*g + rgb2xyz[1,2]*b
+            cz = rgb2xyz[2,0]*r + rgb2xyz[2,1]*g + rgb2xyz[2,2]*b
+            sum_xyz = cx + cy + cz
+            cu = cx / sum_xyz
+            cv = cy / sum_xyz
+            if np.isnan(cu): cu = 0.0
+            if np.isnan(cv): cv = 0.0
+            nx = wx * cy / wy
+            nz = wz * cy / wy
+            clm = (cpv - cv) / (cpu - cu)
+            clyi = cv - cu * clm
+            du = (ayi - clyi) / (clm - am)
+            dv = clm * du + clyi
+            sx = du * cy / dv
+            sy = cy
+            sz = (1.0 - (du + dv)) * cy / dv
+            dx = nx - sx
+            dz = nz - sz
+            adjust = 0.0
+            for c in range(3):
+                s = xyz2rgb[c,0]*sx + xyz2rgb[c,1]*sy + xyz2rgb[c,2]*sz
+                d = xyz2rgb[c,0]*dx + xyz2rgb[c,2]*dz
+                a = ((0.0 if s < 0.0 else 1.0) - s) / d
+                # NaN and out of [0,1] values are ignored, like the reference.
+                if a >= 0.0 and a <= 1.0 and a > adjust:
+                    adjust = a
+                out[i,c] = s
+            for c in range(3):
+                d = xyz2rgb[c,0]*dx + xyz2rgb[c,2]*dz
+                out[i,c] = out[i,c] + d * adjust
+
+    def pixels_of(im):
+        return np.ascontiguousarray(im).reshape(-1, 3)
+
+    class NumbaBackend(NumpyBackend):
+        """Fused parallel loops compiled by Numba. Only one pass over the pixels per kernel."""
+
+        name = 'numba'
+
+        def linearRGB_from_encoding(self, im, encoding: convert.ImageEncoding):
+            if transfer_code(encoding) is None:
+                return super().linearRGB_from_encoding(im, encoding)
+            im = np.ascontiguousarray(im)
+            out = np.empty_like(im)
+            to_linear_kernel(im.reshape(-1), transfer_code(encoding), out.reshape(-1))
+            return out
+
+        def encoding_from_linearRGB(self, im, encoding: convert.ImageEncoding):
+            if transfer_code(encoding) is None:
+                return super().encoding_from_linearRGB(im, encoding)
+            im = np.ascontiguousarray(im)
+            out = np.empty_like(im)
+            from_linear_kernel(im.reshape(-1), transfer_code(encoding), out.reshape(-1))
+            return out
+
+        def apply_color_matrix(self, im, m):
+            out = np.empty(im.shape, dtype=convert._float_dtype(im))
+            color_matrix_kernel(pixels_of(im), np.ascontiguousarray(m, dtype=np.float64), out.reshape(-1, 3))
+            return out
+
+        def brettel_projection(self, im_linear_rgb, LMS_from_linearRGB, H1, H2, n_sep_plane, linearRGB_from_LMS):
+            T1 = linearRGB_from_LMS @ H1 @ LMS_from_linearRGB
+            T2 = linearRGB_from_LMS @ H2 @ LMS_from_linearRGB
+            n = n_sep_plane @ LMS_from_linearRGB
+            out = np.empty(im_linear_rgb.shape, dtype=convert._float_dtype(im_linear_rgb))
+            piecewise_kernel(pixels_of(im_linear_rgb), T1, T2, n, out.reshape(-1, 3))
+            return out
+
+        def coblis_v2_dichromacy(self, im_linear_rgb, cpu: float, cpv: float, am: float, ayi: float):
+            out = np.empty(im_linear_rgb.shape, dtype=convert._float_dtype(im_linear_rgb))
+            coblis_v2_kernel(pixels_of(im_linear_rgb), cpu, cpv, am, ayi,
+                             coblis_v2_rgb2xyz, coblis_v2_xyz2rgb, out.reshape(-1, 3))
+            return out
+
+        def simulate_piecewise_linear_uint8(self, image_srgb_uint8, encoding: convert.ImageEncoding, T1, T2, n):
+            decode = convert.linearRGB_table_from_uint8(encoding).astype(np.float64)
+            T1 = np.ascontiguousarray(T1, dtype=np.float64)
+            T2 = T1 if T2 is None else np.ascontiguousarray(T2, dtype=np.float64)
+            n = np.zeros(3) if n is None else np.ascontiguousarray(n, dtype=np.float64)
+            out = np.empty(image_srgb_uint8.shape, dtype=np.uint8)
+            piecewise_uint8_kernel(pixels_of(image_srgb_uint8), decode, T1, T2, n, transfer_code(encoding), out.reshape(-1, 3))
+            return out
+
+    return NumbaBackend()
+
+# name -> function that creates the backend. It may raise ImportError if a dependency is missing.
+_backend_factories = {
+    'numpy': NumpyBackend,
+    'numba': _make_numba_backend,
+}
+_backends = {}
+# name -> max error found by validate_backend.
+_max_errors = {}
+# Process-wide selection of set_backend, None means 'numpy'.
+_default = None
+# Selection of use_backend, overrides the default in its context.
+_override = contextvars.ContextVar('daltonlens_backend', default=None)
+
+def register_backend(name: str, factory):
+    """Register a new backend.
+
+    Parameters
+    ==========
+    name : str
+        Name to select it with set_backend.
+
+    factory : callable
+        Returns the backend instance, an object with the same methods as
+        NumpyBackend. It should raise ImportError if the backend can't be
+        used in this environment.
+    """
+    _backend_factories[name] = factory
+    _backends.pop(name, None)
+    _max_errors.pop(name, None)
+
+def unregister_backend(name: str):
+    """Remove a backend added with register_backend.
+
+    If it was selected with set_backend, the process goes back to 'numpy'.
+    """
+    global _default
+    if name == 'numpy':
+        raise ValueError("The 'numpy' reference backend can't be unregistered")
+    _backend_factories.pop(name, None)
+    backend = _backends.pop(name, None)
+    _max_errors.pop(name, None)
+    if backend is not None and _default is backend:
+        _default = None
+
+def get_backend(name: str = None):
+    """Return the backend with the given name, or the current one if name is None.
+
+    Raises ImportError if the backend dependencies are not installed.
+    """
+    if name is None:
+        return current()
+    if name not in _backend_factories:
+        raise ValueError(f"Unknown backend '{name}', the registered ones are {list(_backend_factories.keys())}")
+    if name not in _backends:
+        _backends[name] = _backend_factories[name]()
+    return _backends[name]
+
+def available_backends():
+    """Return the names of the backends that can be used in this environment."""
+    names = []
+    for name in _backend_factories:
+        try:
+            get_backend(name)
+            names.append(name)
+        except ImportError:
+            pass
+    return names
+
+def current():
+    """Return the currently selected backend."""
+    global _default
+    backend = _override.get()
+    if backend is not None:
+        return backend
+    if _default is None:
+        _default = get_backend('numpy')
+    return _default
+
+def validate_backend(backend):
+    """Compare a backend with the NumPy reference on generate.rgb_span.
+
+    Every simulator, deficiency and a couple of severities are compared
+    on the uint8 outputs. The backend is only used by the comparison, the
+    selected one does not change, even for the other threads.
+
+    Returns
+    =======
+    max_error : int
+        The maximum difference with the reference.
+    """
+    return contextvars.copy_context().run(_max_error_vs_reference, backend)
+
+def _max_error_vs_reference(backend):
+    from daltonlens import generate, simulate
+    im = generate.rgb_span(27*4, 27*4)
+    simulators = [
+        simulate.Simulator_Vienot1999(),
+        simulate.Simulator_Brettel1997(),
+        simulate.Simulator_Vischeck(),
+        simulate.Simulator_Machado2009(),
+        simulate.Simulator_CoblisV1(),
+        simulate.Simulator_CoblisV2(),
+    ]
+    reference = get_backend('numpy')
+    max_error = 0
+    for simulator in simulators:
+        for deficiency in simulate.Deficiency:
+            for severity in [0.55, 1.0]:
+                _override.set(reference)
+                out_ref = simulator.simulate_cvd(im, deficiency, severity)
+                _override.set(backend)
+                out = simulator.simulate_cvd(im, deficiency, severity)
+                max_error = max(max_error, int(np.max(np.abs(out.astype(int) - out_ref))))
+    return max_error
+
+def _checked_backend(name: str, validate: bool, tolerance: int):
+    """get_backend, validated the first time if asked, see set_backend."""
+    backend = get_backend(name)
+    if validate and name != 'numpy':
+        if name not in _max_errors:
+            _max_errors[name] = validate_backend(backend)
+        if _max_errors[name] > tolerance:
+            raise RuntimeError(f"The '{name}' backend does not match the reference, max error = {_max_errors[name]} > {tolerance}")
+    return backend
+
+def set_backend(name: str, validate: bool = True, tolerance: int = 1):
+    """Select the backend used by all the simulators of the process.
+
+    Parameters
+    ==========
+    name : str
+        'numpy', 'numba', or any backend added with register_backend.
+
+    validate : bool
+        Check the backend against the reference with validate_backend the
+        first time it gets selected, and raise a RuntimeError if it does
+        not match.
+
+    tolerance : int
+        Maximum difference with the reference on the uint8 outputs for
+        the backend to be valid.
+    """
+    global _default
+    _default = _checked_backend(name, validate, tolerance)
+
+@contextmanager
+def use_backend(name: str, validate: bool = True, tolerance: int = 1):
+    """Context manager to select a backend in the current context only, see set_backend.
+
+    The other threads and asyncio tasks keep their backend.
+    """
+    token = _override.set(_checked_backend(name, validate, tolerance))
+    try:
+        yield _override.get()
+    finally:
+        _override.reset(token)
@@ -0,0 +1,219 @@
+"""Content-addressed cache of simulation results.
+
+Results are keyed by a BLAKE2b hash of the input content (image pixels or
+encoded file bytes) and of everything that defines the simulation, so the
+same image processed twice with the same parameters is only simulated once,
+whatever its file name:
+
+    cache = ResultCache(cache_dir="/tmp/daltonlens")
+    simulator = CachedSimulator(simulate.Simulator_Machado2009(), cache)
+    out = simulator.simulate_cvd(im, simulate.Deficiency.DEUTAN, 1.0)
+    print(cache.stats())
+"""
+
+import hashlib
+import os
+import tempfile
+import threading
+from collections import OrderedDict
+from pathlib import Path
+
+import numpy as np
+
+from daltonlens import backends, lut, simulate
+
+# Bump this when the key derivation or the content of the entries changes.
+RESULT_CACHE_FORMAT_VERSION = 1
+
+def content_digest(content):
+    """Return the hex BLAKE2b digest of bytes or of an array (pixels, shape and dtype)."""
+    h = hashlib.blake2b(digest_size=20)
+    if isinstance(content, np.ndarray):
+        h.update(f"{content.dtype.str}{content.shape}".encode())
+        content = np.ascontiguousarray(content)
+    h.update(memoryview(content).cast('B'))
+    return h.hexdigest()
+
+def _entry_size(value):
+    return value.nbytes if isinstance(value, np.ndarray) else len(value)
+
+class ResultCache:
+    """Two-tier LRU cache of simulation results.
+
+    Entries are either arrays or bytes (e.g. encoded image files). The
+    in-memory tier keeps at most max_memory_bytes of entries. When a
+    cache_dir is given, entries are also stored on disk (.npy for arrays,
+    raw files for bytes) in a folder specific to the package version, and
+    the least recently used files are deleted when the total goes above
+    max_disk_bytes. The folders of the other versions are deleted once they
+    were not used for lut.STALE_VERSION_SECONDS. Writes to disk are atomic, so several processes can
+    share the same folder. All the methods are thread-safe.
+    """
+
+    def __init__(self, max_memory_bytes: int = 256 << 20, cache_dir=None, max_disk_bytes: int = 1 << 30):
+        self.max_memory_bytes = max_memory_bytes
+        self.max_disk_bytes = max_disk_bytes
+        self.cache_dir = None
+        if cache_dir is not None:
+            self.cache_dir = lut._versioned_cache_dir(Path(cache_dir), 'results', RESULT_CACHE_FORMAT_VERSION)
+        self._entries = OrderedDict()
+        self._memory_bytes = 0
+        self._lock = threading.Lock()
+        self._stats = dict(memory_hits=0, disk_hits=0, misses=0, evictions=0)
+
+    def key(self, content, simulator: simulate.Simulator, deficiency: simulate.Deficiency, severity: float, **options):
+        """Return the cache key of a simulation.
+
+        Parameters
+        ==========
+        content : bytes or array
+            The input image, as pixels or as the bytes of its file.
+
+        simulator, deficiency, severity
+            The simulation parameters.
+
+        options
+            Anything else that changes the result (precision, output format, ...).
+        """
+        description = f"{RESULT_CACHE_FORMAT_VERSION}:{lut.simulator_fingerprint(simulator)}:{deficiency.name}:{float(severity)!r}"
+        description += ''.join(f":{name}={value!r}" for name, value in sorted(options.items()))
+        return content_digest(content) + content_digest(description.encode())[:20]
+
+    def get(self, key: str):
+        """Return the cached array or bytes, or None if the key is not in the cache.
+
+        Arrays are read-only, copy them before modifying them.
+        """
+        with self._lock:
+            value = self._entries.get(key)
+            if value is not None:
+                self._entries.move_to_end(key)
+                self._stats['memory_hits'] += 1
+                return value
+
+        value = self._load(key)
+        with self._lock:
+            if value is None:
+                self._stats['misses'] += 1
+                return None
+            self._stats['disk_hits'] += 1
+            self._insert(key, value)
+        return value
+
+    def put(self, key: str, value):
+        """Store an array or bytes in the cache. Arrays are stored without a copy and made read-only."""
+        if isinstance(value, np.ndarray):
+            value.flags.writeable = False
+        with self._lock:
+            self._insert(key, value)
+        if self.cache_dir is not None:
+            self._save(key, value)
+            self._evict_disk()
+
+    def stats(self):
+        """Return the hit/miss counters and the current size of the cache."""
+        with self._lock:
+            stats = dict(self._stats)
+            stats['hits'] = stats['memory_hits'] + stats['disk_hits']
+            stats['memory_entries'] = len(self._entries)
+            stats['memory_bytes'] = self._memory_bytes
+        lookups = stats['hits'] + stats['misses']
+        stats['hit_rate'] = stats['hits'] / lookups if lookups > 0 else 0.0
+        return stats
+
+    def clear(self):
+        """Remove all the entries, in memory and on disk."""
+        with self._lock:
+            self._entries.clear()
+            self._memory_bytes = 0
+        if self.cache_dir is not None:
+            for path in self.cache_dir.iterdir():
+                lut._unlink_if_exists(path)
+
+    def _insert(self, key: str, value):
+        size = _entry_size(value)
+        if size > self.max_memory_bytes:
+            return
+        if key in self._entries:
+            self._memory_bytes -= _entry_size(self._entries.pop(key))
+        self._entries[key] = value
+        self._memory_bytes += size
+        while self._memory_bytes > self.max_memory_bytes:
+            _, evicted = self._entries.popitem(last=False)
+            self._memory_bytes -= _entry_size(evicted)
+            self._stats['evictions'] += 1
+
+    def _load(self, key: str):
+        if self.cache_dir is None:
+            return None
+        for suffix in ['.npy', '.bin']:
+            path = self.cache_dir / (key + suffix)
+            try:
+                if suffix == '.npy':
+                    value = np.load(path)
+                    value.flags.writeable = False
+                else:
+                    value = path.read_bytes()
+                # Refresh the modification time, it's what the LRU eviction uses.
+                os.utime(path)
+                return value
+            except (FileNotFoundError, ValueError):
+                continue
+        return None
+
+    def _save(self, key: str, value):
+        is_array = isinstance(value, np.ndarray)
+        path = self.cache_dir / (key + ('.npy' if is_array else '.bin'))
+        fd, tmp_path = tempfile.mkstemp(dir=self.cache_dir, suffix='.tmp')
+        try:
+            with os.fdopen(fd, 'wb') as f:
+                if is_array:
+                    np.save(f, value)
+                else:
+                    f.write(value)
+            os.replace(tmp_path, path)
+        except BaseException:
+            lut._unlink_if_exists(Path(tmp_path))
+            raise
+
+    def _evict_disk(self):
+        entries = []
+        for path in self.cache_dir.iterdir():
+            if path.suffix not in ['.npy', '.bin']:
+                continue
+            try:
+                st = path.stat()
+            except FileNotFoundError: # removed by another process
+                continue
+            entries.append((st.st_mtime, st.st_size, path))
+        total_size = sum(size for _, size, _ in entries)
+        # Oldest first.
+        for _, size, path in sorted(entries):
+            if total_size <= self.max_disk_bytes:
+                break
+            lut._unlink_if_exists(path)
+            total_size -= size
+            with self._lock:
+                self._stats['evictions'] += 1
+
+class CachedSimulator:
+    """Memoize the simulate_cvd calls of a simulator in a ResultCache.
+
+    The simulations of an image that is already in the cache only cost a
+    hash of its pixels and a copy of the cached result.
+    """
+
+    def __init__(self, simulator: simulate.Simulator, cache: ResultCache = None):
+        self.simulator = simulator
+        self.cache = cache if cache is not None else ResultCache()
+
+    def simulate_cvd(self, image_srgb_uint8, deficiency: simulate.Deficiency, severity: float, max_unique_colors: int = 0, precision: str = 'float32'):
+        """Same as Simulator.simulate_cvd, going through the cache."""
+        # The backends can differ from the reference by 1 level.
+        key = self.cache.key(image_srgb_uint8, self.simulator, deficiency, severity, precision=precision,
+                             backend=backends.current().name)
+        out = self.cache.get(key)
+        if out is None:
+            out = self.simulator.simulate_cvd(image_srgb_uint8, deficiency, severity, max_unique_colors, precision)
+            self.cache.put(key, out)
+        return out.copy()
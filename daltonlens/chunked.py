@@ -0,0 +1,72 @@
+"""Simulation of chunked Dask (and xarray) arrays.
+
+All the simulators are pointwise, so a chunked image can be simulated block
+by block with map_blocks, lazily and on as many workers as available:
+
+    import dask.array as da
+    im = da.from_zarr("archive.zarr")  # (..., 3) uint8
+    out = simulator.simulate_cvd(im, simulate.Deficiency.DEUTAN, 1.0)
+    out.to_zarr("archive_deutan.zarr")
+
+Simulator.simulate_cvd dispatches to simulate_cvd_chunked automatically for
+Dask arrays and xarray DataArrays. Dask is only imported when needed
+(`pip install dask[array]`).
+"""
+
+import numpy as np
+
+def is_dask_array(image):
+    return type(image).__module__.startswith('dask.')
+
+def is_xarray(image):
+    return type(image).__module__.startswith('xarray.')
+
+def _simulate_block(block, compiled, max_unique_colors: int, precision: str, layout: str, channel_order: str):
+    return compiled.simulate_cvd(block, max_unique_colors=max_unique_colors, precision=precision,
+                                 layout=layout, channel_order=channel_order)
+
+def simulate_cvd_chunked(image, simulator, deficiency, severity: float, max_unique_colors: int = 0, precision: str = 'float32',
+                         layout: str = 'HWC', channel_order: str = 'RGB'):
+    """Lazily simulate a chunked image, block by block.
+
+    The simulator is compiled once (see Simulator.compile) and the result
+    is a single node of the task graph shared by all the blocks, so it
+    only gets sent once per worker instead of once per task. The output is
+    the one of CompiledSimulation.simulate_cvd on the whole image.
+
+    Parameters
+    ==========
+    image : dask array or xarray.DataArray of shape (...,3) with dtype uint8
+        The input sRGB image(s). The chunks can have any shape, except along
+        the channel axis that gets rechunked to hold the 3 channels.
+
+    simulator : simulate.Simulator
+        The simulator to use.
+
+    deficiency, severity, max_unique_colors, precision, layout, channel_order
+        See Simulator.simulate_cvd.
+
+    Returns
+    =======
+    im : array of the same type and shape as image, with dtype uint8
+        The lazy simulated image. Call compute() or store it to run the
+        simulation.
+    """
+    import dask
+
+    if is_xarray(image):
+        return image.copy(data=simulate_cvd_chunked(image.data, simulator, deficiency, severity, max_unique_colors, precision,
+                                                    layout, channel_order))
+
+    if not is_dask_array(image):
+        import dask.array as da
+        image = da.from_array(np.asarray(image))
+
+    # simulate imports this module.
+    from daltonlens.simulate import channel_axis_of_layout
+
+    compiled = dask.delayed(simulator.compile(deficiency, severity), pure=True)
+    image = image.rechunk({image.ndim + channel_axis_of_layout(layout): 3})
+    dtype = simulator._output_dtype(image.dtype)
+    meta = np.empty((0,) * image.ndim, dtype=dtype)
+    return image.map_blocks(_simulate_block, compiled, max_unique_colors, precision, layout, channel_order, dtype=dtype, meta=meta)
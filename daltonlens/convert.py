@@ -2,11 +2,19 @@ import math
 import numpy as np
 
 from enum import Enum
+from functools import lru_cache
 
 class ImageEncoding(Enum):
     SRGB = 0
     LINEAR_RGB = 1 # assume the image is already in linearRGB and don't apply any transform
     GAMMA_22 = 2 # gamma of 2.2 (old CRTs, before the sRGB standard)
+    PQ = 3 # SMPTE ST 2084 perceptual quantizer of HDR10. Linear 1.0 is 10000 cd/m².
+    HLG = 4 # Hybrid Log-Gamma of ITU-R BT.2100, scene-referred (no OOTF).
+
+# These transfer functions are expensive to evaluate, so the simulators go
+# through lookup tables (linearRGB_table_from_uint8 and
+# uint8_table_from_linearRGB_float16) instead of calling them on each pixel.
+HDR_ENCODINGS = (ImageEncoding.PQ, ImageEncoding.HLG)
 
 def as_uint8(im):
     """Multiply by 255 and cast the float image to uint8"""
@@ -16,6 +24,10 @@ def as_float32(im):
     """Divide by 255 and cast the uint8 image to float32"""
     return im.astype(np.float32)/255.0
 
+def as_uint16(im):
+    """Multiply by 65535 and cast the float image to uint16"""
+    return (np.clip(im,0.,1.0)*65535.0).astype(np.uint16)
+
 def linearRGB_from_gamma22(im):
     """Gamma correction for old PCs/CRT monitors"""
     return np.power(im, 2.2)
@@ -96,23 +108,221 @@ def sRGB_from_linearRGB(im):
     out[large_mask] = np.power(im[large_mask], 1.0 / 2.4) * 1.055 - 0.055
     return out
 
-def apply_color_matrix(im, m):
+# SMPTE ST 2084 constants.
+_PQ_M1 = 2610.0 / 16384.0
+_PQ_M2 = 2523.0 / 4096.0 * 128.0
+_PQ_C1 = 3424.0 / 4096.0
+_PQ_C2 = 2413.0 / 4096.0 * 32.0
+_PQ_C3 = 2392.0 / 4096.0 * 32.0
+
+def linearRGB_from_pq(im):
+    """SMPTE ST 2084 (PQ) EOTF, the output is normalized so that 1.0 is 10000 cd/m²."""
+    e = np.power(np.clip(im, 0., 1.), 1.0 / _PQ_M2)
+    return np.power(np.maximum(e - _PQ_C1, 0.) / (_PQ_C2 - _PQ_C3 * e), 1.0 / _PQ_M1)
+
+def pq_from_linearRGB(im):
+    """Inverse of linearRGB_from_pq."""
+    lm = np.power(np.clip(im, 0., 1.), _PQ_M1)
+    return np.power((_PQ_C1 + _PQ_C2 * lm) / (1.0 + _PQ_C3 * lm), _PQ_M2)
+
+# ITU-R BT.2100 HLG constants.
+_HLG_A = 0.17883277
+_HLG_B = 1.0 - 4.0 * _HLG_A
+_HLG_C = 0.5 - _HLG_A * math.log(4.0 * _HLG_A)
+
+def linearRGB_from_hlg(im):
+    """ITU-R BT.2100 HLG inverse OETF, from the signal to the normalized scene light."""
+    im = np.clip(im, 0., 1.)
+    return np.where(im <= 0.5, im * im / 3.0, (np.exp((np.maximum(im, 0.5) - _HLG_C) / _HLG_A) + _HLG_B) / 12.0).astype(im.dtype)
+
+def hlg_from_linearRGB(im):
+    """ITU-R BT.2100 HLG OETF, inverse of linearRGB_from_hlg."""
+    im = np.clip(im, 0., 1.)
+    return np.where(im <= 1.0 / 12.0, np.sqrt(3.0 * im), _HLG_A * np.log(np.maximum(12.0 * im - _HLG_B, 1.0 - _HLG_B)) + _HLG_C).astype(im.dtype)
+
+def linearRGB_from_encoding(im, encoding: ImageEncoding):
+    """Remove the transfer function of the given encoding.
+
+    Parameters
+    ==========
+    im : array of shape (...,3) with dtype float
+        The input image, normalized between [0,1]
+
+    encoding : ImageEncoding
+        The encoding of the input values.
+
+    Returns
+    =======
+    im : array of shape (...,3) with dtype float
+        The output linear RGB image
+    """
+    if encoding == ImageEncoding.SRGB:
+        return linearRGB_from_sRGB(im)
+    if encoding == ImageEncoding.GAMMA_22:
+        return linearRGB_from_gamma22(im)
+    if encoding == ImageEncoding.PQ:
+        return linearRGB_from_pq(im)
+    if encoding == ImageEncoding.HLG:
+        return linearRGB_from_hlg(im)
+    return im
+
+def encoding_from_linearRGB(im, encoding: ImageEncoding):
+    """Apply the transfer function of the given encoding to a linear RGB image.
+
+    This is the inverse of linearRGB_from_encoding.
+    """
+    if encoding == ImageEncoding.SRGB:
+        return sRGB_from_linearRGB(im)
+    if encoding == ImageEncoding.GAMMA_22:
+        return gamma22_from_linearRGB(im)
+    if encoding == ImageEncoding.PQ:
+        return pq_from_linearRGB(im)
+    if encoding == ImageEncoding.HLG:
+        return hlg_from_linearRGB(im)
+    return im
+
+@lru_cache(maxsize=None)
+def linearRGB_table_from_uint8(encoding: ImageEncoding):
+    """Lookup table with the linear RGB float32 value of each uint8 code value.
+
+    Indexing this table with a uint8 image gives the same result as
+    linearRGB_from_encoding(as_float32(im), encoding), without evaluating the
+    transfer function for every pixel. The returned array is shared, do not
+    modify it.
+    """
+    table = linearRGB_from_encoding(as_float32(np.arange(256, dtype=np.uint8)), encoding)
+    table.flags.writeable = False
+    return table
+
+@lru_cache(maxsize=None)
+def linearRGB_table_from_uint16(encoding: ImageEncoding):
+    """Lookup table with the linear RGB float32 value of each uint16 code value.
+
+    Same as linearRGB_table_from_uint8 for 16-bit images with the code values
+    scaled to [0,65535], e.g. 10 or 12-bit HDR video. It has 65536 entries
+    (256 KB).
+    """
+    table = linearRGB_from_encoding(np.arange(65536, dtype=np.float32) / np.float32(65535.0), encoding)
+    table.flags.writeable = False
+    return table
+
+# Scale of the 16-bit fixed-point linear RGB values: 1.0 maps to 65535.
+LINEAR_UINT16_SCALE = 65535
+
+@lru_cache(maxsize=None)
+def linearRGB_uint16_table_from_uint8(encoding: ImageEncoding):
+    """Lookup table with the 16-bit fixed-point linear RGB value of each uint8 code value.
+
+    Same as linearRGB_table_from_uint8, but scaled by LINEAR_UINT16_SCALE and
+    rounded to uint16. 16 bits are needed to keep the dark sRGB values apart.
+    """
+    table = np.round(linearRGB_table_from_uint8(encoding).astype(np.float64) * LINEAR_UINT16_SCALE).astype(np.uint16)
+    table.flags.writeable = False
+    return table
+
+@lru_cache(maxsize=None)
+def uint8_table_from_linearRGB_uint16(encoding: ImageEncoding):
+    """Lookup table to encode 16-bit fixed-point linear RGB values to uint8.
+
+    The 65536 entries follow as_uint8(encoding_from_linearRGB(v/LINEAR_UINT16_SCALE)).
+    """
+    linear = np.arange(65536, dtype=np.float32) / LINEAR_UINT16_SCALE
+    table = as_uint8(encoding_from_linearRGB(linear, encoding))
+    table.flags.writeable = False
+    return table
+
+@lru_cache(maxsize=None)
+def uint8_table_from_linearRGB_float16(encoding: ImageEncoding):
+    """Lookup table to encode float16 linear RGB values to uint8.
+
+    The table is indexed by the bit pattern of the float16 values, i.e.
+    table[im.view(np.uint16)]. Out of range values are clipped and NaN
+    becomes 0.
+    """
+    linear = np.arange(65536, dtype=np.uint32).astype(np.uint16).view(np.float16).astype(np.float32)
+    linear = np.nan_to_num(np.clip(linear, 0.0, 1.0), nan=0.0)
+    table = as_uint8(encoding_from_linearRGB(linear, encoding))
+    table.flags.writeable = False
+    return table
+
+def sRGB_uint8_from_hexstrings(colors):
+    """Parse a list of hex color strings.
+
+    Parameters
+    ==========
+    colors : list of str
+        Colors like '#ff8000' or the short form '#f80'. The leading '#' is optional.
+
+    Returns
+    =======
+    colors : array of shape (N,3) with dtype uint8
+        The sRGB colors.
+    """
+    colors = [c.lstrip('#') for c in colors]
+    # Fast path for the common case where everything uses the long form.
+    # bytes.fromhex parses everything at once.
+    if all(len(c) == 6 for c in colors):
+        return np.frombuffer(bytes.fromhex(''.join(colors)), dtype=np.uint8).reshape(-1,3)
+    long_colors = []
+    for c in colors:
+        if len(c) == 3:
+            c = c[0]*2 + c[1]*2 + c[2]*2
+        elif len(c) != 6:
+            raise ValueError(f"Invalid hex color '#{c}'")
+        long_colors.append(c)
+    return np.frombuffer(bytes.fromhex(''.join(long_colors)), dtype=np.uint8).reshape(-1,3)
+
+def hexstrings_from_sRGB_uint8(colors):
+    """Format an array of sRGB colors as '#rrggbb' strings.
+
+    Parameters
+    ==========
+    colors : array of shape (N,3) with dtype uint8
+
+    Returns
+    =======
+    colors : list of str
+    """
+    h = np.ascontiguousarray(colors, dtype=np.uint8).tobytes().hex()
+    return ['#' + h[i:i+6] for i in range(0, len(h), 6)]
+
+def uint8_from_linearRGB_float16_table(im, encoding: ImageEncoding):
+    """Encode a linear RGB image to uint8 with uint8_table_from_linearRGB_float16.
+
+    Stays within 1 level of as_uint8(encoding_from_linearRGB(im, encoding)),
+    without evaluating the transfer function for every pixel.
+    """
+    return uint8_table_from_linearRGB_float16(encoding)[np.asarray(im).astype(np.float16).view(np.uint16)]
+
+def apply_color_matrix(im, m, channel_axis: int = -1):
     """Transform a color array with the given 3x3 matrix.
 
     Parameters
     ==========
     im : array of shape (...,3)
         Can be an image or a 1D array, as long as the last
-        dimension is a 3-channels color.
+        dimension (or channel_axis) is a 3-channels color.
 
     m : array of shape (3,3)
         Color matrix to apply.
 
+    channel_axis : int
+        Axis of the color channels. With planar images, e.g. (3,M,N), the
+        matrix is applied to the planes directly, without transposing them.
+
     Returns
     =======
     im : array of shape (...,3)
         Output array, where each input color vector was multiplied by m.
+        Float inputs keep their dtype, the matrix is cast to it.
     """
+    m = np.asarray(m, dtype=_float_dtype(im))
+    channel_axis = channel_axis % im.ndim
+    if channel_axis != im.ndim - 1:
+        # m @ (...,3,K) with the pixels of each plane flattened in K.
+        planes = im.reshape(im.shape[:channel_axis + 1] + (-1,))
+        return (m @ planes).reshape(im.shape)
+
     # Another option is np.einsum('ij, ...j', m, im), but it can be much
     # slower, especially on on float32 types because the matrix multiplication
     # is heavily optimized.
@@ -418,3 +628,232 @@ def compute_XYZ_from_linearRGB_with_primaries(r_xy, g_xy, b_xy, w_xy):
     ])
 
     return XYZ_from_linearRGB
+
+# Chromaticities of the red, green and blue primaries and of the white point
+# of the standard RGB color spaces, to use with compute_XYZ_from_linearRGB_with_primaries.
+RGB_PRIMARIES_BT709 = ([0.64, 0.33], [0.30, 0.60], [0.15, 0.06], [0.3127, 0.3290])
+RGB_PRIMARIES_DISPLAY_P3 = ([0.680, 0.320], [0.265, 0.690], [0.150, 0.060], [0.3127, 0.3290])
+RGB_PRIMARIES_BT2020 = ([0.708, 0.292], [0.170, 0.797], [0.131, 0.046], [0.3127, 0.3290])
+
+XYZ_from_linearRGB_DisplayP3 = compute_XYZ_from_linearRGB_with_primaries(*RGB_PRIMARIES_DISPLAY_P3)
+XYZ_from_linearRGB_BT2020 = compute_XYZ_from_linearRGB_with_primaries(*RGB_PRIMARIES_BT2020)
+
+class LMSModel_SmithPokorny75_WithPrimaries (LMSModel):
+    """LMS model of (Smith & Pokorny, 1975) for a display with any primaries.
+
+    This follows the derivation of XYZJuddVos_from_linearRGB_BT709 by Viénot
+    et al.: the chromaticities of the primaries and white point get the
+    Judd-Vos correction, and the RGB to XYZ matrix is rebuilt from them.
+    With the BT.709 primaries this gives back LMSModel_sRGB_SmithPokorny75.
+
+    The simulators that take an LMS model directly work on the linear RGB
+    of that display, so wide-gamut images do not need to be converted to
+    sRGB first, and that costs nothing per pixel. Set the imageEncoding
+    of the simulator to the transfer function of the images.
+    """
+
+    def __init__(self, r_xy, g_xy, b_xy, w_xy):
+        judd_vos_xy = [xy_vos1978_from_xy_CIE1931(*xy) for xy in (r_xy, g_xy, b_xy, w_xy)]
+        super().__init__(compute_XYZ_from_linearRGB_with_primaries(*judd_vos_xy),
+                         LMS_from_XYZJuddVos_Smith_Pokorny_1975,
+                         usesJuddVosXYZ=True)
+
+class LMSModel_DisplayP3_SmithPokorny75 (LMSModel_SmithPokorny75_WithPrimaries):
+    """(Smith & Pokorny, 1975) for Display P3 images (DCI-P3 primaries, D65 white).
+
+    Display P3 uses the sRGB transfer function, so the default SRGB
+    imageEncoding of the simulators is right.
+    """
+
+    def __init__(self):
+        super().__init__(*RGB_PRIMARIES_DISPLAY_P3)
+
+class LMSModel_BT2020_SmithPokorny75 (LMSModel_SmithPokorny75_WithPrimaries):
+    """(Smith & Pokorny, 1975) for ITU-R BT.2020 / BT.2100 images.
+
+    HDR images usually use the ImageEncoding.PQ or ImageEncoding.HLG
+    transfer functions.
+    """
+
+    def __init__(self):
+        super().__init__(*RGB_PRIMARIES_BT2020)
+
+# CIE standard illuminant D65, used as the white point of sRGB.
+XYZ_D65 = XYZ_from_xyY(np.array([0.3127, 0.3290, 1.0]))
+
+def _float_dtype(im):
+    """Keep float32/float64 inputs as is, compute everything else in float64."""
+    return im.dtype if np.issubdtype(im.dtype, np.floating) else np.float64
+
+def XYZ_from_linearRGB(im, XYZ_from_linearRGB_matrix = XYZ_from_linearRGB_BT709, out=None):
+    """Convert linear RGB colors to CIE XYZ.
+
+    Parameters
+    ==========
+    im : array of shape (...,3) with dtype float
+        The input linear RGB colors.
+
+    XYZ_from_linearRGB_matrix : array of shape (3,3)
+        The conversion matrix, sRGB / BT.709 by default.
+
+    out : array of shape (...,3), optional
+        Output buffer. Must not be the input array.
+
+    Returns
+    =======
+    XYZ : array of shape (...,3)
+        The XYZ colors, with the same float dtype as the input.
+    """
+    im = np.asarray(im)
+    m = np.asarray(XYZ_from_linearRGB_matrix, dtype=_float_dtype(im))
+    return np.matmul(im, m.T, out=out)
+
+def Lab_from_XYZ(XYZ, white_XYZ = XYZ_D65, out=None):
+    """Convert CIE XYZ colors to CIE L*a*b*.
+
+    Parameters
+    ==========
+    XYZ : array of shape (...,3) with dtype float
+        The input XYZ colors, with Y=1 for the white.
+
+    white_XYZ : array of shape (3)
+        The reference white, D65 by default.
+
+    out : array of shape (...,3), optional
+        Output buffer. It can be the input array.
+
+    Returns
+    =======
+    Lab : array of shape (...,3)
+        L* in [0,100], a* and b* roughly in [-128,128], with the same float
+        dtype as the input.
+    """
+    XYZ = np.asarray(XYZ)
+    dtype = _float_dtype(XYZ)
+    f = XYZ / np.asarray(white_XYZ, dtype=dtype)
+    delta = 6.0/29.0
+    small = f <= delta**3
+    f_small = f[small] / (3.0*delta*delta) + 4.0/29.0
+    np.cbrt(f, out=f)
+    f[small] = f_small
+
+    if out is None:
+        out = np.empty(XYZ.shape, dtype=dtype)
+    fx, fy, fz = f[...,0], f[...,1], f[...,2]
+    L, a, b = out[...,0], out[...,1], out[...,2]
+    np.multiply(fy, 116.0, out=L)
+    L -= 16.0
+    np.subtract(fx, fy, out=a)
+    a *= 500.0
+    np.subtract(fy, fz, out=b)
+    b *= 200.0
+    return out
+
+def Lab_from_linearRGB(im, out=None):
+    """Convert linear sRGB (BT.709 primaries) to CIE L*a*b* with a D65 white point.
+
+    Parameters
+    ==========
+    im : array of shape (...,3) with dtype float
+        The input linear RGB colors.
+
+    out : array of shape (...,3), optional
+        Output buffer. Must not be the input array.
+
+    Returns
+    =======
+    Lab : array of shape (...,3)
+        L* in [0,100], a* and b* roughly in [-128,128], with the same float
+        dtype as the input.
+    """
+    XYZ = XYZ_from_linearRGB(im, out=out)
+    return Lab_from_XYZ(XYZ, out=XYZ)
+
+def delta_E76(Lab1, Lab2, out=None):
+    """CIE 1976 color difference, the euclidean distance in L*a*b*.
+
+    Parameters
+    ==========
+    Lab1, Lab2 : arrays of shape (...,3)
+        The colors to compare. The shapes are broadcast, so an (N,1,3) and
+        a (1,N,3) array give all the pairwise distances.
+
+    out : array of shape (...), optional
+        Output buffer.
+
+    Returns
+    =======
+    dE : array of shape (...)
+    """
+    d = np.subtract(Lab1, Lab2)
+    d *= d
+    return np.sqrt(np.sum(d, axis=-1, out=out), out=out)
+
+def delta_E2000(Lab1, Lab2, out=None):
+    """CIEDE2000 color difference.
+
+    Implementation of the formulas from Sharma, Wu and Dalal, 'The CIEDE2000
+    color-difference formula: Implementation notes, supplementary test data,
+    and mathematical observations' (2005), with kL = kC = kH = 1.
+
+    Parameters
+    ==========
+    Lab1, Lab2 : arrays of shape (...,3)
+        The colors to compare, broadcast like delta_E76.
+
+    out : array of shape (...), optional
+        Output buffer.
+
+    Returns
+    =======
+    dE : array of shape (...)
+    """
+    Lab1 = np.asarray(Lab1)
+    Lab2 = np.asarray(Lab2)
+    L1, a1, b1 = Lab1[...,0], Lab1[...,1], Lab1[...,2]
+    L2, a2, b2 = Lab2[...,0], Lab2[...,1], Lab2[...,2]
+
+    pow25_7 = 25.0**7
+    C_mean = 0.5*(np.hypot(a1, b1) + np.hypot(a2, b2))
+    C_mean_7 = C_mean**7
+    G = 0.5*(1.0 - np.sqrt(C_mean_7 / (C_mean_7 + pow25_7)))
+    a1p = (1.0 + G)*a1
+    a2p = (1.0 + G)*a2
+    C1p = np.hypot(a1p, b1)
+    C2p = np.hypot(a2p, b2)
+    h1p = np.degrees(np.arctan2(b1, a1p)) % 360.0
+    h2p = np.degrees(np.arctan2(b2, a2p)) % 360.0
+    C1p_C2p = C1p*C2p
+    achromatic = C1p_C2p == 0
+
+    dLp = L2 - L1
+    dCp = C2p - C1p
+    dhp = h2p - h1p
+    dhp = np.where(dhp > 180.0, dhp - 360.0, np.where(dhp < -180.0, dhp + 360.0, dhp))
+    dhp = np.where(achromatic, 0.0, dhp)
+    dHp = 2.0*np.sqrt(C1p_C2p)*np.sin(np.radians(0.5*dhp))
+
+    Lp_mean = 0.5*(L1 + L2)
+    Cp_mean = 0.5*(C1p + C2p)
+    hp_sum = h1p + h2p
+    hp_mean = np.where(np.abs(h1p - h2p) <= 180.0, 0.5*hp_sum,
+                       np.where(hp_sum < 360.0, 0.5*(hp_sum + 360.0), 0.5*(hp_sum - 360.0)))
+    hp_mean = np.where(achromatic, hp_sum, hp_mean)
+
+    T = (1.0 - 0.17*np.cos(np.radians(hp_mean - 30.0))
+             + 0.24*np.cos(np.radians(2.0*hp_mean))
+             + 0.32*np.cos(np.radians(3.0*hp_mean + 6.0))
+             - 0.20*np.cos(np.radians(4.0*hp_mean - 63.0)))
+    d_theta = 30.0*np.exp(-((hp_mean - 275.0)/25.0)**2)
+    Cp_mean_7 = Cp_mean**7
+    R_C = 2.0*np.sqrt(Cp_mean_7 / (Cp_mean_7 + pow25_7))
+    Lp_mean_50_2 = (Lp_mean - 50.0)**2
+    S_L = 1.0 + 0.015*Lp_mean_50_2 / np.sqrt(20.0 + Lp_mean_50_2)
+    S_C = 1.0 + 0.045*Cp_mean
+    S_H = 1.0 + 0.015*Cp_mean*T
+    R_T = -np.sin(np.radians(2.0*d_theta))*R_C
+
+    dL = dLp / S_L
+    dC = dCp / S_C
+    dH = dHp / S_H
+    return np.sqrt(dL*dL + dC*dC + dH*dH + R_T*dC*dH, out=out)
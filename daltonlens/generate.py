@@ -135,11 +135,9 @@ def ishihara_plate_dichromacy(deficiency: simulate.Deficiency,
 
     # Generate a set of confusion lines by walking along the diagonal plane
     images = []
-    lms_seeds = itertools.product([0.1,0.25,0.5,0.75,0.9], [0.1,0.25,0.5,0.75,0.9])
-    for uv_plane in lms_seeds:
-        lms_color = uv_plane @ np.array([U,V])
-        segment = geometry.lms_confusion_segment(lms_color, lms_model, deficiency)
-        p1, p2 = segment
+    lms_seeds = np.array(list(itertools.product([0.1,0.25,0.5,0.75,0.9], [0.1,0.25,0.5,0.75,0.9])))
+    segments, _ = geometry.lms_confusion_segments(lms_seeds @ np.array([U,V]), lms_model, deficiency)
+    for p1, p2 in segments:
         # p1 and p2 are the extremes of the segment. A CVD with full severity would
         # not distinguish these two colors. A CVD with half severity would distinguish
         # them, but not the two colors situated half-way along the segment, etc.
@@ -203,11 +201,6 @@ def simulator_ishihara_plate(simulator: simulate.Simulator,
         sys.stderr.write("OpenCV is required for ishihara_image: `pip install opencv-python'\n")
         return None
 
-    try: import colour
-    except ImportError:
-        sys.stderr.write("colour is required for simulator_ishihara_plate: `pip install colour-science'\n")
-        return None
-
     from daltonlens import geometry
 
     mask_images_path = Path(__file__).parent.absolute() / "data"
@@ -242,7 +235,7 @@ def simulator_ishihara_plate(simulator: simulate.Simulator,
     grid_cvd = grid_cvd.reshape(-1, 3)
     grid = grid.reshape(-1, 3)
 
-    linearRGB_to_Lab = lambda im_rgb: colour.XYZ_to_Lab(colour.sRGB_to_XYZ(im_rgb, apply_cctf_decoding=False))
+    linearRGB_to_Lab = convert.Lab_from_linearRGB
 
     # Manage a subset of colors in the grid.
     ColorSubset = namedtuple('ColorSubset', ['orig_rgb', 'orig_lab', 'cvd_rgb', 'cvd_lab'])
@@ -262,7 +255,7 @@ def simulator_ishihara_plate(simulator: simulate.Simulator,
         # Perceptual distance between the simulated colour and the original one.
         # This will typically have the largest distance when the severity is
         # low.
-        dE_refRgb_refCvd = colour.delta_E(ref_lab, ref_cvd_lab)
+        dE_refRgb_refCvd = convert.delta_E2000(ref_lab, ref_cvd_lab)
 
         current_set = ColorSubset (grid, None, grid_cvd, None)
 
@@ -282,11 +275,11 @@ def simulator_ishihara_plate(simulator: simulate.Simulator,
         current_set = current_set._replace(cvd_lab=linearRGB_to_Lab(current_set.cvd_rgb))
 
         # Now we know that all these colors are similar once transformed with CVD.
-        dE_refCvd_cvd = colour.delta_E(ref_cvd_lab, current_set.cvd_lab)
+        dE_refCvd_cvd = convert.delta_E2000(ref_cvd_lab, current_set.cvd_lab)
         refined_indices = dE_refCvd_cvd < 1.0
         current_set = filterSubset(current_set, refined_indices)
 
-        dE_refRgb_orig = colour.delta_E(ref_lab, current_set.orig_lab)
+        dE_refRgb_orig = convert.delta_E2000(ref_lab, current_set.orig_lab)
         indices_that_changed = dE_refRgb_orig > 2.0
         current_set = filterSubset(current_set, indices_that_changed)
         dE_refRgb_orig = dE_refRgb_orig[indices_that_changed]
@@ -1,24 +1,74 @@
 import numpy as np
-import sys
 
 from daltonlens import convert, simulate
 
-try: import Geometry3D as geo3d
-except ImportError as e:
-    sys.stderr.write("Geometry3D is required to import this module: `pip install Geometry3D'\n")
-    raise e
+def lms_confusion_segments(lms_colors, color_model: convert.LMSModel, deficiency: simulate.Deficiency):
+    """Return the endpoints of the confusion lines passing by each of the given LMS points.
 
-def geo3dPoint_from_np(p): return geo3d.Point(p[0], p[1], p[2])
-def geo3dVector_from_np(p): return geo3d.Vector(p[0], p[1], p[2])
-def np_from_geo3dPoint(p): return np.array([p.x, p.y, p.z])
+    Batched version of lms_confusion_segment. Each line is parallel to the
+    dichromat missing axis, and the segment is the intersection of that line
+    with the RGB gamut in the LMS space.
+
+    The gamut is a parallelepiped in LMS, but it's just the unit cube in linear
+    RGB, so the intersection is computed there with the slab method: for each
+    channel the line is inside the [0,1] slab for an interval of its
+    parameter t, and the segment is the intersection of the 3 intervals.
+
+    Parameters
+    ==========
+    lms_colors : array of shape (N,3)
+    Coordinates of the colors through which the confusion lines should pass
+    in the LMS space.
+
+    color_model : convert.LMSModel
+    The color model to go from RGB to LMS. It is used to compute the
+    RGB gamut in LMS.
+
+    deficiency : Deficiency
+    One of Deficiency.PROTAN, DEUTAN or TRITAN to determine the confusion axis in LMS.
+
+    Returns
+    =======
+    segments : array of shape (N,2,3)
+    The start and end points of each segment, in LMS. The start point
+    is the one with the smallest coordinate along the confusion axis.
+
+    valid : array of shape (N) with dtype bool
+    False when the line does not intersect the gamut. The corresponding
+    segments are filled with NaN.
+    """
+    lms_colors = np.asarray(lms_colors, dtype=np.float64).reshape(-1,3)
+    confusion_axis = simulate.lms_confusion_axis(deficiency)
+
+    # Line in linear RGB: rgb_origin + t*rgb_direction
+    rgb_origin = convert.apply_color_matrix(lms_colors, color_model.linearRGB_from_LMS)
+    rgb_direction = color_model.linearRGB_from_LMS @ confusion_axis
+
+    # Parallel to a slab: either always inside or never.
+    parallel = np.abs(rgb_direction) < 1e-12
+    safe_direction = np.where(parallel, 1.0, rgb_direction)
+    t0 = (0.0 - rgb_origin) / safe_direction
+    t1 = (1.0 - rgb_origin) / safe_direction
+    t_low = np.where(parallel, -np.inf, np.minimum(t0, t1))
+    t_high = np.where(parallel, np.inf, np.maximum(t0, t1))
+    outside_parallel_slab = parallel & ((rgb_origin < 0.0) | (rgb_origin > 1.0))
+
+    t_enter = np.max(t_low, axis=-1)
+    t_exit = np.min(t_high, axis=-1)
+    valid = (t_enter <= t_exit) & ~np.any(outside_parallel_slab, axis=-1)
+
+    segments = np.stack([lms_colors + t_enter[:,np.newaxis]*confusion_axis,
+                         lms_colors + t_exit[:,np.newaxis]*confusion_axis], axis=1)
+    segments[~valid] = np.nan
+    return segments, valid
 
 def lms_confusion_segment(lms_color, color_model: convert.LMSModel, deficiency: simulate.Deficiency):
     """Return the endpoints of the confusion line passing by the given LMS point.
-    
+
     The line is parallel to the dichromat missing axis, and the segment is the intersection
     of that line with the RGB gamut in the LMS space.
 
-    Note: the Geometry3D package is required for that function.
+    See lms_confusion_segments to process many colors at once.
 
     Parameters
     ==========
@@ -38,34 +88,9 @@ def lms_confusion_segment(lms_color, color_model: convert.LMSModel, deficiency:
     (start, end) : tuple of 3D points
     The points correspond to the start and end points of the segment.
     """
-
-    # First we build the linear RGB gamut (cube) in LMS. It becomes
-    # a parallelepiped since it's a linear transform.
-    lms_K = color_model.LMS_from_linearRGB @ np.array([0.,0.,0.])
-    lms_R = color_model.LMS_from_linearRGB @ np.array([1.,0.,0.])
-    lms_G = color_model.LMS_from_linearRGB @ np.array([0.,1.,0.])
-    lms_B = color_model.LMS_from_linearRGB @ np.array([0.,0.,1.])
-
-    # The parallelogram is defined by the origin (black) and the
-    # 3 vectors.
-    KBMRGCWY_geometry = geo3d.Parallelepiped(geo3dPoint_from_np(lms_K),
-                                             geo3dVector_from_np(lms_R-lms_K),
-                                             geo3dVector_from_np(lms_G-lms_K),
-                                             geo3dVector_from_np(lms_B-lms_K))
-
-    confusion_axis = simulate.lms_confusion_axis(deficiency)
-
-    # Now we build the confusion line passing through the given point.
-    line = geo3d.Line(geo3dPoint_from_np(lms_color),
-                      geo3dPoint_from_np(lms_color + confusion_axis))
-
-    # The intersection with the parallelepiped is our segment.
-    segment = geo3d.intersection(KBMRGCWY_geometry, line)
-    # display(segment)
-
-    # It can be None if the provided color was not inside the parallelogram.
-    if segment is None:
+    segments, valid = lms_confusion_segments(lms_color, color_model, deficiency)
+    # It can be invalid if the line does not cross the RGB gamut.
+    if not valid[0]:
         print("ERROR: lms_confusion_segment: the provided color is not in the RGB gamut.")
         return None
-    return tuple(np_from_geo3dPoint(p) for p in segment)
-
+    return (segments[0,0], segments[0,1])
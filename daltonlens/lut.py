@@ -0,0 +1,440 @@
+import hashlib
+import os
+import shutil
+import tempfile
+import time
+from enum import Enum
+from pathlib import Path
+
+import numpy as np
+
+from daltonlens import __version__, convert, simulate
+
+# Bump this when the content or layout of the tables changes.
+LUT_FORMAT_VERSION = 1
+
+def compute_lut(simulator: simulate.Simulator, deficiency: simulate.Deficiency, severity: float):
+    """Compute the full lookup table of a simulator for every 8-bit RGB color.
+
+    Parameters
+    ==========
+    simulator : simulate.Simulator
+        The simulator to tabulate.
+
+    deficiency : Deficiency
+        The deficiency to simulate.
+
+    severity : float
+        The severity between 0 (normal vision) and 1 (complete dichromacy).
+
+    Returns
+    =======
+    lut : array of shape (256,256,256,3) with dtype uint8
+        lut[r,g,b] is the simulated sRGB color of (r,g,b).
+    """
+    lut = np.empty((256,256,256,3), dtype=np.uint8)
+    # Process 16 red values at a time to keep the float32 temporaries small.
+    reds_per_batch = 16
+    g, b = np.meshgrid(np.arange(256, dtype=np.uint8), np.arange(256, dtype=np.uint8), indexing='ij')
+    im = np.empty((reds_per_batch, 256*256, 3), dtype=np.uint8)
+    im[:,:,1] = g.ravel()
+    im[:,:,2] = b.ravel()
+    for r in range(0, 256, reds_per_batch):
+        im[:,:,0] = np.arange(r, r + reds_per_batch, dtype=np.uint8)[:,np.newaxis]
+        lut[r:r+reds_per_batch] = simulator.simulate_cvd(im, deficiency, severity).reshape(reds_per_batch, 256, 256, 3)
+    return lut
+
+def apply_lut(lut, image_srgb_uint8):
+    """Apply a full (256,256,256,3) lookup table to an image.
+
+    Parameters
+    ==========
+    lut : array of shape (256,256,256,3) with dtype uint8
+        Table computed by compute_lut, possibly memory-mapped.
+
+    image_srgb_uint8 : array of shape (M,N,3) with dtype uint8
+        The input sRGB image.
+
+    Returns
+    =======
+    im : array of shape (M,N,3) with dtype uint8
+        The transformed image.
+    """
+    im = image_srgb_uint8
+    index = (im[...,0].astype(np.uint32) << 16) | (im[...,1].astype(np.uint32) << 8) | im[...,2]
+    return lut.reshape(-1,3)[index]
+
+def compute_compact_lut(simulator: simulate.Simulator, deficiency: simulate.Deficiency, severity: float, size: int = 33):
+    """Compute a reduced-resolution lookup table, meant to be interpolated.
+
+    The simulator is evaluated on a regular size x size x size grid of
+    encoded RGB values (sRGB for most simulators), in float, so the table does
+    not depend on the bit depth of the images it gets applied to. Typical
+    sizes are 17, 33 or 65.
+
+    Parameters
+    ==========
+    simulator, deficiency, severity
+        See compute_lut.
+
+    size : int
+        Number of samples along each axis.
+
+    Returns
+    =======
+    lut : array of shape (size,size,size,3) with dtype float32
+        lut[r,g,b] is the simulated color of the grid node (r,g,b)/(size-1),
+        with values in [0,1].
+    """
+    axis = np.linspace(0.0, 1.0, size, dtype=np.float32)
+    grid = np.stack(np.meshgrid(axis, axis, axis, indexing='ij'), axis=-1)
+    im_linear_rgb = convert.linearRGB_from_encoding(grid.reshape(1,-1,3), simulator.imageEncoding)
+    im_cvd_linear_rgb = simulator._simulate_cvd_linear_rgb(im_linear_rgb, deficiency, severity)
+    im_cvd = convert.encoding_from_linearRGB(im_cvd_linear_rgb, simulator.imageEncoding)
+    return np.clip(im_cvd, 0.0, 1.0).astype(np.float32).reshape(size, size, size, 3)
+
+def _as_unit_float32(im):
+    """Normalize uint8, uint16 or float images to float32 in [0,1]."""
+    if im.dtype == np.uint8:
+        return im.astype(np.float32) / 255.0
+    if im.dtype == np.uint16:
+        return im.astype(np.float32) / 65535.0
+    return np.clip(im, 0.0, 1.0).astype(np.float32)
+
+def _from_unit_float32(im, dtype):
+    if dtype == np.uint8:
+        # Truncate like convert.as_uint8 so the output matches simulate_cvd.
+        return convert.as_uint8(im)
+    if dtype == np.uint16:
+        return np.round(np.clip(im, 0.0, 1.0) * 65535.0).astype(np.uint16)
+    return im
+
+def apply_compact_lut(lut, image, method: str = 'tetrahedral'):
+    """Apply a table from compute_compact_lut with trilinear or tetrahedral interpolation.
+
+    Parameters
+    ==========
+    lut : array of shape (S,S,S,3) with dtype float32
+        The lookup table.
+
+    image : array of shape (...,3) with dtype uint8, uint16 or float
+        The input image. Float images must be normalized in [0,1].
+
+    method : str
+        'tetrahedral' (default) or 'trilinear'. Tetrahedral interpolation only
+        reads 4 of the 8 cell corners and preserves the neutral axis better.
+
+    Returns
+    =======
+    im : array of shape (...,3) with the same dtype as the input
+        The transformed image.
+    """
+    size = lut.shape[0]
+    lut_flat = lut.reshape(-1,3)
+    strides = np.array([size*size, size, 1], dtype=np.int32)
+
+    x = _as_unit_float32(image) * np.float32(size - 1)
+    # x >= 0 so truncation is the floor. Make the last cell include its upper bound.
+    i0 = np.minimum(x.astype(np.int32), size - 2)
+    f = x - i0
+    base = i0 @ strides
+
+    if method == 'trilinear':
+        fr, fg, fb = f[...,0:1], f[...,1:2], f[...,2:3]
+        def corner(dr, dg, db): return lut_flat[base + (dr*strides[0] + dg*strides[1] + db*strides[2])]
+        c00 = corner(0,0,0)*(1.0-fb) + corner(0,0,1)*fb
+        c01 = corner(0,1,0)*(1.0-fb) + corner(0,1,1)*fb
+        c10 = corner(1,0,0)*(1.0-fb) + corner(1,0,1)*fb
+        c11 = corner(1,1,0)*(1.0-fb) + corner(1,1,1)*fb
+        c0 = c00*(1.0-fg) + c01*fg
+        c1 = c10*(1.0-fg) + c11*fg
+        out = c0*(1.0-fr) + c1*fr
+    elif method == 'tetrahedral':
+        # The cell is split in 6 tetrahedra. The one containing the point goes
+        # from the black corner to the white one by following the axes in
+        # decreasing order of the fractional parts. Only the largest and the
+        # smallest axes are needed to find the 2 intermediate corners.
+        fr, fg, fb = f[...,0], f[...,1], f[...,2]
+        r_is_max = (fr >= fg) & (fr >= fb)
+        b_is_min = (fb <= fg) & (fb <= fr)
+        max_stride = np.where(r_is_max, strides[0], np.where(fg >= fb, strides[1], strides[2]))
+        min_stride = np.where(b_is_min, strides[2], np.where((fg <= fr) & (fg <= fb), strides[1], strides[0]))
+        f1 = np.maximum(np.maximum(fr, fg), fb)[...,np.newaxis]
+        f3 = np.minimum(np.minimum(fr, fg), fb)[...,np.newaxis]
+        f2 = np.sum(f, axis=-1, keepdims=True) - f1 - f3
+        white_offset = np.sum(strides)
+        v0 = lut_flat[base]
+        v1 = lut_flat[base + max_stride]
+        v2 = lut_flat[base + (white_offset - min_stride)]
+        v3 = lut_flat[base + white_offset]
+        out = v0*(1.0-f1) + v1*(f1-f2) + v2*(f2-f3) + v3*f3
+    else:
+        raise ValueError(f"Unknown interpolation method '{method}'")
+
+    return _from_unit_float32(out, image.dtype)
+
+def compact_lut_max_error(lut, simulator: simulate.Simulator, deficiency: simulate.Deficiency, severity: float,
+                          method: str = 'tetrahedral', image = None):
+    """Max absolute difference with simulate_cvd, in 8-bit levels.
+
+    Parameters
+    ==========
+    image : array of shape (M,N,3) with dtype uint8
+        The colors to test. Defaults to generate.rgb_span, which spans the
+        whole RGB cube.
+    """
+    from daltonlens import generate
+    if image is None:
+        image = generate.rgb_span(27*8, 27*8)
+    out_ref = simulator.simulate_cvd(image, deficiency, severity)
+    out = apply_compact_lut(lut, image, method)
+    return int(np.max(np.abs(out.astype(np.int32) - out_ref)))
+
+def compute_pil_filter(simulator: simulate.Simulator, deficiency: simulate.Deficiency, severity: float, size: int = 33):
+    """Compile a simulation into a PIL ImageFilter.Color3DLUT.
+
+    pil_image.filter(f) then runs the simulation in the C code of PIL, with
+    trilinear interpolation of compute_compact_lut, and without converting
+    the image to a NumPy array. It only works on 'RGB' images. See
+    pil_filter_accuracy for the difference with simulate_cvd.
+
+    Parameters
+    ==========
+    simulator, deficiency, severity
+        See compute_lut.
+
+    size : int
+        Number of samples along each axis, between 2 and 65.
+
+    Returns
+    =======
+    filter : PIL.ImageFilter.Color3DLUT
+    """
+    from PIL import ImageFilter
+    table = compute_compact_lut(simulator, deficiency, severity, size)
+    # PIL rounds the interpolated values while simulate_cvd truncates them
+    # (see convert.as_uint8), half a level of offset compensates for that.
+    table = np.clip(table - 0.5/255.0, 0.0, 1.0)
+    # The red index varies the fastest in PIL tables, like in .cube files.
+    return ImageFilter.Color3DLUT(size, table.transpose(2,1,0,3), channels=3)
+
+def pil_filter_accuracy(pil_filter, simulator: simulate.Simulator, deficiency: simulate.Deficiency, severity: float, image = None):
+    """Compare a filter from compute_pil_filter with simulate_cvd.
+
+    Parameters
+    ==========
+    image : array of shape (M,N,3) with dtype uint8
+        The colors to test. Defaults to generate.rgb_span, which spans the
+        whole RGB cube.
+
+    Returns
+    =======
+    report : dict
+        'max_error' and 'mean_error' are the absolute differences in 8-bit
+        levels, and 'exact_fraction' the fraction of the channel values that
+        are identical.
+    """
+    from PIL import Image
+    from daltonlens import generate
+    if image is None:
+        image = generate.rgb_span(27*8, 27*8)
+    out_ref = simulator.simulate_cvd(image, deficiency, severity)
+    out = np.asarray(Image.fromarray(image).filter(pil_filter))
+    error = np.abs(out.astype(np.int32) - out_ref)
+    return {'max_error': int(np.max(error)), 'mean_error': float(np.mean(error)), 'exact_fraction': float(np.mean(error == 0))}
+
+def save_cube_file(lut, path, title: str = "DaltonLens"):
+    """Export a compact lookup table as an Adobe/Resolve .cube file."""
+    size = lut.shape[0]
+    with open(path, 'w') as f:
+        f.write(f'TITLE "{title}"\n')
+        f.write(f'LUT_3D_SIZE {size}\n')
+        f.write('DOMAIN_MIN 0.0 0.0 0.0\n')
+        f.write('DOMAIN_MAX 1.0 1.0 1.0\n')
+        # The red index varies the fastest in .cube files.
+        np.savetxt(f, lut.transpose(2,1,0,3).reshape(-1,3), fmt='%.6f')
+
+def load_cube_file(path):
+    """Load a .cube file saved by save_cube_file.
+
+    Returns
+    =======
+    lut : array of shape (S,S,S,3) with dtype float32
+        Indexed by [r,g,b], like compute_compact_lut.
+    """
+    size = None
+    values = []
+    with open(path) as f:
+        for line in f:
+            tokens = line.split()
+            if not tokens or tokens[0].startswith('#'):
+                continue
+            if tokens[0] == 'LUT_3D_SIZE':
+                size = int(tokens[1])
+            elif tokens[0][0].isdigit() or tokens[0][0] in '-.':
+                values.append([float(v) for v in tokens])
+    if size is None or len(values) != size**3:
+        raise ValueError(f"Invalid .cube file {path}")
+    return np.array(values, dtype=np.float32).reshape(size,size,size,3).transpose(2,1,0,3).copy()
+
+def _value_fingerprint(value):
+    if isinstance(value, convert.LMSModel):
+        return b''.join([type(value).__qualname__.encode(),
+                         repr(value.usesJuddVosXYZ).encode(),
+                         np.ascontiguousarray(value.XYZ_from_linearRGB, dtype=np.float64).tobytes(),
+                         np.ascontiguousarray(value.LMS_from_XYZ, dtype=np.float64).tobytes()])
+    if isinstance(value, (bool, int, float, str, Enum)) or value is None:
+        return repr(value).encode()
+    # Anything else (e.g. arrays saved for inspection) does not define the simulator.
+    return None
+
+def simulator_fingerprint(simulator: simulate.Simulator):
+    """Return a string that identifies the simulator class and its options.
+
+    Two simulators with the same fingerprint produce the same output. The
+    options are taken from the public attributes of the simulator, and the
+    LMS models are identified by their matrices.
+    """
+    h = hashlib.sha1()
+    h.update(type(simulator).__module__.encode())
+    h.update(type(simulator).__qualname__.encode())
+    for name, value in sorted(vars(simulator).items()):
+        if name.startswith('_') or name == 'dumpPrecomputedValues':
+            continue
+        value_fingerprint = _value_fingerprint(value)
+        if value_fingerprint is not None:
+            h.update(name.encode())
+            h.update(value_fingerprint)
+    return h.hexdigest()
+
+def lut_cache_key(simulator: simulate.Simulator, deficiency: simulate.Deficiency, severity: float):
+    h = hashlib.sha1()
+    h.update(f"{LUT_FORMAT_VERSION}:{simulator_fingerprint(simulator)}:{deficiency.name}:{float(severity)!r}".encode())
+    return h.hexdigest()
+
+def default_cache_dir():
+    """Cache directory, from $DALTONLENS_CACHE_DIR or the user cache folder."""
+    if 'DALTONLENS_CACHE_DIR' in os.environ:
+        return Path(os.environ['DALTONLENS_CACHE_DIR'])
+    return Path(os.environ.get('XDG_CACHE_HOME', Path.home() / '.cache')) / 'daltonlens'
+
+# Folders of other package versions are deleted once they were not used for
+# that long. Several versions can share the same cache folder, e.g. during a
+# rolling deploy or with several virtual environments.
+STALE_VERSION_SECONDS = 7*24*3600
+
+# Temporary files older than that were left by killed writers and get deleted.
+STALE_TMP_SECONDS = 3600
+
+def _unlink_if_exists(path: Path):
+    # Path.unlink(missing_ok=True) needs python 3.8
+    try:
+        path.unlink()
+    except FileNotFoundError:
+        pass
+
+def _versioned_cache_dir(root_dir: Path, prefix: str, format_version: int):
+    """Create the folder of this package version in root_dir, e.g. luts-v0.1.6-1.
+
+    The folders of the other versions with the same prefix are deleted once
+    they were not used for STALE_VERSION_SECONDS.
+    """
+    cache_dir = root_dir / f"{prefix}-v{__version__}-{format_version}"
+    cache_dir.mkdir(parents=True, exist_ok=True)
+    # Tell the other versions that this one is still in use.
+    os.utime(cache_dir)
+    now = time.time()
+    for path in root_dir.glob(f'{prefix}-v*'):
+        if not path.is_dir() or path == cache_dir:
+            continue
+        try:
+            # Opening a cache touches its folder, and reading an entry touches the entry.
+            last_use = max([path.stat().st_mtime] + [entry.stat().st_mtime for entry in path.iterdir()])
+        except FileNotFoundError: # removed by another process
+            continue
+        if now - last_use > STALE_VERSION_SECONDS:
+            shutil.rmtree(path, ignore_errors=True)
+    return cache_dir
+
+class LUTCache:
+    """Persistent on-disk cache of lookup tables, shared across processes.
+
+    Tables are stored as .npy files in a folder specific to the package
+    version, so upgrading the package invalidates them. The folders of the
+    other versions are deleted once they were not used for
+    STALE_VERSION_SECONDS. They are loaded with
+    np.load(mmap_mode='r'), so all the processes using the same table share
+    the same memory pages. Writes are atomic (written to a temporary file
+    and then renamed), so concurrent processes never see a partial table.
+    When the total size goes above max_size_bytes the least recently used
+    tables get deleted. The temporary files count in the total size, and
+    the ones left by killed writers are deleted after STALE_TMP_SECONDS.
+    """
+
+    def __init__(self, cache_dir=None, max_size_bytes: int = 1 << 30):
+        root_dir = Path(cache_dir) if cache_dir is not None else default_cache_dir()
+        self.cache_dir = _versioned_cache_dir(root_dir, 'luts', LUT_FORMAT_VERSION)
+        self.max_size_bytes = max_size_bytes
+        self._evict()
+
+    def get(self, simulator: simulate.Simulator, deficiency: simulate.Deficiency, severity: float):
+        """Return the lookup table of the simulator, computing it if needed.
+
+        Returns
+        =======
+        lut : array of shape (256,256,256,3) with dtype uint8
+            The table, read-only and memory-mapped when it was already in
+            the cache. See apply_lut.
+        """
+        path = self.cache_dir / (lut_cache_key(simulator, deficiency, severity) + '.npy')
+        try:
+            lut = np.load(path, mmap_mode='r')
+            # Refresh the modification time, it's what the LRU eviction uses.
+            os.utime(path)
+            return lut
+        except (FileNotFoundError, ValueError):
+            pass
+
+        lut = compute_lut(simulator, deficiency, severity)
+        self._atomic_save(path, lut)
+        self._evict()
+        return lut
+
+    def clear(self):
+        for path in self.cache_dir.glob('*.npy'):
+            _unlink_if_exists(path)
+
+    def _atomic_save(self, path: Path, lut):
+        fd, tmp_path = tempfile.mkstemp(dir=self.cache_dir, suffix='.tmp')
+        try:
+            with os.fdopen(fd, 'wb') as f:
+                np.save(f, lut)
+            os.replace(tmp_path, path)
+        except BaseException:
+            _unlink_if_exists(Path(tmp_path))
+            raise
+
+    def _evict(self):
+        entries = []
+        total_size = 0
+        now = time.time()
+        for path in self.cache_dir.iterdir():
+            try:
+                st = path.stat()
+            except FileNotFoundError: # removed by another process
+                continue
+            if path.suffix == '.tmp':
+                # Tables being written can't be evicted, but they use space.
+                if now - st.st_mtime > STALE_TMP_SECONDS:
+                    _unlink_if_exists(path)
+                else:
+                    total_size += st.st_size
+            elif path.suffix == '.npy':
+                entries.append((st.st_mtime, st.st_size, path))
+                total_size += st.st_size
+        # Oldest first.
+        for _, size, path in sorted(entries):
+            if total_size <= self.max_size_bytes:
+                break
+            _unlink_if_exists(path)
+            total_size -= size
@@ -1,68 +1,324 @@
 #!/usr/bin/env python3
 
+import io
 import os
 import sys
 import numpy as np
 from pathlib import Path
 from PIL import Image
 
-from daltonlens import convert, simulate, generate
+from daltonlens import backends, cache, simulate, generate, lut, vector
+from daltonlens.simulate import deficiency_from_str, simulate_palette_image, simulator_from_str
+from daltonlens.utils import rgb_array
+
+def severity_list(value: str):
+    """argparse type of --severity: comma-separated floats in [0,1]."""
+    from argparse import ArgumentTypeError
+    try:
+        severities = [float(s) for s in value.split(',')]
+    except ValueError:
+        raise ArgumentTypeError(f"invalid severity list '{value}', expected comma-separated numbers")
+    if not all(0.0 <= s <= 1.0 for s in severities):
+        raise ArgumentTypeError(f"severities must be between 0 and 1, got '{value}'")
+    return severities
 
 def parse_command_line():
     from argparse import ArgumentParser, ArgumentDefaultsHelpFormatter
     parser = ArgumentParser(description='Toolbox to simulate and filter color vision deficiencies.',
                             formatter_class=ArgumentDefaultsHelpFormatter)    
 
-    parser.add_argument("input_image", type=Path, help="Image to process.")
-    parser.add_argument("output_image", type=Path, help="Output image")
+    parser.add_argument("input_image", type=Path, nargs='?', help="Image to process. SVG and CSS files get their colors rewritten.")
+    parser.add_argument("output_image", type=Path, nargs='?', help="Output image")
  
     parser.add_argument("--model", "-m", type=str, default="auto",
-                        help="Color model to apply: auto, vienot, brettel, machado, vischeck, coblisV1, coblisV2")
+                        help="Color model to apply: auto, vienot, brettel, machado, vischeck, coblisV1, coblisV2. "
+                             "Several comma-separated models can be given.")
 
     parser.add_argument("--filter", "-f", type=str, default="simulate",
                         help="Filter to apply: simulate or daltonize.")
 
     parser.add_argument("--deficiency", "-d", type=str, default="protan",
-                        help="Deficiency type: protan, deutan or tritan")
+                        help="Deficiency type: protan, deutan or tritan. Several comma-separated deficiencies can be given, e.g. protan,deutan,tritan")
+
+    parser.add_argument("--severity", "-s", type=severity_list, default="1.0",
+                        help="Severity between 0 and 1. Several comma-separated severities can be given.")
+
+    parser.add_argument("--max-size", type=int, default=None,
+                        help="Downscale the input so that its largest side is at most that many pixels before simulating. "
+                             "JPEG files are directly decoded at a reduced resolution.")
+
+    parser.add_argument("--png-compress-level", type=int, default=None, choices=range(10), metavar="[0-9]",
+                        help="zlib level of the PNG outputs. 1 is much faster to encode than the default 6, for slightly larger files.")
+
+    parser.add_argument("--jpeg-quality", type=int, default=None,
+                        help="Quality of the JPEG outputs, between 1 and 95 (PIL default: 75).")
+
+    parser.add_argument("--webp-quality", type=int, default=None,
+                        help="Quality of the WebP outputs, between 0 and 100 (PIL default: 80).")
+
+    parser.add_argument("--webp-lossless", action="store_true",
+                        help="Use lossless WebP compression.")
+
+    parser.add_argument("--composite", action="store_true",
+                        help="When several variants are requested, save them as a single labeled grid image instead of separate files.")
+
+    parser.add_argument("--max-unique-colors", type=int, default=4096,
+                        help="Only simulate the unique colors of images that have less than that many (max 65536). 0 to disable.")
+
+    parser.add_argument("--precision", type=str, default="float32", choices=simulate.PRECISIONS,
+                        help="Precision of the intermediate values. 'fixed' is faster and uses less memory, within 1 level of float32.")
+
+    parser.add_argument("--engine", type=str, default="numpy", choices=["numpy", "pil"],
+                        help="'pil' applies the simulations as PIL Color3DLUT filters. Several times faster on large images, "
+                             "within a few levels of 'numpy' (see daltonlens.lut.pil_filter_accuracy).")
 
-    parser.add_argument("--severity", "-s", type=float, default="1.0",
-                        help="Severity between 0 and 1")
+    parser.add_argument("--pil-lut-size", type=int, default=33,
+                        help="Number of samples along each axis of the --engine pil tables, at most 65.")
+
+    parser.add_argument("--backend", type=str, default="numpy",
+                        help="Implementation of the per-pixel kernels: numpy, or numba if it is installed.")
+
+    parser.add_argument("--lut-cache", action="store_true",
+                        help="Simulate with a lookup table stored in a persistent cache shared across processes.")
+
+    parser.add_argument("--lut-cache-dir", type=Path, default=None,
+                        help="Folder of the lookup table cache. Defaults to $DALTONLENS_CACHE_DIR or ~/.cache/daltonlens")
+
+    parser.add_argument("--result-cache", action="store_true",
+                        help="Store the output files in a cache keyed by the content of the input file and the options. "
+                             "Inputs already in the cache are not even decoded.")
+
+    parser.add_argument("--result-cache-dir", type=Path, default=None,
+                        help="Folder of the result cache. Defaults to $DALTONLENS_CACHE_DIR or ~/.cache/daltonlens")
+
+    parser.add_argument("--result-cache-max-size", type=int, default=1024,
+                        help="Maximum size of the result cache in MB. The least recently used outputs get deleted.")
+
+    parser.add_argument("--serve", type=str, default=None, metavar="[HOST:]PORT",
+                        help="Run a simulation server instead of processing a single image. See daltonlens.server.")
+
+    parser.add_argument("--workers", type=int, default=os.cpu_count(),
+                        help="Number of simulation threads of the server.")
+
+    parser.add_argument("--max-queue", type=int, default=16,
+                        help="Number of requests that can wait for a server worker before new ones get rejected.")
+    parser.add_argument("--max-request-size", type=int, default=64,
+                        help="Maximum size of the server requests in MB, larger ones get rejected.")
 
     args = parser.parse_args()
+    if args.max_unique_colors > 65536:
+        parser.error("--max-unique-colors must be at most 65536")
+    if args.serve is None and (args.input_image is None or args.output_image is None):
+        parser.error("input_image and output_image are required unless --serve is given")
     return args
 
-deficiency_from_str = {
-    'protan': simulate.Deficiency.PROTAN,
-    'deutan': simulate.Deficiency.DEUTAN,
-    'tritan': simulate.Deficiency.TRITAN,
-}
-
-simulator_from_str = {
-    'vienot': simulate.Simulator_Vienot1999(convert.LMSModel_sRGB_SmithPokorny75()),
-    'brettel': simulate.Simulator_Brettel1997(convert.LMSModel_sRGB_SmithPokorny75()),
-    'vischeck': simulate.Simulator_Vischeck(),
-    'machado': simulate.Simulator_Machado2009(),
-    'coblisV1': simulate.Simulator_CoblisV1(),
-    'coblisV2': simulate.Simulator_CoblisV2(),
-    'auto': simulate.Simulator_AutoSelect()
-}
+def load_image(path: Path, max_size: int = None):
+    """Open an image, downscaled so that its largest side is at most max_size if given."""
+    pil_im = Image.open(path)
+    if max_size and max(pil_im.size) > max_size:
+        # JPEG can decode at 1/2, 1/4 or 1/8 of the resolution, which
+        # is much faster than decoding everything and then resizing.
+        pil_im.draft(None, (max_size, max_size))
+        pil_im.thumbnail((max_size, max_size), Image.BILINEAR)
+    return pil_im
+
+def encoder_options(path: Path, args):
+    """PIL save() options for the output format, from the command line."""
+    suffix = path.suffix.lower()
+    options = {}
+    if suffix == '.png' and args.png_compress_level is not None:
+        options['compress_level'] = args.png_compress_level
+    elif suffix in ['.jpg', '.jpeg'] and args.jpeg_quality is not None:
+        options['quality'] = args.jpeg_quality
+    elif suffix == '.webp':
+        if args.webp_quality is not None:
+            options['quality'] = args.webp_quality
+        if args.webp_lossless:
+            options['lossless'] = True
+    return options
+
+def encode_image(pil_im: Image.Image, path: Path, args):
+    """Return the content of the image file, in the format given by the path extension."""
+    image_format = Image.registered_extensions().get(path.suffix.lower())
+    if image_format is None:
+        raise ValueError(f"unknown file extension: {path.suffix}")
+    # JPEG can't store a palette.
+    if pil_im.mode == 'P' and image_format == 'JPEG':
+        pil_im = pil_im.convert('RGB')
+    f = io.BytesIO()
+    pil_im.save(f, format=image_format, **encoder_options(path, args))
+    return f.getvalue()
+
+def serve(args):
+    from daltonlens import server
+    host, _, port = args.serve.rpartition(':')
+    simulation_server = server.SimulationServer(host or '127.0.0.1', int(port),
+                                                num_workers=args.workers,
+                                                max_queue_size=args.max_queue,
+                                                max_body_bytes=args.max_request_size << 20,
+                                                use_lut_cache=args.lut_cache,
+                                                lut_cache_dir=args.lut_cache_dir)
+    host, port = simulation_server.server_address[:2]
+    print(f"Serving simulations on http://{host}:{port}/simulate")
+    try:
+        simulation_server.serve_forever()
+    except KeyboardInterrupt:
+        pass
+    finally:
+        simulation_server.shutdown()
+
+def variant_label(model: str, deficiency: str, severity: float):
+    return f"{model} {deficiency} {severity:g}"
+
+def variant_output_path(output_image: Path, model: str, deficiency: str, severity: float):
+    return output_image.with_name(f"{output_image.stem}_{model}_{deficiency}_{severity:g}{output_image.suffix}")
+
+def composite_grid(images, labels, n_per_row: int):
+    """Stack the images in a grid, with a label above each of them."""
+    from PIL import ImageDraw
+    label_height = 24
+    height, width = images[0].shape[:2]
+    n_rows = -(-len(images) // n_per_row)
+    grid = Image.new('RGB', (width*n_per_row, (height + label_height)*n_rows))
+    draw = ImageDraw.Draw(grid)
+    for i, (im, label) in enumerate(zip(images, labels)):
+        x, y = (i % n_per_row)*width, (i // n_per_row)*(height + label_height)
+        draw.text((x + 8, y + 6), label, fill=(220,220,220))
+        grid.paste(Image.fromarray(im), (x, y + label_height))
+    return grid
+
+def simulate_variants(im, variants, args):
+    """Simulate all the (model, deficiency, severity) variants of an sRGB uint8 image.
+
+    The image is only linearized once per transfer function and shared
+    by all the variants, unless the variant goes through a single kernel
+    of the current backend anyway (see Simulator.has_fused_kernel). The
+    outputs are the same as Simulator.simulate_cvd.
+    """
+    linear_images = {}
+    # Opening the cache scans its folder, do it once for all the variants.
+    lut_cache = lut.LUTCache(args.lut_cache_dir) if args.lut_cache else None
+    try_unique_colors = args.max_unique_colors > 0
+    outputs = []
+    for model, deficiency, severity in variants:
+        simulator: simulate.Simulator = simulator_from_str[model]
+        deficiency = deficiency_from_str[deficiency]
+        if lut_cache is not None:
+            outputs.append(lut.apply_lut(lut_cache.get(simulator, deficiency, severity), im))
+            continue
+        if try_unique_colors:
+            out = simulator.simulate_cvd_unique_colors(im, deficiency, severity, args.max_unique_colors)
+            if out is not None:
+                outputs.append(out)
+                continue
+            # Same image for all the variants, no need to try again.
+            try_unique_colors = False
+        if args.precision != 'float32' or simulator.has_fused_kernel(deficiency, severity):
+            outputs.append(simulator.simulate_cvd(im, deficiency, severity, precision=args.precision))
+            continue
+        encoding = simulator.imageEncoding
+        if encoding not in linear_images:
+            linear_images[encoding] = simulator.linearRGB_from_image(im)
+        im_cvd_linear_rgb = simulator.simulate_cvd_linear_rgb(linear_images[encoding], deficiency, severity)
+        outputs.append(simulator.image_from_linearRGB(im_cvd_linear_rgb))
+    return outputs
+
+def variant_output_paths(output_image: Path, variants, composite: bool):
+    """Output file of each variant, or the single composite file."""
+    if len(variants) == 1 or composite:
+        return [output_image]
+    return [variant_output_path(output_image, *variant) for variant in variants]
+
+def result_cache_keys(result_cache, input_bytes: bytes, variants, output_paths, args):
+    """Result cache key of each output file."""
+    options = dict(max_size=args.max_size, precision=args.precision, lut_cache=args.lut_cache, backend=args.backend,
+                   engine=args.engine, pil_lut_size=args.pil_lut_size if args.engine == 'pil' else None)
+    if len(output_paths) != len(variants):
+        # The composite depends on all the variants.
+        options['variants'] = variants
+    return [result_cache.key(input_bytes, simulator_from_str[model], deficiency_from_str[deficiency], severity,
+                             suffix=path.suffix.lower(), encoder=encoder_options(path, args), **options)
+            for (model, deficiency, severity), path in zip(variants, output_paths)]
+
+def simulate_output_files(input_image: Path, variants, output_paths, args):
+    """Simulate the variants and return the content of each output file."""
+    if input_image.suffix.lower() in vector.DOCUMENT_SUFFIXES:
+        text = input_image.read_text(encoding='utf-8')
+        return [vector.simulate_cvd_document(text, input_image.suffix, simulator_from_str[model], deficiency_from_str[deficiency], severity).encode('utf-8')
+                for model, deficiency, severity in variants]
+
+    pil_im = load_image(input_image, args.max_size)
+
+    # Indexed images (GIF, palette PNGs): just simulate the palette and keep the indices.
+    if pil_im.mode == 'P' and len(output_paths) == len(variants):
+        return [encode_image(simulate_palette_image(pil_im, simulator_from_str[model], deficiency_from_str[deficiency], severity), path, args)
+                for (model, deficiency, severity), path in zip(variants, output_paths)]
+
+    if args.engine == 'pil':
+        rgb_im = pil_im if pil_im.mode == 'RGB' else pil_im.convert('RGB')
+        out_images = [rgb_im.filter(lut.compute_pil_filter(simulator_from_str[model], deficiency_from_str[deficiency], severity, args.pil_lut_size))
+                      for model, deficiency, severity in variants]
+    else:
+        out_images = [Image.fromarray(out) for out in simulate_variants(rgb_array(pil_im), variants, args)]
+    if len(output_paths) == len(variants):
+        return [encode_image(out_im, path, args) for out_im, path in zip(out_images, output_paths)]
+    labels = [variant_label(*v) for v in variants]
+    n_per_row = len(set(deficiency for _, deficiency, _ in variants))
+    return [encode_image(composite_grid([np.asarray(out_im) for out_im in out_images], labels, n_per_row=n_per_row), output_paths[0], args)]
 
 def main():
     args = parse_command_line ()
 
-    deficiency = deficiency_from_str[args.deficiency]
-    simulator: simulate.Simulator = simulator_from_str[args.model]
-    im = np.asarray(Image.open(args.input_image).convert('RGB'))
+    if args.backend != 'numpy':
+        backends.set_backend(args.backend)
+
+    if args.serve is not None:
+        serve(args)
+        return
 
-    if args.filter == 'simulate':
-        out = simulator.simulate_cvd(im, deficiency=deficiency, severity=args.severity)
-    elif args.filter == 'daltonize':
+    if args.filter == 'daltonize':
         raise NotImplementedError()
-    else:
+    elif args.filter != 'simulate':
         print(f"ERROR: invalid filter '{args.filter}'. Supported filters are 'simulate' and 'daltonize'")
         sys.exit (1)
-    
-    Image.fromarray(out).save(args.output_image)
-    
+
+    models = args.model.split(',')
+    deficiencies = args.deficiency.split(',')
+    severities = args.severity
+    for model in models:
+        if model not in simulator_from_str:
+            print(f"ERROR: invalid model '{model}'. Supported models are {', '.join(simulator_from_str.keys())}")
+            sys.exit (1)
+    for deficiency in deficiencies:
+        if deficiency not in deficiency_from_str:
+            print(f"ERROR: invalid deficiency '{deficiency}'. Supported deficiencies are protan, deutan and tritan")
+            sys.exit (1)
+    # Deficiencies vary the fastest, so they become the columns of the composite.
+    variants = [(m, d, s) for m in models for s in severities for d in deficiencies]
+
+    if args.composite and len(variants) > 1 and args.input_image.suffix.lower() in vector.DOCUMENT_SUFFIXES:
+        print(f"ERROR: --composite is not supported for {args.input_image.suffix} files")
+        sys.exit (1)
+
+    output_paths = variant_output_paths(args.output_image, variants, args.composite)
+
+    result_cache = None
+    if args.result_cache:
+        result_cache = cache.ResultCache(max_memory_bytes=0,
+                                         cache_dir=args.result_cache_dir or lut.default_cache_dir(),
+                                         max_disk_bytes=args.result_cache_max_size << 20)
+        keys = result_cache_keys(result_cache, args.input_image.read_bytes(), variants, output_paths, args)
+        cached_files = [result_cache.get(key) for key in keys]
+        if all(data is not None for data in cached_files):
+            for path, data in zip(output_paths, cached_files):
+                path.write_bytes(data)
+            return
+
+    output_files = simulate_output_files(args.input_image, variants, output_paths, args)
+    for i, (path, data) in enumerate(zip(output_paths, output_files)):
+        path.write_bytes(data)
+        if result_cache is not None:
+            result_cache.put(keys[i], data)
+
 if __name__ == '__main__':
     main()
@@ -0,0 +1,241 @@
+"""Fused pipelines of color operations.
+
+A Pipeline chains operations on linear RGB colors (color space conversions,
+simulations, gamut fitting, ...) between the decoding and the encoding of an
+image. Instead of running each operation as a separate full-frame pass, the
+consecutive linear and piecewise linear operations are fused into a single
+one, and the whole pipeline runs tile by tile in a single pass over the image:
+
+    p = pipeline.Pipeline()
+    p.add_color_space_conversion(convert.XYZ_from_linearRGB_DisplayP3)
+    p.add_simulation(simulate.Simulator_Brettel1997(), simulate.Deficiency.PROTAN, 0.8)
+    p.add_gamut_fitting()
+    print(p.explain())
+    out = p.apply(im)
+
+The fused operations are represented as region trees: either a 3x3 matrix,
+or a split of the color space by a plane through the origin, with one tree
+for each side (see Simulator._piecewise_linear_rgb_matrices). Composing a
+tree with a matrix or with another tree gives another tree, so only the
+operations that are not piecewise linear (opaque functions like the gamut
+fitting) break the fusion.
+"""
+
+from collections import namedtuple
+
+import numpy as np
+
+from daltonlens import convert, simulate
+
+# Number of pixels processed at once by Pipeline.apply. The float32 linear
+# values of a tile (768 KB) stay in the CPU caches during all the passes.
+DEFAULT_TILE_PIXELS = 1 << 16
+
+# A region tree for the colors c with dot(normal, c) < 0 (below) and the others (above).
+_Split = namedtuple('_Split', ['normal', 'below', 'above'])
+
+def _transform_tree(tree, m):
+    """Region tree of c -> tree(m @ c)."""
+    if not isinstance(tree, _Split):
+        return tree @ m
+    normal = m.T @ tree.normal
+    if not np.any(normal):
+        # dot(normal, c) is always 0, only the above side is left.
+        return _transform_tree(tree.above, m)
+    below = _transform_tree(tree.below, m)
+    above = _transform_tree(tree.above, m)
+    if not isinstance(below, _Split) and not isinstance(above, _Split) and np.array_equal(below, above):
+        return below
+    return _Split(normal / np.max(np.abs(normal)), below, above)
+
+def compose_trees(after, before):
+    """Region tree of c -> after(before(c))."""
+    if isinstance(before, _Split):
+        return _Split(before.normal, compose_trees(after, before.below), compose_trees(after, before.above))
+    return _transform_tree(after, before)
+
+def tree_from_piecewise_linear_rgb_matrices(T1, T2, n):
+    """Region tree of the (T1, T2, n) matrices of Simulator._piecewise_linear_rgb_matrices."""
+    if T2 is None:
+        return np.asarray(T1, dtype=np.float64)
+    return _Split(np.asarray(n, dtype=np.float64), np.asarray(T2, dtype=np.float64), np.asarray(T1, dtype=np.float64))
+
+def count_regions(tree):
+    """Number of matrices of a region tree."""
+    if not isinstance(tree, _Split):
+        return 1
+    return count_regions(tree.below) + count_regions(tree.above)
+
+def _leaves_and_masks(tree, colors, mask):
+    if not isinstance(tree, _Split):
+        yield tree, mask
+        return
+    below = (colors @ tree.normal.astype(colors.dtype, copy=False)) < 0
+    yield from _leaves_and_masks(tree.below, colors, below if mask is None else mask & below)
+    yield from _leaves_and_masks(tree.above, colors, ~below if mask is None else mask & ~below)
+
+def apply_tree(tree, colors):
+    """Apply a region tree to an array of shape (N,3) of linear RGB colors."""
+    leaves = list(_leaves_and_masks(tree, colors, None))
+    # The masks of the leaves partition the colors, so the first one can
+    # be used as the default.
+    out = convert.apply_color_matrix(colors, leaves[0][0])
+    for m, mask in leaves[1:]:
+        np.copyto(out, convert.apply_color_matrix(colors, m), where=mask[:, np.newaxis])
+    return out
+
+class Stage:
+    """An operation of a Pipeline on linear RGB colors.
+
+    Attributes
+    ==========
+    name : str
+        Description of the operation, used by Pipeline.explain.
+
+    tree : 3x3 matrix, region tree or None
+        The operation if it is piecewise linear.
+
+    function : callable or None
+        The operation if it is not piecewise linear. It gets an array of
+        shape (N,3) with dtype float32 and must return the same shape.
+    """
+
+    def __init__(self, name: str, tree=None, function=None):
+        assert (tree is None) != (function is None)
+        self.name = name
+        self.tree = tree
+        self.function = function
+
+    @property
+    def kind(self):
+        """'linear', 'piecewise linear' or 'opaque'."""
+        if self.tree is None:
+            return 'opaque'
+        return 'linear' if not isinstance(self.tree, _Split) else 'piecewise linear'
+
+    def __call__(self, colors):
+        if self.tree is not None:
+            return apply_tree(self.tree, colors)
+        return np.asarray(self.function(colors), dtype=np.float32)
+
+class Pipeline:
+    """Chain of operations on linear RGB colors, fused and run in a single pass.
+
+    Parameters
+    ==========
+    encoding : convert.ImageEncoding
+        Transfer function of the input images.
+
+    output_encoding : convert.ImageEncoding
+        Transfer function of the output images, the same as encoding if None.
+
+    tile_pixels : int
+        Number of pixels processed at once by apply.
+    """
+
+    def __init__(self, encoding: convert.ImageEncoding = convert.ImageEncoding.SRGB,
+                 output_encoding: convert.ImageEncoding = None, tile_pixels: int = DEFAULT_TILE_PIXELS):
+        self.encoding = encoding
+        self.output_encoding = encoding if output_encoding is None else output_encoding
+        self.tile_pixels = tile_pixels
+        self.stages = []
+        self._fused_stages = None
+
+    def add_stage(self, stage: Stage):
+        self.stages.append(stage)
+        self._fused_stages = None
+        return self
+
+    def add_matrix(self, m, name: str = "matrix"):
+        """Add a 3x3 matrix applied to the linear RGB colors."""
+        return self.add_stage(Stage(name, tree=np.asarray(m, dtype=np.float64)))
+
+    def add_function(self, function, name: str = "function"):
+        """Add an arbitrary operation, see Stage.function. It won't be fused with the others."""
+        return self.add_stage(Stage(name, function=function))
+
+    def add_color_space_conversion(self, XYZ_from_linearRGB_input, XYZ_from_linearRGB_output=convert.XYZ_from_linearRGB_BT709,
+                                   name: str = "color space conversion"):
+        """Convert the linear RGB colors to other primaries, e.g. from Display P3 to sRGB."""
+        return self.add_matrix(np.linalg.inv(XYZ_from_linearRGB_output) @ XYZ_from_linearRGB_input, name)
+
+    def add_simulation(self, simulator: simulate.Simulator, deficiency: simulate.Deficiency, severity: float):
+        """Add a CVD simulation, including the severity blend.
+
+        It is applied to the linear colors of the pipeline, so the pipeline
+        encoding should be the imageEncoding of the simulator to get the
+        same result as simulate_cvd.
+        """
+        name = f"{type(simulator).__name__} {simulate.name_of_deficiency(deficiency)} {severity:g}"
+        params = simulator._piecewise_linear_rgb_matrices(deficiency, severity)
+        if params is not None:
+            return self.add_stage(Stage(name, tree=tree_from_piecewise_linear_rgb_matrices(*params)))
+        # Simulators expect an image, so use a single-row one.
+        return self.add_function(lambda colors: simulator._simulate_cvd_linear_rgb(colors[np.newaxis], deficiency, severity)[0], name)
+
+    def add_gamut_fitting(self):
+        """Desaturate the colors to fit in [0,1], see convert.desaturate_linearRGB_to_fit_in_gamut."""
+        return self.add_function(convert.desaturate_linearRGB_to_fit_in_gamut, "gamut fitting")
+
+    def fused_stages(self):
+        """Return the stages after fusing the consecutive piecewise linear ones."""
+        if self._fused_stages is None:
+            fused = []
+            for stage in self.stages:
+                if stage.tree is not None and fused and fused[-1].tree is not None:
+                    previous = fused.pop()
+                    stage = Stage(f"{previous.name} + {stage.name}", tree=compose_trees(stage.tree, previous.tree))
+                fused.append(stage)
+            self._fused_stages = fused
+        return self._fused_stages
+
+    def explain(self):
+        """Return a description of the fused passes, for debugging."""
+        fused = self.fused_stages()
+        lines = [f"{len(self.stages)} stages fused into {len(fused)} passes, tiles of {self.tile_pixels} pixels:",
+                 f"  decode {self.encoding.name}"]
+        for i, stage in enumerate(fused):
+            kind = stage.kind
+            if stage.tree is not None and kind != 'linear':
+                kind += f" ({count_regions(stage.tree)} regions)"
+            lines.append(f"  pass {i+1}: {kind}: {stage.name}")
+        lines.append(f"  encode {self.output_encoding.name}")
+        return '\n'.join(lines)
+
+    def apply(self, image_uint8, out=None):
+        """Run the pipeline on an image.
+
+        Parameters
+        ==========
+        image_uint8 : array of shape (...,3) with dtype uint8
+            The input image, with the pipeline encoding.
+
+        out : contiguous array of shape (...,3) with dtype uint8
+            Where to write the result, allocated if None. It can be
+            image_uint8 itself.
+
+        Returns
+        =======
+        out : array of shape (...,3) with dtype uint8
+            The output image, with the pipeline output encoding.
+        """
+        im = np.asarray(image_uint8)
+        if out is None:
+            out = np.empty(im.shape, dtype=np.uint8)
+        elif not out.flags.c_contiguous:
+            raise ValueError("out must be a contiguous array")
+        pixels = im.reshape(-1, 3)
+        out_pixels = out.reshape(-1, 3)
+
+        fused = self.fused_stages()
+        decode = convert.linearRGB_table_from_uint8(self.encoding)
+        for start in range(0, pixels.shape[0], self.tile_pixels):
+            colors = decode[pixels[start:start + self.tile_pixels]]
+            for stage in fused:
+                colors = stage(colors)
+            if self.output_encoding in convert.HDR_ENCODINGS:
+                encoded = convert.uint8_from_linearRGB_float16_table(colors, self.output_encoding)
+            else:
+                encoded = convert.as_uint8(convert.encoding_from_linearRGB(colors, self.output_encoding))
+            out_pixels[start:start + self.tile_pixels] = encoded
+        return out
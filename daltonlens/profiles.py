@@ -0,0 +1,171 @@
+"""Per-user CVD profiles with a memory-budgeted cache of compiled simulations.
+
+Each user has a profile (model, deficiency, severity). The simulations are
+compiled on demand and shared by all the users with the same profile:
+piecewise linear simulators only need their matrices (a few hundred bytes),
+the others get a compact lookup table (see lut.compute_compact_lut). The
+severities are quantized to buckets so that close profiles share the same
+entry, and the least recently used entries are evicted when the total goes
+above the memory budget:
+
+    store = ProfileStore(max_memory_bytes=64 << 20, severity_buckets=20)
+    store.set_profile("alice", "machado", simulate.Deficiency.DEUTAN, 0.63)
+    out = store.simulate_cvd("alice", im)
+    print(store.stats())
+"""
+
+import threading
+from collections import OrderedDict, namedtuple
+
+import numpy as np
+
+from daltonlens import lut, simulate
+from daltonlens.simulate import simulator_from_str
+
+Profile = namedtuple('Profile', ['model', 'deficiency', 'severity'])
+
+class CompiledProfile:
+    """A profile compiled to a set of matrices or to a compact lookup table.
+
+    Attributes
+    ==========
+    profile : Profile
+        The profile, with the quantized severity.
+
+    compiled : simulate.CompiledSimulation or None
+        The compiled simulation of piecewise linear simulators.
+
+    lut : array of shape (S,S,S,3) with dtype float32 or None
+        The compact lookup table of the other simulators.
+
+    nbytes : int
+        Memory used by the matrices or the table. The compiled simulations
+        apply their own matrices, they don't grow the caches of the
+        simulators while simulating.
+    """
+
+    def __init__(self, profile: Profile, simulator: simulate.Simulator, lut_size: int):
+        self.profile = profile
+        self.compiled = simulator.compile(profile.deficiency, profile.severity)
+        self.lut = None
+        if self.compiled.linear_rgb_matrices is not None:
+            self.nbytes = self.compiled.nbytes
+        else:
+            self.compiled = None
+            self.lut = lut.compute_compact_lut(simulator, profile.deficiency, profile.severity, lut_size)
+            self.nbytes = self.lut.nbytes
+
+    def simulate_cvd(self, image_srgb_uint8, precision: str = 'float32'):
+        """Simulate an (M,N,3) uint8 image. The lookup tables ignore the precision."""
+        if self.compiled is not None:
+            return self.compiled.simulate_cvd(image_srgb_uint8, precision=precision)
+        return lut.apply_compact_lut(self.lut, np.asarray(image_srgb_uint8))
+
+class ProfileStore:
+    """Registry of user profiles, with an LRU cache of their compiled simulations.
+
+    All the methods are thread-safe.
+
+    Parameters
+    ==========
+    max_memory_bytes : int
+        Budget of the compiled simulations. The least recently used ones are
+        evicted above it.
+
+    severity_buckets : int
+        The severities are rounded to multiples of 1/severity_buckets. 0
+        disables the quantization.
+
+    lut_size : int
+        Size of the compact lookup tables of the simulators that are not
+        piecewise linear (431 KB per table for 33). CoblisV2 is not smooth
+        across hues, so some colors can be ~10 levels off whatever the size,
+        see lut.compact_lut_max_error.
+
+    simulators : dict
+        Simulator of each model name. Defaults to the models of the command
+        line (vienot, brettel, machado, ...).
+    """
+
+    def __init__(self, max_memory_bytes: int = 64 << 20, severity_buckets: int = 20, lut_size: int = 33, simulators=None):
+        self.max_memory_bytes = max_memory_bytes
+        self.severity_buckets = severity_buckets
+        self.lut_size = lut_size
+        self.simulators = simulator_from_str if simulators is None else simulators
+        self._profiles = {}
+        self._entries = OrderedDict()
+        self._memory_bytes = 0
+        self._lock = threading.Lock()
+        self._stats = dict(hits=0, misses=0, evictions=0)
+
+    def quantize_severity(self, severity: float):
+        if self.severity_buckets <= 0:
+            return float(severity)
+        return round(min(max(severity, 0.0), 1.0) * self.severity_buckets) / self.severity_buckets
+
+    def set_profile(self, user, model: str, deficiency: simulate.Deficiency, severity: float):
+        """Set or replace the profile of a user."""
+        if model not in self.simulators:
+            raise ValueError(f"Invalid model '{model}', expected one of {list(self.simulators.keys())}")
+        with self._lock:
+            self._profiles[user] = Profile(model, deficiency, float(severity))
+
+    def remove_profile(self, user):
+        with self._lock:
+            self._profiles.pop(user, None)
+
+    def profile(self, user):
+        """Return the Profile of a user, raises KeyError if there is none."""
+        with self._lock:
+            return self._profiles[user]
+
+    def compiled(self, model: str, deficiency: simulate.Deficiency, severity: float):
+        """Return the CompiledProfile of a (model, deficiency, severity), compiling it if needed."""
+        profile = Profile(model, deficiency, self.quantize_severity(severity))
+        with self._lock:
+            entry = self._entries.get(profile)
+            if entry is not None:
+                self._entries.move_to_end(profile)
+                self._stats['hits'] += 1
+                return entry
+            self._stats['misses'] += 1
+
+        # Compile without holding the lock, concurrent misses on the same
+        # profile just compile it twice.
+        entry = CompiledProfile(profile, self.simulators[model], self.lut_size)
+        with self._lock:
+            self._insert(profile, entry)
+        return entry
+
+    def simulate_cvd(self, user, image_srgb_uint8, precision: str = 'float32'):
+        """Simulate an image with the profile of a user."""
+        return self.compiled(*self.profile(user)).simulate_cvd(image_srgb_uint8, precision)
+
+    def stats(self):
+        """Return the hit/miss counters and the memory used by the compiled simulations."""
+        with self._lock:
+            stats = dict(self._stats)
+            stats['users'] = len(self._profiles)
+            stats['entries'] = len(self._entries)
+            stats['memory_bytes'] = self._memory_bytes
+        lookups = stats['hits'] + stats['misses']
+        stats['hit_rate'] = stats['hits'] / lookups if lookups > 0 else 0.0
+        return stats
+
+    def clear(self):
+        """Remove all the compiled simulations, the profiles are kept."""
+        with self._lock:
+            self._entries.clear()
+            self._memory_bytes = 0
+
+    def _insert(self, profile: Profile, entry: CompiledProfile):
+        if entry.nbytes > self.max_memory_bytes:
+            return
+        if profile in self._entries:
+            self._memory_bytes -= self._entries.pop(profile).nbytes
+        self._entries[profile] = entry
+        self._memory_bytes += entry.nbytes
+        while self._memory_bytes > self.max_memory_bytes:
+            _, evicted = self._entries.popitem(last=False)
+            self._memory_bytes -= evicted.nbytes
+            self._stats['evictions'] += 1
@@ -0,0 +1,259 @@
+"""Long-running simulation server.
+
+Starting the interpreter and importing numpy for every image costs much more
+than simulating it. This module keeps a process alive with warm simulators
+and serves simulations over HTTP:
+
+    POST /simulate?deficiency=protan&severity=1.0&model=auto&format=png
+        The body is the encoded input image (any format PIL can read), the
+        response is the encoded simulated image. Invalid parameters or
+        images that can't be decoded give a 400, bodies larger than
+        max_body_bytes a 413.
+
+    GET /metrics
+        JSON with the request counters and the latency histogram.
+
+    GET /health
+        Returns 'ok'.
+
+Start it with `daltonlens-python --serve 8000`.
+"""
+
+import io
+import json
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from urllib.parse import urlparse, parse_qs
+
+from PIL import Image
+
+from daltonlens import lut, simulate
+from daltonlens.simulate import deficiency_from_str, simulator_from_str, simulate_palette_image
+from daltonlens.utils import LRUCache, rgb_array
+
+class LatencyHistogram:
+    """Thread-safe histogram of request latencies, with fixed buckets in milliseconds."""
+
+    bucket_upper_bounds_ms = [1, 2, 5, 10, 20, 50, 100, 200, 500, 1000, 2000, 5000, 10000, float('inf')]
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self.counts = [0] * len(self.bucket_upper_bounds_ms)
+        self.total_count = 0
+        self.total_seconds = 0.0
+
+    def record(self, seconds: float):
+        ms = seconds * 1e3
+        bucket = next(i for i, bound in enumerate(self.bucket_upper_bounds_ms) if ms <= bound)
+        with self._lock:
+            self.counts[bucket] += 1
+            self.total_count += 1
+            self.total_seconds += seconds
+
+    def snapshot(self):
+        with self._lock:
+            return {
+                'buckets_ms': {('+inf' if bound == float('inf') else str(bound)): count
+                               for bound, count in zip(self.bucket_upper_bounds_ms, self.counts)},
+                'count': self.total_count,
+                'mean_ms': (self.total_seconds / self.total_count * 1e3) if self.total_count else 0.0,
+            }
+
+class SimulationServer:
+    """HTTP server with a persistent pool of simulation workers.
+
+    Requests are decoded, simulated and encoded in a pool of num_workers
+    threads (numpy and PIL release the GIL for the heavy work). At most
+    num_workers + max_queue_size requests are accepted at the same time,
+    the others are rejected immediately with a 503 so clients can back off
+    instead of piling up memory on the server.
+
+    Parameters
+    ==========
+    host, port : str, int
+        Address to listen to. Use port 0 to pick a free port, the actual
+        one is then in server_address.
+
+    num_workers : int
+        Number of simulation threads.
+
+    max_queue_size : int
+        Number of requests that can wait for a worker.
+
+    max_body_bytes : int
+        Requests with a larger body are rejected with a 413 before reading it.
+
+    use_lut_cache : bool
+        Simulate with lookup tables from lut.LUTCache. They are loaded once
+        per model / deficiency / severity and then kept in memory.
+
+    max_luts : int
+        Number of lookup tables kept in memory, the least recently used ones
+        get dropped. Each one takes 48 MB.
+    """
+
+    def __init__(self, host: str = '127.0.0.1', port: int = 8000,
+                 num_workers: int = 4, max_queue_size: int = 16,
+                 max_body_bytes: int = 64 << 20,
+                 use_lut_cache: bool = False, lut_cache_dir = None, max_luts: int = 4):
+        self.executor = ThreadPoolExecutor(max_workers=num_workers, thread_name_prefix='daltonlens-worker')
+        self.latencies = LatencyHistogram()
+        self.max_body_bytes = max_body_bytes
+        self.use_lut_cache = use_lut_cache
+        self._lut_cache = lut.LUTCache(lut_cache_dir) if use_lut_cache else None
+        self._luts = LRUCache(max_luts)
+        self._slots = threading.BoundedSemaphore(num_workers + max_queue_size)
+        self._counters_lock = threading.Lock()
+        self.counters = {'requests': 0, 'rejected': 0, 'errors': 0, 'in_flight': 0}
+        self.httpd = ThreadingHTTPServer((host, port), self._make_handler())
+        self.httpd.daemon_threads = True
+
+    @property
+    def server_address(self):
+        return self.httpd.server_address
+
+    def serve_forever(self):
+        self.httpd.serve_forever()
+
+    def shutdown(self):
+        self.httpd.shutdown()
+        self.httpd.server_close()
+        self.executor.shutdown(wait=True)
+
+    def metrics(self):
+        with self._counters_lock:
+            metrics = dict(self.counters)
+        metrics['latency'] = self.latencies.snapshot()
+        return metrics
+
+    def _increment(self, name: str, delta: int = 1):
+        with self._counters_lock:
+            self.counters[name] += delta
+
+    def _lut(self, model: str, deficiency: simulate.Deficiency, severity: float):
+        # Loaded outside of any lock, concurrent misses on the same key just
+        # load it twice.
+        return self._luts.get((model, deficiency, severity),
+                              lambda: self._lut_cache.get(simulator_from_str[model], deficiency, severity))
+
+    def process(self, image_bytes: bytes, model: str, deficiency: simulate.Deficiency, severity: float, format: str):
+        """Decode, simulate and encode one image. Runs in a worker thread."""
+        simulator = simulator_from_str[model]
+        pil_im = Image.open(io.BytesIO(image_bytes))
+        if pil_im.mode == 'P' and format.lower() != 'jpeg':
+            out_im = simulate_palette_image(pil_im, simulator, deficiency, severity)
+        else:
+            im = rgb_array(pil_im)
+            if self.use_lut_cache:
+                out = lut.apply_lut(self._lut(model, deficiency, severity), im)
+            else:
+                out = simulator.simulate_cvd(im, deficiency, severity, max_unique_colors=4096)
+            out_im = Image.fromarray(out)
+        output = io.BytesIO()
+        out_im.save(output, format=format)
+        return output.getvalue()
+
+    def _make_handler(self):
+        server = self
+
+        class Handler(BaseHTTPRequestHandler):
+            protocol_version = 'HTTP/1.1'
+
+            def log_message(self, format, *args):
+                pass
+
+            def _reply(self, code: int, body: bytes, content_type: str, extra_headers=None):
+                self.send_response(code)
+                self.send_header('Content-Type', content_type)
+                self.send_header('Content-Length', str(len(body)))
+                for name, value in (extra_headers or {}).items():
+                    self.send_header(name, value)
+                self.end_headers()
+                self.wfile.write(body)
+
+            def _reply_error(self, code: int, message: str, extra_headers=None):
+                self._reply(code, json.dumps({'error': message}).encode(), 'application/json', extra_headers)
+
+            def _reject(self, code: int, message: str, extra_headers=None):
+                # The request body was not read, so the connection can't be reused.
+                self.close_connection = True
+                self._reply_error(code, message, {**(extra_headers or {}), 'Connection': 'close'})
+
+            def do_GET(self):
+                path = urlparse(self.path).path
+                if path == '/metrics':
+                    self._reply(200, json.dumps(server.metrics()).encode(), 'application/json')
+                elif path == '/health':
+                    self._reply(200, b'ok', 'text/plain')
+                else:
+                    self._reply_error(404, f"Unknown path {path}")
+
+            def do_POST(self):
+                # Everything that can be checked from the request line and the
+                # headers is checked before reading the body.
+                url = urlparse(self.path)
+                if url.path != '/simulate':
+                    self._reject(404, f"Unknown path {url.path}")
+                    return
+
+                query = {k: v[-1] for k, v in parse_qs(url.query).items()}
+                try:
+                    model = query.get('model', 'auto')
+                    deficiency = deficiency_from_str[query.get('deficiency', 'protan')]
+                    severity = float(query.get('severity', 1.0))
+                    format = query.get('format', 'png').upper()
+                    Image.init()
+                    if model not in simulator_from_str or not (0.0 <= severity <= 1.0) or format not in Image.SAVE:
+                        raise ValueError()
+                except (KeyError, ValueError):
+                    self._reject(400, "Invalid parameters, expected deficiency=protan|deutan|tritan, severity in [0,1], "
+                                      f"model in {list(simulator_from_str.keys())} and a format PIL can write")
+                    return
+
+                try:
+                    content_length = int(self.headers['Content-Length'])
+                    if content_length < 0:
+                        raise ValueError()
+                except (TypeError, ValueError):
+                    self._reject(400, "Missing or invalid Content-Length")
+                    return
+                if content_length > server.max_body_bytes:
+                    self._reject(413, f"Request body larger than {server.max_body_bytes} bytes")
+                    return
+
+                server._increment('requests')
+                if not server._slots.acquire(blocking=False):
+                    server._increment('rejected')
+                    self._reject(503, "Too many requests in flight", {'Retry-After': '1'})
+                    return
+
+                start = time.perf_counter()
+                server._increment('in_flight')
+                try:
+                    try:
+                        body = self.rfile.read(content_length)
+                    except OSError:
+                        body = b''
+                    if len(body) < content_length:
+                        # The client went away before sending everything.
+                        self.close_connection = True
+                        return
+                    future = server.executor.submit(server.process, body, model, deficiency, severity, format)
+                    output = future.result()
+                except (OSError, Image.DecompressionBombError) as e:
+                    server._increment('errors')
+                    self._reply_error(400, f"Could not decode the image: {e}")
+                    return
+                except Exception as e:
+                    server._increment('errors')
+                    self._reply_error(500, f"Internal error: {e}")
+                    return
+                finally:
+                    server._increment('in_flight', -1)
+                    server._slots.release()
+                server.latencies.record(time.perf_counter() - start)
+                self._reply(200, output, Image.MIME.get(format, 'application/octet-stream'))
+
+        return Handler
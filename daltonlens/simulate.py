@@ -1,14 +1,17 @@
-from daltonlens import convert
-from daltonlens.utils import array_to_C_decl, normalized
+from daltonlens import backends, chunked, convert
+from daltonlens.utils import LRUCache, array_to_C_decl, normalized
 
 from collections import namedtuple
 
+import logging
 import math
 import numpy as np
 import sys
 
 from abc import ABC, abstractmethod
 
+logger = logging.getLogger(__name__)
+
 from enum import Enum
 class Deficiency(Enum):
     PROTAN = 0
@@ -19,53 +22,683 @@ def name_of_deficiency(d: Deficiency):
     if d == Deficiency.PROTAN: return "protan"
     if d == Deficiency.DEUTAN: return "deutan"
     if d == Deficiency.TRITAN: return "tritan"
+
+deficiency_from_str = {
+    'protan': Deficiency.PROTAN,
+    'deutan': Deficiency.DEUTAN,
+    'tritan': Deficiency.TRITAN,
+}
+
+# Supported values for the precision argument of Simulator.simulate_cvd
+PRECISIONS = ('float32', 'float16', 'fixed')
+
+# Number of fractional bits of the fixed-point matrix coefficients.
+FIXED_POINT_BITS = 12
+
+# Number of (deficiency, severity) matrices kept by each simulator, see
+# Simulator.cvd_linear_rgb_matrix. Callers like severity sliders go through
+# many distinct severities, the oldest ones get recomputed if needed.
+MATRIX_CACHE_SIZE = 256
+
+# Supported values for the layout and channel_order arguments of Simulator.simulate_cvd
+LAYOUTS = ('HWC', 'CHW')
+CHANNEL_ORDERS = ('RGB', 'BGR')
+
+def channel_axis_of_layout(layout: str):
+    """Axis of the color channels: -1 for 'HWC', -3 for 'CHW' (so batches NHWC/NCHW work too)."""
+    if layout not in LAYOUTS:
+        raise ValueError(f"Invalid layout '{layout}', expected one of {LAYOUTS}")
+    return -1 if layout == 'HWC' else -3
+
+def permute_piecewise_linear_rgb_matrices(T1, T2, n, channel_order: str):
+    """Fold the channel order into the matrices, so they apply directly to e.g. BGR values."""
+    if channel_order not in CHANNEL_ORDERS:
+        raise ValueError(f"Invalid channel order '{channel_order}', expected one of {CHANNEL_ORDERS}")
+    if channel_order == 'RGB':
+        return T1, T2, n
+    p = [2, 1, 0]
+    return T1[p][:, p], None if T2 is None else T2[p][:, p], None if n is None else n[p]
+
+def _channel_planes(image, channel_axis: int, out):
+    """Views of the 3 channels of the input, and of the output, allocated if None."""
+    image = np.asarray(image)
+    if out is None:
+        out = np.empty(image.shape, dtype=np.uint8)
+    return np.moveaxis(image, channel_axis, 0), out, np.moveaxis(out, channel_axis, 0)
+
+# Above that many pixels, simulate_cvd_unique_colors finds the unique colors
+# with tables over the whole RGB space instead of sorting the pixels.
+_MAX_PIXELS_TO_SORT = 1 << 19
+
+def _packed_rgb(pixels):
+    """Pack an (N,3) uint8 array into (N,) uint32 0xRRGGBB values."""
+    return (pixels[:,0].astype(np.uint32) << 16) | (pixels[:,1].astype(np.uint32) << 8) | pixels[:,2]
+
+def apply_piecewise_linear_rgb_matrices_float32(image_srgb_uint8, T1, T2, n, encoding: convert.ImageEncoding,
+                                                channel_axis: int = -1, out=None):
+    """Planar implementation of a (piecewise) linear simulation.
+
+    The channels are decoded with a lookup table, so they do not need to be
+    contiguous nor in the last axis. The products are computed like the
+    default path of Simulator.simulate_cvd and the output is identical up
+    to rounding. Same parameters as apply_piecewise_linear_rgb_matrices_fixed_point.
+    """
+    planes, out, out_planes = _channel_planes(image_srgb_uint8, channel_axis, out)
+    decode = convert.linearRGB_table_from_uint8(encoding)
+    linear = np.empty((3,) + planes.shape[1:], dtype=np.float32)
+    for c in range(3):
+        np.take(decode, planes[c], out=linear[c], mode='clip')
+    im_cvd = convert.apply_color_matrix(linear, T1, channel_axis=0)
+    if T2 is not None:
+        use_T2 = np.tensordot(np.asarray(n, dtype=linear.dtype), linear, axes=(0, 0)) < 0
+        np.copyto(im_cvd, convert.apply_color_matrix(linear, T2, channel_axis=0), where=use_T2)
+    out_planes[...] = convert.as_uint8(convert.encoding_from_linearRGB(im_cvd, encoding))
+    return out
+
+def apply_piecewise_linear_rgb_matrices_fixed_point(image_srgb_uint8, T1, T2, n, encoding: convert.ImageEncoding,
+                                                    channel_axis: int = -1, out=None):
+    """Integer implementation of a (piecewise) linear simulation.
+
+    The image is decoded to 16-bit linear RGB with a lookup table, the
+    matrices are applied with FIXED_POINT_BITS coefficients and int32
+    accumulators, and the result is encoded back with a 65536 entries table.
+    Pixels with dot(n, rgb) < 0 use T2, the others T1. T2 and n can be None
+    for purely linear simulations.
+
+    The channels are processed as separate planes, so channel_axis can be
+    any axis of the image, with any strides. The output has the same layout,
+    and is written to out if given.
+
+    Returns None if the coefficients are too large for int32 accumulators.
+    """
+    scale = 1 << FIXED_POINT_BITS
+    max_row_sum = max(np.max(np.sum(np.abs(T), axis=1)) for T in (T1, T2) if T is not None)
+    if max_row_sum * convert.LINEAR_UINT16_SCALE * scale >= 2**31 - scale:
+        return None
+
+    decode = convert.linearRGB_uint16_table_from_uint8(encoding)
+    encode = convert.uint8_table_from_linearRGB_uint16(encoding)
+    planes, out, out_planes = _channel_planes(image_srgb_uint8, channel_axis, out)
+    channels = [decode[planes[c]] for c in range(3)]
+    acc = np.empty(channels[0].shape, dtype=np.int32)
+    tmp = np.empty_like(acc)
+
+    def dot(coefs, out):
+        # The products are done in int32 directly from the uint16 channels.
+        np.multiply(channels[0], coefs[0], out=out, dtype=np.int32)
+        for c in (1, 2):
+            np.multiply(channels[c], coefs[c], out=tmp, dtype=np.int32)
+            out += tmp
+        return out
+
+    use_T2 = None
+    if T2 is not None:
+        n_q = np.round(n / np.max(np.abs(n)) * scale).astype(np.int32)
+        use_T2 = dot(n_q, acc) < 0
+        acc2 = np.empty_like(acc)
+
+    T1_q = np.round(np.asarray(T1) * scale).astype(np.int32)
+    T2_q = None if T2 is None else np.round(np.asarray(T2) * scale).astype(np.int32)
+    for c in range(3):
+        dot(T1_q[c], acc)
+        if use_T2 is not None:
+            np.copyto(acc, dot(T2_q[c], acc2), where=use_T2)
+        acc += scale >> 1
+        acc >>= FIXED_POINT_BITS
+        np.clip(acc, 0, convert.LINEAR_UINT16_SCALE, out=acc)
+        out_planes[c] = encode[acc]
+    return out
+
+def apply_piecewise_linear_rgb_matrices_float16(image_srgb_uint8, T1, T2, n, encoding: convert.ImageEncoding,
+                                                channel_axis: int = -1, out=None):
+    """float16 implementation of a (piecewise) linear simulation.
+
+    Same as apply_piecewise_linear_rgb_matrices_fixed_point, but the linear
+    values and the products are float16. The output is encoded with a table
+    indexed by the float16 bit patterns.
+    """
+    decode = convert.linearRGB_table_from_uint8(encoding).astype(np.float16)
+    encode = convert.uint8_table_from_linearRGB_float16(encoding)
+    planes, out, out_planes = _channel_planes(image_srgb_uint8, channel_axis, out)
+    channels = [decode[planes[c]] for c in range(3)]
+    acc = np.empty(channels[0].shape, dtype=np.float16)
+    tmp = np.empty_like(acc)
+
+    def dot(coefs, out):
+        np.multiply(channels[0], np.float16(coefs[0]), out=out)
+        for c in (1, 2):
+            np.multiply(channels[c], np.float16(coefs[c]), out=tmp)
+            out += tmp
+        return out
+
+    use_T2 = None
+    if T2 is not None:
+        use_T2 = dot(n / np.max(np.abs(n)), acc) < 0
+        acc2 = np.empty_like(acc)
+
+    for c in range(3):
+        dot(T1[c], acc)
+        if use_T2 is not None:
+            np.copyto(acc, dot(T2[c], acc2), where=use_T2)
+        out_planes[c] = encode[acc.view(np.uint16)]
+    return out
+
 class Simulator (ABC):
-    """Base class for all CVD simulators."""
+    """Base class for all CVD simulators.
+
+    Simulators don't modify themselves while simulating, except for their
+    matrix caches (see cvd_linear_rgb_matrix). These are bounded and
+    thread-safe, so a single instance can be shared between threads. Use
+    compile to get a simulation that does not go through them.
+    """
 
     def __init__(self):
         self.dumpPrecomputedValues = False
         self.imageEncoding = convert.ImageEncoding.SRGB
+        # (deficiency, severity, model parameters) -> linear RGB matrix, see cvd_linear_rgb_matrix
+        self._cvd_matrix_cache = LRUCache(MATRIX_CACHE_SIZE)
+        # (key, dtype, model parameters) -> matrices, see _matrices_as
+        self._typed_matrix_cache = LRUCache(MATRIX_CACHE_SIZE)
 
-    def simulate_cvd (self, image_srgb_uint8, deficiency: Deficiency, severity: float):
+    def simulate_cvd (self, image_srgb_uint8, deficiency: Deficiency, severity: float, max_unique_colors: int = 0, precision: str = 'float32',
+                      layout: str = 'HWC', channel_order: str = 'RGB'):
         """Simulate the appearance of an image for the given color vision deficiency
     
         Parameters
         ==========
         image_srgb_uint8 : array of shape (M,N,3) with dtype uint8
-            The input sRGB image, with values in [0,255].
+            The input image, with values in [0,255]. It is sRGB by default,
+            see the imageEncoding and color model of the simulator. Dask arrays and
+            xarray DataArrays get simulated lazily block by block, see
+            chunked.simulate_cvd_chunked. With the HDR encodings (PQ, HLG) it
+            can also be uint16, with the code values scaled to [0,65535],
+            e.g. 10-bit values shifted left by 6. Other dtypes raise a
+            ValueError with these encodings.
 
         deficiency: Deficiency
             The deficiency to simulate.
 
         severity: float
             The severity between 0 (normal vision) and 1 (complete dichromacy).
-    
+
+        max_unique_colors: int
+            If > 0, images with at most that many distinct colors (flat UI
+            graphics, charts, etc.) only get their unique colors simulated and
+            the result is remapped to the pixels. Must be <= 65536. The output
+            is the same up to rounding, it's just much faster on these images.
+
+        precision: str
+            'float32' (default), 'float16' or 'fixed'. The reduced precisions
+            use 2 bytes per channel instead of 4 for the intermediate values,
+            and lookup tables for the transfer functions. 'fixed' does the
+            matrix products with integers (16-bit linear values, 12-bit
+            coefficients) and is also several times faster. 'float16' only
+            saves memory, numpy has no fast float16 arithmetic. Both stay
+            within 1 level of the float32 output, but are only available for the simulators that can be
+            written as matrices on linear RGB (Viénot, Brettel, Vischeck,
+            Machado, CoblisV1 and AutoSelect) and the SDR encodings. The others silently use float32.
+
+        layout: str
+            'HWC' (default) for channels in the last axis, or 'CHW' for
+            planar images with the channels in the third to last axis
+            (e.g. (3,M,N) or (B,3,M,N)). The image can have any strides,
+            e.g. flipped views, it does not need to be contiguous.
+
+        channel_order: str
+            'RGB' (default) or 'BGR', e.g. for OpenCV images.
+
         Returns
         =======
         im : array of shape (M,N,3) with dtype uint8
-            The simulated sRGB image with values in [0,255].
+            The simulated sRGB image with values in [0,255], with the layout
+            and channel order of the input. uint16 for uint16 HDR inputs.
+        """
+        if precision not in PRECISIONS:
+            raise ValueError(f"Invalid precision '{precision}', expected one of {PRECISIONS}")
+
+        if chunked.is_dask_array(image_srgb_uint8) or chunked.is_xarray(image_srgb_uint8):
+            return chunked.simulate_cvd_chunked(image_srgb_uint8, self, deficiency, severity, max_unique_colors, precision,
+                                                layout, channel_order)
+
+        if layout != 'HWC' or channel_order != 'RGB':
+            return self._simulate_cvd_planes(image_srgb_uint8, deficiency, severity, max_unique_colors, precision, layout, channel_order)
+
+        if max_unique_colors > 0:
+            im_cvd = self.simulate_cvd_unique_colors(image_srgb_uint8, deficiency, severity, max_unique_colors)
+            if im_cvd is not None:
+                return im_cvd
+
+        if precision != 'float32' and self.imageEncoding not in convert.HDR_ENCODINGS:
+            # The reduced precisions are too coarse near black for the HDR transfer functions.
+            params = self._piecewise_linear_rgb_matrices(deficiency, severity)
+            if params is not None:
+                im = np.asarray(image_srgb_uint8)
+                if precision == 'fixed':
+                    im_cvd = apply_piecewise_linear_rgb_matrices_fixed_point(im, *params, self.imageEncoding)
+                else:
+                    im_cvd = apply_piecewise_linear_rgb_matrices_float16(im, *params, self.imageEncoding)
+                if im_cvd is not None:
+                    return im_cvd
+
+        if self.has_fused_kernel(deficiency, severity):
+            params = self._piecewise_linear_rgb_matrices(deficiency, severity)
+            return backends.current().simulate_piecewise_linear_uint8(np.asarray(image_srgb_uint8), self.imageEncoding, *params)
+
+        im_linear_rgb = self.linearRGB_from_image(image_srgb_uint8)
+        im_cvd_linear_rgb = self.simulate_cvd_linear_rgb(im_linear_rgb, deficiency, severity)
+        return self.image_from_linearRGB(im_cvd_linear_rgb, self._output_dtype(np.asarray(image_srgb_uint8).dtype))
+
+    def _output_dtype (self, input_dtype):
+        """Dtype of simulate_cvd outputs: uint16 for uint16 HDR images, uint8 otherwise."""
+        if self.imageEncoding in convert.HDR_ENCODINGS and input_dtype == np.uint16:
+            return np.uint16
+        return np.uint8
+
+    def has_fused_kernel (self, deficiency: Deficiency, severity: float):
+        """True if simulate_cvd goes through a single kernel of the current backend for this image encoding, deficiency and severity.
+
+        It then never materializes the linear RGB image, so there is nothing
+        to gain from calling linearRGB_from_image once for several simulations.
         """
-        im_linear_rgb = convert.as_float32(image_srgb_uint8)        
-        if (self.imageEncoding == convert.ImageEncoding.SRGB):
-            im_linear_rgb = convert.linearRGB_from_sRGB(im_linear_rgb)
-        elif (self.imageEncoding == convert.ImageEncoding.GAMMA_22):
-            im_linear_rgb = convert.linearRGB_from_gamma22(im_linear_rgb)
+        return (self.imageEncoding not in convert.HDR_ENCODINGS
+                and backends.current().simulate_piecewise_linear_uint8 is not None
+                and self._piecewise_linear_rgb_matrices(deficiency, severity) is not None)
 
-        im_cvd_linear_rgb = self._simulate_cvd_linear_rgb(im_linear_rgb, deficiency, severity)
-        
-        if (self.imageEncoding == convert.ImageEncoding.SRGB):
-            im_cvd_float = convert.sRGB_from_linearRGB(im_cvd_linear_rgb)
-        elif (self.imageEncoding == convert.ImageEncoding.GAMMA_22):
-            im_cvd_float = convert.gamma22_from_linearRGB(im_cvd_linear_rgb)
+    def linearRGB_from_image (self, image_srgb_uint8):
+        """Decode an image in the encoding of the simulator to linear RGB.
+
+        With simulate_cvd_linear_rgb and image_from_linearRGB, this splits
+        simulate_cvd (float32 precision, HWC RGB layout) in its three steps,
+        so that several deficiencies or severities can share a single
+        decoding of the image. It uses the current backend like simulate_cvd.
+
+        Parameters
+        ==========
+        image_srgb_uint8 : array of shape (M,N,3) with dtype uint8
+            The input image, see simulate_cvd. It can be uint16 with the HDR encodings.
+
+        Returns
+        =======
+        im : array of shape (M,N,3) with dtype float32
+            The linear RGB image.
+        """
+        if self.imageEncoding in convert.HDR_ENCODINGS:
+            # Lookup tables for the transfer function, much faster than evaluating it.
+            im = np.asarray(image_srgb_uint8)
+            if im.dtype == np.uint8:
+                return convert.linearRGB_table_from_uint8(self.imageEncoding)[im]
+            if im.dtype == np.uint16:
+                return convert.linearRGB_table_from_uint16(self.imageEncoding)[im]
+            raise ValueError(f"Images in the {self.imageEncoding.name} encoding must be uint8 or uint16, got {im.dtype}")
+        return backends.current().linearRGB_from_encoding(convert.as_float32(image_srgb_uint8), self.imageEncoding)
+
+    def simulate_cvd_linear_rgb (self, image_linear_rgb, deficiency: Deficiency, severity: float):
+        """Simulate a deficiency on an image that is already linear RGB, see linearRGB_from_image.
+
+        Float32 and float16 inputs stay in their dtype.
+        """
+        return self._simulate_cvd_linear_rgb(image_linear_rgb, deficiency, severity)
+
+    def image_from_linearRGB (self, image_linear_rgb, dtype=np.uint8):
+        """Encode a linear RGB image back to the encoding of the simulator, see linearRGB_from_image.
+
+        dtype can be np.uint16 with the HDR encodings, the output is then scaled to [0,65535].
+        """
+        if np.dtype(dtype) == np.uint16:
+            if self.imageEncoding not in convert.HDR_ENCODINGS:
+                raise ValueError("uint16 images are only supported with the HDR encodings")
+            # No table for 16-bit outputs, float16 is too coarse for them.
+            return convert.as_uint16(backends.current().encoding_from_linearRGB(image_linear_rgb, self.imageEncoding))
+        if self.imageEncoding in convert.HDR_ENCODINGS:
+            return convert.uint8_from_linearRGB_float16_table(image_linear_rgb, self.imageEncoding)
+        return convert.as_uint8(backends.current().encoding_from_linearRGB(image_linear_rgb, self.imageEncoding))
+
+    def _simulate_cvd_planes (self, image_srgb_uint8, deficiency: Deficiency, severity: float, max_unique_colors: int, precision: str,
+                              layout: str, channel_order: str):
+        """simulate_cvd for the other layouts and channel orders, without transposing the image."""
+        channel_axis = channel_axis_of_layout(layout)
+        params = self._piecewise_linear_rgb_matrices(deficiency, severity)
+        if channel_order not in CHANNEL_ORDERS:
+            raise ValueError(f"Invalid channel order '{channel_order}', expected one of {CHANNEL_ORDERS}")
+
+        image = np.asarray(image_srgb_uint8)
+        planes = np.moveaxis(image, channel_axis, 0)
+        if channel_order == 'BGR':
+            planes = planes[::-1]
+        # HWC RGB view of the input, without any copy.
+        rgb_view = np.moveaxis(planes, 0, -1)
+
+        out = None
+        if max_unique_colors > 0:
+            out = self.simulate_cvd_unique_colors(rgb_view, deficiency, severity, max_unique_colors)
+
+        if out is None and (params is None or self.imageEncoding in convert.HDR_ENCODINGS):
+            out = self.simulate_cvd(rgb_view, deficiency, severity, 0, precision)
+
+        if out is not None:
+            # The simulated image is HWC RGB, write it back to the input layout.
+            out_image = np.empty(image.shape, dtype=out.dtype)
+            out_planes = np.moveaxis(out_image, channel_axis, 0)
+            np.moveaxis(out_planes[::-1] if channel_order == 'BGR' else out_planes, 0, -1)[...] = out
+            return out_image
+
+        # Linear simulators: apply the matrices to the planes in memory order.
+        T1, T2, n = permute_piecewise_linear_rgb_matrices(*params, channel_order)
+        if precision == 'fixed':
+            out = apply_piecewise_linear_rgb_matrices_fixed_point(image, T1, T2, n, self.imageEncoding, channel_axis)
+        elif precision == 'float16':
+            out = apply_piecewise_linear_rgb_matrices_float16(image, T1, T2, n, self.imageEncoding, channel_axis)
+        if out is None:
+            out = apply_piecewise_linear_rgb_matrices_float32(image, T1, T2, n, self.imageEncoding, channel_axis)
+        return out
+
+    def simulate_cvd_region (self, image_srgb_uint8, deficiency: Deficiency, severity: float,
+                             rois=None, mask=None, out=None, precision: str = 'float32'):
+        """Simulate only some rectangles or pixels of an image.
+
+        Parameters
+        ==========
+        image_srgb_uint8 : array of shape (M,N,3) with dtype uint8
+            The input sRGB image.
+
+        deficiency: Deficiency
+            The deficiency to simulate.
+
+        severity: float
+            The severity between 0 (normal vision) and 1 (complete dichromacy).
+
+        rois : list of (x, y, width, height)
+            Rectangles to simulate. They get clipped to the image. None
+            means the full image.
+
+        mask : array of shape (M,N) with dtype bool
+            Only simulate the pixels where mask is True. If rois are also
+            given, only the masked pixels inside the rectangles are simulated.
+
+        out : array of shape (M,N,3) with dtype uint8
+            Where to write the result. The pixels that are not simulated are
+            left untouched. It can be image_srgb_uint8 itself. If None, a
+            copy of the input image is used.
+
+        precision: str
+            See simulate_cvd.
+
+        Returns
+        =======
+        out : array of shape (M,N,3) with dtype uint8
+            The output image.
+        """
+        im = np.asarray(image_srgb_uint8)
+        if out is None:
+            out = im.copy()
+        if rois is None:
+            rois = [(0, 0, im.shape[1], im.shape[0])]
+
+        for x, y, width, height in rois:
+            x0, y0 = max(x, 0), max(y, 0)
+            x1, y1 = min(x + width, im.shape[1]), min(y + height, im.shape[0])
+            if x1 <= x0 or y1 <= y0:
+                continue
+            region = im[y0:y1, x0:x1]
+            if mask is None:
+                out[y0:y1, x0:x1] = self.simulate_cvd(region, deficiency, severity, precision=precision)
+            else:
+                region_mask = mask[y0:y1, x0:x1]
+                # Simulate the selected pixels as a single-row image.
+                pixels = region[region_mask][np.newaxis]
+                if pixels.shape[1] > 0:
+                    out[y0:y1, x0:x1][region_mask] = self.simulate_cvd(pixels, deficiency, severity, precision=precision)[0]
+        return out
+
+    def simulate_cvd_palette (self, colors, deficiency: Deficiency, severity: float):
+        """Simulate the appearance of a list of colors for the given color vision deficiency
+
+        This is meant for palettes, chart color schemes or single colors. It
+        gives the same result as simulate_cvd, but skips the image plumbing:
+        the transfer function is a table lookup, and linear simulators apply
+        a cached matrix (see cvd_linear_rgb_matrix).
+
+        Parameters
+        ==========
+        colors : list of str or array of shape (N,3) with dtype uint8
+            The input sRGB colors, either as hex strings like '#ff8000' or
+            as an array with values in [0,255].
+
+        deficiency: Deficiency
+            The deficiency to simulate.
+
+        severity: float
+            The severity between 0 (normal vision) and 1 (complete dichromacy).
+
+        Returns
+        =======
+        colors : list of str or array of shape (N,3) with dtype uint8
+            The simulated colors, as hex strings if the input was hex strings.
+        """
+        as_hexstrings = not isinstance(colors, np.ndarray) and len(colors) > 0 and isinstance(colors[0], str)
+        if as_hexstrings:
+            srgb_uint8 = convert.sRGB_uint8_from_hexstrings(colors)
+        else:
+            srgb_uint8 = np.asarray(colors, dtype=np.uint8).reshape(-1,3)
+
+        linear_rgb = convert.linearRGB_table_from_uint8(self.imageEncoding)[srgb_uint8]
+        m = self.cvd_linear_rgb_matrix(deficiency, severity)
+        if m is not None:
+            cvd_linear_rgb = convert.apply_color_matrix(linear_rgb, m)
+        else:
+            # Simulators may expect an image, so use a single-row one.
+            cvd_linear_rgb = self._simulate_cvd_linear_rgb(linear_rgb[np.newaxis], deficiency, severity)[0]
+        cvd_uint8 = convert.as_uint8(convert.encoding_from_linearRGB(cvd_linear_rgb, self.imageEncoding))
+        return convert.hexstrings_from_sRGB_uint8(cvd_uint8) if as_hexstrings else cvd_uint8
+
+    def simulate_cvd_unique_colors (self, image_srgb_uint8, deficiency: Deficiency, severity: float, max_unique_colors: int):
+        """Simulate only the unique colors of the image, or return None if there are too many.
+
+        This is what simulate_cvd does with max_unique_colors > 0, for callers
+        that want to know whether it worked before falling back to another path.
+        Images that are not uint8 always return None.
+        """
+        if max_unique_colors > 65536:
+            raise ValueError(f"max_unique_colors must be at most 65536, got {max_unique_colors}")
+        im = np.asarray(image_srgb_uint8)
+        if im.dtype != np.uint8:
+            return None
+        pixels = im.reshape(-1, 3)
+
+        # Cheap rejection of natural images on a subsample, before touching every pixel.
+        if np.unique(_packed_rgb(pixels[::61])).size > max_unique_colors:
+            return None
+
+        packed = _packed_rgb(pixels)
+        if packed.size <= _MAX_PIXELS_TO_SORT:
+            unique_packed, index_of_pixel = np.unique(packed, return_inverse=True)
+            if unique_packed.size > max_unique_colors:
+                return None
         else:
-            im_cvd_float = im_cvd_linear_rgb
-        return convert.as_uint8(im_cvd_float)
+            # Sorting all the pixels gets slower than tables over the whole
+            # 24-bit RGB space (48 MB) for large images.
+            present = np.zeros(1 << 24, dtype=bool)
+            present[packed] = True
+            unique_packed = np.flatnonzero(present)
+            if unique_packed.size > max_unique_colors:
+                return None
+            del present
+            index_of_color = np.empty(1 << 24, dtype=np.uint16)
+            index_of_color[unique_packed] = np.arange(unique_packed.size, dtype=np.uint16)
+            index_of_pixel = index_of_color[packed]
+
+        palette = np.stack([unique_packed >> 16, (unique_packed >> 8) & 0xff, unique_packed & 0xff], axis=-1).astype(np.uint8)
+        palette_cvd = self.simulate_cvd_palette(palette, deficiency, severity)
+        return palette_cvd[index_of_pixel].reshape(im.shape)
+
+    def cvd_linear_rgb_matrix (self, deficiency: Deficiency, severity: float):
+        """Return the 3x3 matrix applied on linear RGB colors, if any.
+
+        The matrix is computed once per deficiency, severity and model
+        parameters and then cached, the MATRIX_CACHE_SIZE most recently used
+        ones are kept. Returns None for non-linear simulators.
+        """
+        return self._cvd_matrix_cache.get((deficiency, severity, self._model_parameters()),
+                                          lambda: self._compute_cvd_linear_rgb_matrix(deficiency, severity))
+
+    def _compute_cvd_linear_rgb_matrix (self, deficiency: Deficiency, severity: float):
+        """Linear simulators should override this and return their 3x3 matrix."""
+        return None
+
+    def _model_parameters (self):
+        """Attributes the matrices depend on, besides the deficiency and severity.
+
+        They are part of the cache keys, so that changing e.g. the color
+        model of a simulator does not return the matrices of the previous one.
+        """
+        return ()
+
+    def _matrices_as (self, dtype, key, compute):
+        """Return the matrices of compute() cast to dtype, computed once per key, dtype and model parameters.
+
+        The simulation of a float32 image must stay in float32, and numpy
+        promotes the whole image to float64 as soon as one of the operands is
+        float64. The model matrices are computed in float64, so the image
+        paths use this to get them in the dtype of the image. The
+        MATRIX_CACHE_SIZE most recently used ones are kept.
+        """
+        return self._typed_matrix_cache.get((key, np.dtype(dtype), self._model_parameters()),
+                                            lambda: tuple(np.asarray(m, dtype=dtype) for m in compute()))
+
+    def compile (self, deficiency: Deficiency, severity: float):
+        """Precompute everything needed to simulate the given deficiency and severity.
+
+        The result applies its own linear RGB matrices, it never goes
+        through the caches of the simulator. The intermediate values of
+        the model that used to be stored on the simulator for inspection are
+        returned in the inspection dict of the result instead.
+
+        Returns
+        =======
+        compiled : CompiledSimulation
+        """
+        return CompiledSimulation(self, deficiency, severity,
+                                  self._piecewise_linear_rgb_matrices(deficiency, severity),
+                                  self._inspection_data(deficiency, severity))
+
+    def _inspection_data (self, deficiency: Deficiency, severity: float):
+        """Intermediate values of the model, see compile."""
+        return {}
+
+    def _piecewise_linear_rgb_matrices (self, deficiency: Deficiency, severity: float):
+        """Return the simulation as one or two 3x3 matrices on linear RGB.
+
+        Returns (T1, T2, n) such that a linear RGB color c becomes T2 @ c if
+        dot(n, c) < 0 and T1 @ c otherwise. Linear simulators return
+        (m, None, None). Returns None if the simulator is not piecewise linear.
+        """
+        m = self.cvd_linear_rgb_matrix(deficiency, severity)
+        return None if m is None else (m, None, None)
 
     @abstractmethod
     def _simulate_cvd_linear_rgb (self, image_linear_rgb_float32, deficiency: Deficiency, severity: float):
         """All subclasses must implement this."""
         pass
 
+class CompiledSimulation:
+    """A simulator bound to a deficiency and a severity, see Simulator.compile.
+
+    Attributes
+    ==========
+    simulator : Simulator
+        The simulator that was compiled.
+
+    deficiency : Deficiency
+        The simulated deficiency.
+
+    severity : float
+        The simulated severity.
+
+    linear_rgb_matrices : tuple (T1, T2, n) or None
+        The simulation as matrices on linear RGB colors: T2 @ c if
+        dot(n, c) < 0 and T1 @ c otherwise. T2 and n are None for linear
+        simulators, and the whole tuple is None for non-linear ones.
+
+    inspection : dict
+        Intermediate values of the model. For example 'lms_projection_matrix'
+        and 'cvd_linear_rgb' for Viénot, or 'H1', 'H2', 'n_sep_plane', 'T1',
+        'T2' and 'n_sep_plane_rgb' for Brettel.
+    """
+
+    def __init__(self, simulator: Simulator, deficiency: Deficiency, severity: float, linear_rgb_matrices, inspection):
+        self.simulator = simulator
+        self.deficiency = deficiency
+        self.severity = severity
+        self.linear_rgb_matrices = linear_rgb_matrices
+        self.inspection = inspection
+        # Non-linear simulations can only go through the simulator.
+        self._matrices_simulator = (simulator if linear_rgb_matrices is None
+                                    else _MatricesSimulator(linear_rgb_matrices, simulator.imageEncoding))
+
+    @property
+    def nbytes(self):
+        """Memory used by the matrices of the simulation and the inspection arrays, in bytes."""
+        nbytes = sum(v.nbytes for v in self.inspection.values() if isinstance(v, np.ndarray))
+        if self.linear_rgb_matrices is not None:
+            nbytes += self._matrices_simulator.nbytes
+        return nbytes
+
+    def simulate_cvd (self, image_srgb_uint8, max_unique_colors: int = 0, precision: str = 'float32',
+                      layout: str = 'HWC', channel_order: str = 'RGB'):
+        """See Simulator.simulate_cvd."""
+        return self._matrices_simulator.simulate_cvd(image_srgb_uint8, self.deficiency, self.severity,
+                                                     max_unique_colors=max_unique_colors, precision=precision,
+                                                     layout=layout, channel_order=channel_order)
+
+    def simulate_cvd_palette (self, colors):
+        """See Simulator.simulate_cvd_palette."""
+        return self._matrices_simulator.simulate_cvd_palette(colors, self.deficiency, self.severity)
+
+    def pil_filter (self, size: int = 33):
+        """PIL ImageFilter.Color3DLUT applying the simulation, see lut.compute_pil_filter."""
+        # lut imports this module.
+        from daltonlens import lut
+        return lut.compute_pil_filter(self._matrices_simulator, self.deficiency, self.severity, size)
+
+class _MatricesSimulator (Simulator):
+    """Applies fixed (T1, T2, n) linear RGB matrices, whatever the deficiency and severity.
+
+    This is how CompiledSimulation simulates the piecewise linear models
+    without going through the caches of the original simulator.
+    """
+
+    def __init__(self, linear_rgb_matrices, imageEncoding: convert.ImageEncoding):
+        super().__init__()
+        self.imageEncoding = imageEncoding
+        self.linear_rgb_matrices = linear_rgb_matrices
+        # Cast once to the dtypes of the images, see Simulator._matrices_as.
+        self._typed_matrices = {np.dtype(dtype): self._cast_matrices(dtype) for dtype in (np.float32, np.float16)}
+
+    @property
+    def nbytes(self):
+        all_matrices = [self.linear_rgb_matrices] + list(self._typed_matrices.values())
+        return sum(m.nbytes for matrices in all_matrices for m in matrices if m is not None)
+
+    def _cast_matrices(self, dtype):
+        return tuple(None if m is None else np.asarray(m, dtype=dtype) for m in self.linear_rgb_matrices)
+
+    def _piecewise_linear_rgb_matrices (self, deficiency: Deficiency, severity: float):
+        return self.linear_rgb_matrices
+
+    def cvd_linear_rgb_matrix (self, deficiency: Deficiency, severity: float):
+        T1, T2, n = self.linear_rgb_matrices
+        return T1 if T2 is None else None
+
+    def _simulate_cvd_linear_rgb (self, image_linear_rgb_float32, deficiency: Deficiency, severity: float):
+        dtype = np.dtype(convert._float_dtype(image_linear_rgb_float32))
+        T1, T2, n = self._typed_matrices.get(dtype) or self._cast_matrices(dtype)
+        kernels = backends.current()
+        im_cvd = kernels.apply_color_matrix(image_linear_rgb_float32, T1)
+        if T2 is not None:
+            use_T2 = (np.asarray(image_linear_rgb_float32) @ n) < 0
+            np.copyto(im_cvd, kernels.apply_color_matrix(image_linear_rgb_float32, T2), where=use_T2[..., np.newaxis])
+        return im_cvd
+
 class DichromacySimulator (Simulator):
     """Base class for CVD simulators that only support dichromacy
     
@@ -84,7 +717,9 @@ class DichromacySimulator (Simulator):
     def _simulate_cvd_linear_rgb (self, image_linear_rgb_float32, deficiency: Deficiency, severity: float):
         im_dichromacy = self._simulate_dichromacy_linear_rgb(image_linear_rgb_float32, deficiency)
         if severity < 0.99999:
-            return im_dichromacy*severity + image_linear_rgb_float32*(1.0-severity)
+            # A numpy float64 severity would promote the images to float64.
+            severity = im_dichromacy.dtype.type(severity)
+            return im_dichromacy*severity + image_linear_rgb_float32*(1-severity)
         else:
             return im_dichromacy
 
@@ -92,6 +727,18 @@ class DichromacySimulator (Simulator):
     def _simulate_dichromacy_linear_rgb (self, image_linear_rgb_float32, deficiency: Deficiency, severity: float):
         pass
 
+    def _compute_cvd_linear_rgb_matrix (self, deficiency: Deficiency, severity: float):
+        m = self._dichromacy_linear_rgb_matrix(deficiency)
+        if m is None:
+            return None
+        if severity < 0.99999:
+            return m*severity + np.eye(3)*(1.0-severity)
+        return m
+
+    def _dichromacy_linear_rgb_matrix (self, deficiency: Deficiency):
+        """Linear dichromacy simulators should override this and return their 3x3 matrix."""
+        return None
+
 def plane_projection_matrix(plane_normal, deficiency: Deficiency):
     """Utility function for Vienot and Brettel.
     
@@ -141,12 +788,42 @@ class Simulator_Vienot1999 (DichromacySimulator):
     Recommended for protanopia and deuteranopia, but not accurate for tritanopia.    
     """
 
-    def __init__(self, color_model: convert.LMSModel = convert.LMSModel_sRGB_SmithPokorny75()):
+    def __init__(self, color_model: convert.LMSModel = convert.LMSModel_sRGB_SmithPokorny75(),
+                 image_encoding: convert.ImageEncoding = convert.ImageEncoding.SRGB):
+        """
+        Parameters
+        ==========
+        color_model : convert.LMSModel
+            The LMS model, it also defines the RGB primaries of the images.
+            For example LMSModel_DisplayP3_SmithPokorny75 for Display P3 images.
+
+        image_encoding : convert.ImageEncoding
+            The transfer function of the images, e.g. ImageEncoding.PQ for HDR10.
+        """
         super().__init__()
         self.color_model = color_model
+        self.imageEncoding = image_encoding
+
+    def _model_parameters (self):
+        return (self.color_model,)
 
     def _simulate_dichromacy_linear_rgb (self, image_linear_rgb_float32, deficiency: Deficiency):
-        self.lms_projection_matrix = None
+        if self.dumpPrecomputedValues:
+            print (array_to_C_decl(f"vienot_{name_of_deficiency(deficiency)}_rgbCvd_from_rgb", self._vienot_matrices(deficiency)[1]))
+
+        cvd_linear_rgb, = self._matrices_as(convert._float_dtype(image_linear_rgb_float32), ('vienot', deficiency),
+                                            lambda: self._vienot_matrices(deficiency)[1:])
+        return backends.current().apply_color_matrix(image_linear_rgb_float32, cvd_linear_rgb)
+
+    def _dichromacy_linear_rgb_matrix (self, deficiency: Deficiency):
+        return self._vienot_matrices(deficiency)[1]
+
+    def _inspection_data (self, deficiency: Deficiency, severity: float):
+        lms_projection_matrix, cvd_linear_rgb = self._vienot_matrices(deficiency)
+        return {'lms_projection_matrix': lms_projection_matrix, 'cvd_linear_rgb': cvd_linear_rgb}
+
+    def _vienot_matrices (self, deficiency: Deficiency):
+        """Return the LMS projection matrix and the full linear RGB transform."""
         if deficiency == Deficiency.PROTAN or deficiency == Deficiency.DEUTAN:
             lms_blue = self.color_model.LMS_from_linearRGB @ np.array([0.0, 0.0, 1.0])
             lms_yellow = self.color_model.LMS_from_linearRGB @ np.array([1.0, 1.0, 0.0])
@@ -155,21 +832,16 @@ class Simulator_Vienot1999 (DichromacySimulator):
 
             # Deutan and Protan plane normal
             n = np.cross(v_yellow, v_blue)
-            self.lms_projection_matrix = plane_projection_matrix(n, deficiency)
+            lms_projection_matrix = plane_projection_matrix(n, deficiency)
         else:
             # print ("WARNING: Viénot 1999 is not accurate for tritanopia. Use Brettel 1997 instead.")
             v_red = self.color_model.LMS_from_linearRGB @ np.array([1.0, 0.0, 0.0]) # - lms_black which is ommitted since it's zero
             v_cyan = self.color_model.LMS_from_linearRGB @ np.array([0.0, 1.0, 1.0]) # - lms_black which is ommitted since it's zero
             n = np.cross(v_cyan, v_red)
-            self.lms_projection_matrix = plane_projection_matrix(n, Deficiency.TRITAN)
-
-        # Save it for external inspection.
-        self.cvd_linear_rgb = self.color_model.linearRGB_from_LMS @ self.lms_projection_matrix @ self.color_model.LMS_from_linearRGB
+            lms_projection_matrix = plane_projection_matrix(n, Deficiency.TRITAN)
 
-        if self.dumpPrecomputedValues:
-            print (array_to_C_decl(f"vienot_{name_of_deficiency(deficiency)}_rgbCvd_from_rgb", self.cvd_linear_rgb))
-
-        return convert.apply_color_matrix(image_linear_rgb_float32, self.cvd_linear_rgb)
+        cvd_linear_rgb = self.color_model.linearRGB_from_LMS @ lms_projection_matrix @ self.color_model.LMS_from_linearRGB
+        return lms_projection_matrix, cvd_linear_rgb
 
 class Simulator_Brettel1997 (DichromacySimulator):
     """Algorithm of (Brettel, Viénot & Mollon, 1997).
@@ -183,10 +855,15 @@ class Simulator_Brettel1997 (DichromacySimulator):
     def __init__(self, 
                  color_model: convert.LMSModel = convert.LMSModel_sRGB_SmithPokorny75(),
                  use_vischeck_anchors=False,
-                 use_white_as_neutral=True):
+                 use_white_as_neutral=True,
+                 image_encoding: convert.ImageEncoding = convert.ImageEncoding.SRGB):
         """    
         Parameters
         ==========
+        color_model : convert.LMSModel
+            The LMS model, it also defines the RGB primaries of the images.
+            For example LMSModel_BT2020_SmithPokorny75 for HDR images.
+
         use_vischeck_anchors : Boolean
             If true, the 475, 575, 485 and 660nm
             anchors will be taken from Vischeck. Not sure how they were computed
@@ -205,14 +882,52 @@ class Simulator_Brettel1997 (DichromacySimulator):
 
             This is also the approximation made by Viénot, Brettel & Mollon 1999 
             'Digital video colourmaps for checking the legibility of displays by dichromats.'
+
+        image_encoding : convert.ImageEncoding
+            The transfer function of the images, e.g. ImageEncoding.PQ for HDR10.
         """
         
         super().__init__()
+        self.imageEncoding = image_encoding
         self.use_vischeck_anchors = use_vischeck_anchors
         self.color_model = color_model
         self.use_white_as_neutral = use_white_as_neutral
 
+    def _model_parameters (self):
+        return (self.color_model, self.use_vischeck_anchors, self.use_white_as_neutral)
+
     def _simulate_dichromacy_linear_rgb (self, image_linear_rgb_float32, deficiency: Deficiency):
+        if self.dumpPrecomputedValues:            
+            self._dump_brettel_data (deficiency, self._inspection_data(deficiency, 1.0))
+
+        matrices = self._matrices_as(convert._float_dtype(image_linear_rgb_float32), ('brettel', deficiency),
+                                     lambda: (self.color_model.LMS_from_linearRGB,) + self._brettel_lms_matrices(deficiency)
+                                             + (self.color_model.linearRGB_from_LMS,))
+        return backends.current().brettel_projection(image_linear_rgb_float32, *matrices)
+
+    def _inspection_data (self, deficiency: Deficiency, severity: float):
+        H1, H2, n_sep_plane = self._brettel_lms_matrices(deficiency)
+        return {
+            'H1': H1,
+            'H2': H2,
+            'n_sep_plane': n_sep_plane,
+            # rgbCvdFromRgb 1 and 2
+            'T1': self.color_model.linearRGB_from_LMS @ H1 @ self.color_model.LMS_from_linearRGB,
+            'T2': self.color_model.linearRGB_from_LMS @ H2 @ self.color_model.LMS_from_linearRGB,
+            'n_sep_plane_rgb': np.dot(n_sep_plane, self.color_model.LMS_from_linearRGB),
+        }
+
+    def _piecewise_linear_rgb_matrices (self, deficiency: Deficiency, severity: float):
+        H1, H2, n_sep_plane = self._brettel_lms_matrices(deficiency)
+        T1 = self.color_model.linearRGB_from_LMS @ H1 @ self.color_model.LMS_from_linearRGB
+        T2 = self.color_model.linearRGB_from_LMS @ H2 @ self.color_model.LMS_from_linearRGB
+        if severity < 0.99999:
+            T1 = T1*severity + np.eye(3)*(1.0-severity)
+            T2 = T2*severity + np.eye(3)*(1.0-severity)
+        return T1, T2, n_sep_plane @ self.color_model.LMS_from_linearRGB
+
+    def _brettel_lms_matrices (self, deficiency: Deficiency):
+        """Return the projection matrices of the two half-planes and the normal of the separation plane, in LMS."""
         if self.use_vischeck_anchors:
             # From GIMP vischeck implementation. They define them in lms, but
             # we converted them to XYZ using their lms2rgb matrix and XYZ_from_rgb
@@ -226,8 +941,7 @@ class Simulator_Brettel1997 (DichromacySimulator):
             xyz_485 = np.array([ 0.79132,  1.4793 ,  4.85354])
             xyz_660 = np.array([ 0.90089,  0.21688, -0.04599])
         else:
-            # This is how these were computed. Saving the values to avoid a dependency.
-            # pip install colour-science
+            # This is how these were computed. Saving the values to avoid recomputing them.
             # from daltonlens import cmfs
             # xyz_475 = cmfs.wavelength_to_XYZ_JuddVos(475)
             # xyz_575 = cmfs.wavelength_to_XYZ_JuddVos(575)
@@ -279,22 +993,9 @@ class Simulator_Brettel1997 (DichromacySimulator):
             lms_485 = self.color_model.LMS_from_XYZ @ xyz_485
             lms_660 = self.color_model.LMS_from_XYZ @ xyz_660
             H1, H2, n_sep_plane = compute_matrices(lms_485, lms_660)
+        return H1, H2, n_sep_plane
 
-        if self.dumpPrecomputedValues:            
-            self._dump_brettel_data (deficiency, H1, H2, n_sep_plane)
-
-        im_lms = convert.apply_color_matrix(image_linear_rgb_float32, self.color_model.LMS_from_linearRGB)
-        im_H1 = convert.apply_color_matrix(im_lms, H1)
-        im_H2 = convert.apply_color_matrix(im_lms, H2)
-        H2_indices = np.dot(im_lms, n_sep_plane) < 0
-
-        # Start with H1, then overwrite the pixels that are closer to plane 2 with im_H2
-        im_H = im_H1
-        im_H[H2_indices] = im_H2[H2_indices]
-        im_linear_rgb = convert.apply_color_matrix(im_H, self.color_model.linearRGB_from_LMS)
-        return im_linear_rgb
-
-    def _dump_brettel_data(self, deficiency, H1, H2, n_sep_plane):
+    def _dump_brettel_data(self, deficiency, data):
         deficiency_name = name_of_deficiency(deficiency)
 
         print ("""
@@ -311,29 +1012,20 @@ struct DLBrettel1997Params
     float separationPlaneNormalInRgb[3];
 };""")
 
-        # Save it in case someone wants it.
-        self.n_sep_plane = n_sep_plane
-        self.H1 = H1
-        self.H2 = H2
-        
-        self.n_sep_plane_rgb = np.dot(n_sep_plane, self.color_model.LMS_from_linearRGB)
-        # rgbCvdFromRgb 1 and 2
-        self.T1 = self.color_model.linearRGB_from_LMS @ H1 @ self.color_model.LMS_from_linearRGB
-        self.T2 = self.color_model.linearRGB_from_LMS @ H2 @ self.color_model.LMS_from_linearRGB
-
+        T1, T2, n_sep_plane_rgb = data['T1'], data['T2'], data['n_sep_plane_rgb']
         print (f"""
 static struct DLBrettel1997Params brettel_{deficiency_name}_params = {{
     {{
-        {self.T1[0,0]:.5f}, {self.T1[0,1]:.5f}, {self.T1[0,2]:.5f},
-        {self.T1[1,0]:.5f}, {self.T1[1,1]:.5f}, {self.T1[1,2]:.5f},
-        {self.T1[2,0]:.5f}, {self.T1[2,1]:.5f}, {self.T1[2,2]:.5f},
+        {T1[0,0]:.5f}, {T1[0,1]:.5f}, {T1[0,2]:.5f},
+        {T1[1,0]:.5f}, {T1[1,1]:.5f}, {T1[1,2]:.5f},
+        {T1[2,0]:.5f}, {T1[2,1]:.5f}, {T1[2,2]:.5f},
     }},
     {{
-        {self.T2[0,0]:.5f}, {self.T2[0,1]:.5f}, {self.T2[0,2]:.5f},
-        {self.T2[1,0]:.5f}, {self.T2[1,1]:.5f}, {self.T2[1,2]:.5f},
-        {self.T2[2,0]:.5f}, {self.T2[2,1]:.5f}, {self.T2[2,2]:.5f},
+        {T2[0,0]:.5f}, {T2[0,1]:.5f}, {T2[0,2]:.5f},
+        {T2[1,0]:.5f}, {T2[1,1]:.5f}, {T2[1,2]:.5f},
+        {T2[2,0]:.5f}, {T2[2,1]:.5f}, {T2[2,2]:.5f},
     }},
-    {{ {self.n_sep_plane_rgb[0]:.5f}, {self.n_sep_plane_rgb[1]:.5f}, {self.n_sep_plane_rgb[2]:.5f} }}
+    {{ {n_sep_plane_rgb[0]:.5f}, {n_sep_plane_rgb[1]:.5f}, {n_sep_plane_rgb[2]:.5f} }}
 }};""")
 
 class Simulator_Vischeck (Simulator_Brettel1997):
@@ -410,6 +1102,11 @@ class Simulator_Machado2009 (Simulator):
     """
 
     def _simulate_cvd_linear_rgb (self, image_linear_rgb_float32, deficiency: Deficiency, severity: float):
+        m, = self._matrices_as(convert._float_dtype(image_linear_rgb_float32), ('machado', deficiency, severity),
+                               lambda: (self.cvd_linear_rgb_matrix(deficiency, severity),))
+        return backends.current().apply_color_matrix(image_linear_rgb_float32, m)
+
+    def _compute_cvd_linear_rgb_matrix (self, deficiency: Deficiency, severity: float):
         assert severity >= 0.0 and severity <= 1.0
         severity_lower = int(math.floor(severity*10.0))
         severity_higher = min(severity_lower + 1, 10)
@@ -419,8 +1116,7 @@ class Simulator_Machado2009 (Simulator):
         # alpha = 0 => only m1, alpha = 1.0 => only m2
         alpha = (severity - severity_lower/10.0)
         m = alpha*m2 + (1.0-alpha)*m1
-
-        return convert.apply_color_matrix(image_linear_rgb_float32, m)
+        return m
 
 coblis_v1_matrices = {
     Deficiency.PROTAN: np.array([[0.567, 0.433, 0.000],
@@ -453,8 +1149,12 @@ class Simulator_CoblisV1 (DichromacySimulator):
         self.imageEncoding = convert.ImageEncoding.LINEAR_RGB
 
     def _simulate_dichromacy_linear_rgb (self, image_linear_rgb_float32, deficiency: Deficiency):
-        m = coblis_v1_matrices[deficiency]
-        return convert.apply_color_matrix(image_linear_rgb_float32, m)
+        m, = self._matrices_as(convert._float_dtype(image_linear_rgb_float32), ('coblisV1', deficiency),
+                               lambda: (coblis_v1_matrices[deficiency],))
+        return backends.current().apply_color_matrix(image_linear_rgb_float32, m)
+
+    def _dichromacy_linear_rgb_matrix (self, deficiency: Deficiency):
+        return coblis_v1_matrices[deficiency]
 
 coblis_v2_constants = {
     Deficiency.PROTAN: {'cpu': 0.735, 'cpv':  0.265, 'am': 1.273463, 'ayi': -0.073894},
@@ -481,74 +1181,8 @@ class Simulator_CoblisV2 (DichromacySimulator):
         self.imageEncoding = convert.ImageEncoding.GAMMA_22
 
     def _simulate_dichromacy_linear_rgb (self, image_linear_rgb_float32, deficiency: Deficiency):
-        # Implementation adapted from https://github.com/jkulesza/peacock by
-        # moving it to numpy and restoring the original issue with large values.
-        # TODO: we're allocating way too many arrays.
-        # But kept it this way for clarity.
-        wx = 0.312713
-        wy = 0.329016
-        wz = 0.358271
-
-        cpu = coblis_v2_constants[deficiency]['cpu']
-        cpv = coblis_v2_constants[deficiency]['cpv']
-        am  = coblis_v2_constants[deficiency]['am']
-        ayi = coblis_v2_constants[deficiency]['ayi']
-
-        rgb2xyz = np.array([[0.430574, 0.341550, 0.178325],
-                            [0.222015, 0.706655, 0.071330],
-                            [0.020183, 0.129553, 0.939180]])
-        crgb = image_linear_rgb_float32
-        cxyz = convert.apply_color_matrix(crgb, rgb2xyz)
-        cx = cxyz[:,:,0]
-        cy = cxyz[:,:,1]
-        sum_xyz = np.sum(cxyz, axis=2)
-
-        with np.errstate(divide='ignore', invalid='ignore'):
-            cu = cx / sum_xyz
-            cv = cy / sum_xyz
-            np.nan_to_num(cu, copy=False)
-            np.nan_to_num(cv, copy=False)
-
-        nx = wx * cy / wy
-        nz = wz * cy / wy
-        
-        clm = (cpv - cv) / (cpu - cu)
-        # clm[cu >= cpu] *= -1.0
-
-        clyi = cv - np.multiply(cu, clm)
-        du = np.divide((ayi - clyi), (clm - am))
-        dv = np.multiply(clm, du) + clyi
-
-        sxyz = np.zeros_like(cxyz)
-        sx = sxyz[:,:,0] = np.divide(np.multiply(du, cy), dv)
-        sy = sxyz[:,:,1] = cy
-        sz = sxyz[:,:,2] = np.divide(np.multiply((1.0 - (du + dv)), cy), dv)
-        
-        xyz2rgb = np.array([[ 3.063218, -1.393325, -0.475802],
-                            [-0.969243,  1.875966,  0.041555],
-                            [ 0.067871, -0.228834,  1.069251]])
-        srgb = convert.apply_color_matrix(sxyz, xyz2rgb)
-
-        dxyz = np.zeros_like(sxyz)
-        dx = dxyz[:,:,0] = nx - sx
-        dy = dxyz[:,:,1] # = 0
-        dz = dxyz[:,:,2] = nz - sz
-
-        drgb = convert.apply_color_matrix(dxyz, xyz2rgb)
-        
-        adjrgb = np.zeros_like(drgb)
-        # Note: peacock fixed some issues with large values by doing drgb > 0.0 instead.
-        # It's unclear to me whether it can have drawbacks, but sticking to the original
-        # behavior that only avoids exact zero for comparison purposes.
-        with np.errstate(divide='ignore'):
-            adjrgb = np.divide((np.where(srgb < 0.0, 0.0, 1.0) - srgb), drgb)
-        np.nan_to_num(adjrgb, copy=False)
-
-        adjust = adjrgb
-        adjust[np.logical_or(adjrgb > 1.0, adjrgb < 0.0)] = 0.0
-        adjust = np.amax(adjust, 2) # becomes (M,N,1) here
-        srgb = srgb + np.multiply(drgb, adjust[..., np.newaxis])
-        return srgb
+        c = coblis_v2_constants[deficiency]
+        return backends.current().coblis_v2_dichromacy(image_linear_rgb_float32, c['cpu'], c['cpv'], c['am'], c['ayi'])
 
 class Simulator_AutoSelect (Simulator):
     """Automatically selects the best algorithm for the given deficiency and severity.
@@ -557,15 +1191,146 @@ class Simulator_AutoSelect (Simulator):
     - For protanomaly/deuteranomly (severity < 1) it picks (Machado, 2009)
     - For protanopia/deuteranopia (severity = 1) it picks (Vienot, 1999)
     """
+    def __init__(self):
+        super().__init__()
+        # Created once, they don't change while simulating.
+        self.brettel1997 = Simulator_Brettel1997(convert.LMSModel_sRGB_SmithPokorny75())
+        self.machado2009 = Simulator_Machado2009()
+        self.vienot1999 = Simulator_Vienot1999(convert.LMSModel_sRGB_SmithPokorny75())
+
     def _simulate_cvd_linear_rgb (self, image_linear_rgb_float32, deficiency: Deficiency, severity: float):
+        simulator = self._select_simulator(deficiency, severity)
+        return simulator._simulate_cvd_linear_rgb (image_linear_rgb_float32, deficiency, severity)
+
+    def _piecewise_linear_rgb_matrices (self, deficiency: Deficiency, severity: float):
+        simulator = self._select_simulator(deficiency, severity)
+        return simulator._piecewise_linear_rgb_matrices (deficiency, severity)
+
+    def _inspection_data (self, deficiency: Deficiency, severity: float):
+        simulator = self._select_simulator(deficiency, severity)
+        return dict(simulator._inspection_data(deficiency, severity), selected_simulator=simulator)
+
+    def _select_simulator (self, deficiency: Deficiency, severity: float):
         if deficiency == Deficiency.TRITAN:
-            print ("Choosing Brettel 1997 for tritanopia / tritanomaly")
-            simulator = Simulator_Brettel1997(convert.LMSModel_sRGB_SmithPokorny75())
+            logger.debug("Choosing Brettel 1997 for tritanopia / tritanomaly")
+            return self.brettel1997
         elif severity < 0.999:
-            print("Anomalous trichromacy requested, using Machado 2009")
-            simulator = Simulator_Machado2009()
+            logger.debug("Anomalous trichromacy requested, using Machado 2009")
+            return self.machado2009
         else:
-            print("Choosing Viénot 1999 for " + ("protanopia" if deficiency == Deficiency.PROTAN else "deuteranopia"))
-            simulator = Simulator_Vienot1999(convert.LMSModel_sRGB_SmithPokorny75())
-        
-        return simulator._simulate_cvd_linear_rgb (image_linear_rgb_float32, deficiency, severity)
+            logger.debug("Choosing Viénot 1999 for " + ("protanopia" if deficiency == Deficiency.PROTAN else "deuteranopia"))
+            return self.vienot1999
+
+# Shared simulator instances, by the model names of the command line and
+# the server. Their caches get warm across calls.
+simulator_from_str = {
+    'vienot': Simulator_Vienot1999(convert.LMSModel_sRGB_SmithPokorny75()),
+    'brettel': Simulator_Brettel1997(convert.LMSModel_sRGB_SmithPokorny75()),
+    'vischeck': Simulator_Vischeck(),
+    'machado': Simulator_Machado2009(),
+    'coblisV1': Simulator_CoblisV1(),
+    'coblisV2': Simulator_CoblisV2(),
+    'auto': Simulator_AutoSelect()
+}
+
+def simulate_palette_image(pil_im, simulator: Simulator, deficiency: Deficiency, severity: float):
+    """Simulate a 'P' mode PIL image by only transforming its palette."""
+    palette = np.asarray(pil_im.getpalette('RGB'), dtype=np.uint8).reshape(-1,3)
+    out_im = pil_im.copy()
+    out_im.putpalette(simulator.simulate_cvd_palette(palette, deficiency, severity).tobytes(), 'RGB')
+    return out_im
+
+class IncrementalSimulator:
+    """Keep the simulation of a changing image up to date.
+
+    Each call to update only re-simulates the tiles that changed since the
+    previous one, which is much cheaper for interactive tools where a small
+    part of a large canvas changes between frames.
+
+    Parameters
+    ==========
+    simulator : Simulator
+        The simulator to use.
+
+    deficiency : Deficiency
+        The deficiency to simulate.
+
+    severity : float
+        The severity between 0 (normal vision) and 1 (complete dichromacy).
+
+    tile_size : int
+        Size of the square tiles used to detect the changes.
+
+    precision : str
+        See Simulator.simulate_cvd.
+    """
+
+    def __init__(self, simulator: Simulator, deficiency: Deficiency, severity: float, tile_size: int = 64, precision: str = 'float32'):
+        self.simulator = simulator
+        self.deficiency = deficiency
+        self.severity = severity
+        self.tile_size = tile_size
+        self.precision = precision
+        self.source = None
+        self.output = None
+
+    def dirty_rectangles (self, image_srgb_uint8):
+        """Return the (x, y, width, height) rectangles that differ from the previous image.
+
+        Changed tiles are merged along each row of tiles.
+        """
+        im = np.asarray(image_srgb_uint8)
+        if self.source is None or self.source.shape != im.shape:
+            return [(0, 0, im.shape[1], im.shape[0])]
+
+        t = self.tile_size
+        rows, cols = -(-im.shape[0] // t), -(-im.shape[1] // t)
+        changed = np.any(self.source != im, axis=-1)
+        padded = np.zeros((rows*t, cols*t), dtype=bool)
+        padded[:im.shape[0], :im.shape[1]] = changed
+        dirty_tiles = np.any(padded.reshape(rows, t, cols, t), axis=(1, 3))
+
+        rects = []
+        for row in range(rows):
+            # Runs of consecutive dirty tiles.
+            d = np.concatenate([[False], dirty_tiles[row], [False]]).astype(np.int8)
+            starts = np.flatnonzero(np.diff(d) == 1)
+            ends = np.flatnonzero(np.diff(d) == -1)
+            rects += [(int(start)*t, row*t, int(end-start)*t, t) for start, end in zip(starts, ends)]
+        return rects
+
+    def update (self, image_srgb_uint8, dirty_rectangles=None):
+        """Return the simulation of the new image.
+
+        Parameters
+        ==========
+        image_srgb_uint8 : array of shape (M,N,3) with dtype uint8
+            The new version of the image.
+
+        dirty_rectangles : list of (x, y, width, height)
+            The rectangles that changed, if the caller knows them. Otherwise
+            they are found by comparing with the previous image.
+
+        Returns
+        =======
+        im : array of shape (M,N,3) with dtype uint8
+            The simulated image. The same array is updated by the next
+            calls, copy it to keep it.
+        """
+        im = np.asarray(image_srgb_uint8)
+        if self.source is None or self.source.shape != im.shape:
+            self.source = im.copy()
+            self.output = np.empty_like(im)
+            dirty_rectangles = None
+        elif dirty_rectangles is None:
+            dirty_rectangles = self.dirty_rectangles(im)
+
+        self.simulator.simulate_cvd_region(im, self.deficiency, self.severity,
+                                           rois=dirty_rectangles, out=self.output,
+                                           precision=self.precision)
+        if dirty_rectangles is None:
+            self.source[...] = im
+        else:
+            for x, y, width, height in dirty_rectangles:
+                self.source[y:y+height, x:x+width] = im[y:y+height, x:x+width]
+        return self.output
@@ -1,3 +1,6 @@
+import threading
+from collections import OrderedDict
+
 import numpy as np
 
 def normalized(p): return p / np.linalg.norm(p)
@@ -16,3 +19,55 @@ def array_to_C_decl(varname:str, a):
         s += ",\n".join(rows)
     s += "\n};"
     return s
+
+def rgb_array(pil_im):
+    """Return the pixels of a PIL image as an (M,N,3) uint8 array."""
+    # convert() always makes a copy, even when the mode is already right.
+    if pil_im.mode != 'RGB':
+        pil_im = pil_im.convert('RGB')
+    return np.asarray(pil_im)
+
+class LRUCache:
+    """Thread-safe dictionary that keeps the max_entries most recently used values.
+
+    It is meant for small values derived from the arguments of a call, e.g.
+    the matrices of a simulator for each severity, so that callers sweeping
+    through many arguments can't grow it without bound.
+    """
+
+    def __init__(self, max_entries: int):
+        self.max_entries = max_entries
+        self._entries = OrderedDict()
+        self._lock = threading.Lock()
+
+    def get(self, key, compute):
+        """Return the value of key, calling compute() to create it if it's not there.
+
+        compute() runs without holding the lock, so concurrent misses on the
+        same key just compute it twice.
+        """
+        with self._lock:
+            if key in self._entries:
+                self._entries.move_to_end(key)
+                return self._entries[key]
+        value = compute()
+        with self._lock:
+            self._entries[key] = value
+            while len(self._entries) > self.max_entries:
+                self._entries.popitem(last=False)
+        return value
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+
+    def __len__(self):
+        return len(self._entries)
+
+    def __getstate__(self):
+        # Locks can't be pickled, e.g. to send a simulator to dask workers,
+        # and the entries are cheap to recompute.
+        return {'max_entries': self.max_entries}
+
+    def __setstate__(self, state):
+        self.__init__(state['max_entries'])
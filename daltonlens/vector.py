@@ -0,0 +1,242 @@
+"""Simulation of SVG and CSS documents, without rasterizing them.
+
+The color values of the document (hex, rgb()/rgba() and named colors in
+presentation attributes, style attributes, <style> elements and CSS
+declarations) are collected, all the unique colors are simulated in a single
+simulate_cvd_palette call, and the document is rewritten with the simulated
+colors. Everything else is left untouched, including the alpha values.
+
+    from daltonlens import simulate, vector
+    svg = Path("chart.svg").read_text()
+    deutan_svg = vector.simulate_cvd_svg(svg, simulate.Simulator_Machado2009(), simulate.Deficiency.DEUTAN, 1.0)
+
+Gradients, filters and embedded raster images are not simulated, only
+the colors written in the document. hsl() colors are left as is.
+"""
+
+import re
+
+import numpy as np
+from PIL import ImageColor
+
+from daltonlens import simulate
+
+# File extensions handled by simulate_cvd_document.
+DOCUMENT_SUFFIXES = ('.svg', '.css')
+
+# Properties whose value can be a named color. hex and rgb() colors get
+# rewritten in any property.
+COLOR_PROPERTIES = frozenset([
+    'fill', 'stroke', 'stop-color', 'flood-color', 'lighting-color', 'color',
+    'background', 'background-color', 'border', 'border-color', 'border-top', 'border-right',
+    'border-bottom', 'border-left', 'border-top-color', 'border-right-color', 'border-bottom-color',
+    'border-left-color', 'outline', 'outline-color', 'text-decoration', 'text-decoration-color',
+    'column-rule', 'column-rule-color', 'caret-color', 'accent-color', 'box-shadow', 'text-shadow',
+])
+
+_color_regex_source = (r'(?<![\w&])#(?P<hex>[0-9a-fA-F]{8}|[0-9a-fA-F]{6}|[0-9a-fA-F]{3,4})\b'
+                       r'|(?P<func>rgba?)\(\s*(?P<args>[^()]*)\)')
+# Named colors are only looked for in COLOR_PROPERTIES.
+_color_regex = re.compile(_color_regex_source)
+_color_or_name_regex = re.compile(_color_regex_source + r'|(?<![\w#-])(?P<name>[a-zA-Z]+)(?![\w-])')
+# Only the attributes that can hold colors. SVG attribute names are case-sensitive.
+_attribute_regex = re.compile(r'\s(?P<property>%s)\s*=\s*(?:"(?P<dq>[^"]*)"|\'(?P<sq>[^\']*)\')'
+                              % '|'.join(sorted(COLOR_PROPERTIES | {'style'}, key=len, reverse=True)))
+_style_element_regex = re.compile(r'(<style\b[^>]*>)(.*?)(</style>)', re.DOTALL | re.IGNORECASE)
+_declaration_regex = re.compile(r'(?P<property>[a-zA-Z-]+)\s*:\s*(?P<value>[^;{}]*)')
+_comment_regex = re.compile(r'/\*.*?\*/', re.DOTALL)
+_block_regex = re.compile(r'\{([^{}]*)\}')
+# References like url(#gradient) are not colors.
+_url_regex = re.compile(r'url\([^)]*\)', re.IGNORECASE)
+
+def _blank(regex, text: str):
+    """Replace the matches with spaces, keeping the positions of the rest of the text."""
+    return regex.sub(lambda m: ' ' * len(m.group()), text)
+
+def _parse_rgb_function(args: str):
+    """Return the (r,g,b) of the rgb()/rgba() arguments and the alpha text, or None."""
+    color, slash, alpha = args.partition('/')
+    components = [c for c in re.split(r'[\s,]+', color.strip()) if c]
+    if slash:
+        alpha = alpha.strip()
+    elif len(components) == 4:
+        alpha = components.pop()
+    if len(components) != 3:
+        return None
+    rgb = []
+    for c in components:
+        try:
+            v = float(c[:-1]) * 2.55 if c.endswith('%') else float(c)
+        except ValueError:
+            return None
+        rgb.append(min(max(int(round(v)), 0), 255))
+    return rgb, alpha or None
+
+# Marks the hex tokens in _Rewriter.parsed_tokens, they get parsed all at once.
+_HEX = 'hex'
+
+def _parse_color_token(token: str):
+    """Return the (r,g,b) of an rgb()/rgba() or named color token and its alpha text, or None if it is not a color."""
+    if token[-1] == ')':
+        return _parse_rgb_function(token[token.index('(')+1:-1])
+    hexstring = ImageColor.colormap.get(token.lower())
+    if hexstring is not None:
+        return [int(hexstring[i:i+2], 16) for i in (1, 3, 5)], None
+    return None
+
+def _format_color(token: str, rgb, alpha):
+    """Write the color like the original token, named colors become hex."""
+    r, g, b = (int(v) for v in rgb)
+    if token[-1] == ')':
+        if alpha is None:
+            return f"rgb({r}, {g}, {b})"
+        return f"rgba({r}, {g}, {b}, {alpha})"
+    return f"#{r:02x}{g:02x}{b:02x}"
+
+class _Rewriter:
+    """Collect the colors of a document, then rewrite them all at once.
+
+    Each color value is remembered as a (start, end) span of the document.
+    Documents tend to repeat the same colors, so each distinct token is
+    only parsed and formatted once, and the hex colors (by far the most
+    common) are parsed and formatted in bulk.
+    """
+
+    def __init__(self, text: str):
+        self.text = text
+        self.spans = [] # (start, end, token)
+        self.parsed_tokens = {} # token -> _HEX, ((r,g,b), alpha) or None
+
+    def add_value(self, value_start: int, value: str, property_name: str):
+        parsed_tokens = self.parsed_tokens
+        if property_name.lower() in COLOR_PROPERTIES:
+            # Fast path for the usual fill="#abcdef", already seen before.
+            if value in parsed_tokens:
+                if parsed_tokens[value] is not None:
+                    self.spans.append((value_start, value_start + len(value), value))
+                return
+            regex = _color_or_name_regex
+        else:
+            regex = _color_regex
+        if 'url(' in value.lower():
+            value = _blank(_url_regex, value)
+        for match in regex.finditer(value):
+            token = match.group()
+            if token not in parsed_tokens:
+                parsed_tokens[token] = _HEX if token[0] == '#' else _parse_color_token(token)
+            if parsed_tokens[token] is not None:
+                self.spans.append((value_start + match.start(), value_start + match.end(), token))
+
+    def add_declarations(self, start: int, css: str):
+        """Declarations of a style attribute or of a rule block."""
+        for declaration in _declaration_regex.finditer(css):
+            self.add_value(start + declaration.start('value'), declaration.group('value'), declaration.group('property'))
+
+    def add_stylesheet(self, start: int, css: str):
+        # Comments could contain anything, and selectors can look like
+        # colors (#abc), so only look inside the innermost blocks.
+        css = _blank(_comment_regex, css)
+        for block in _block_regex.finditer(css):
+            self.add_declarations(start + block.start(1), block.group(1))
+
+    def rewrite(self, transform):
+        if not self.spans:
+            return self.text
+        hex_tokens = [token for token, parsed in self.parsed_tokens.items() if parsed is _HEX]
+        other_tokens = [token for token, parsed in self.parsed_tokens.items() if parsed is not None and parsed is not _HEX]
+        # #rgb and #rgba are expanded to #rrggbb and #rrggbbaa.
+        hex_digits = [token[1:] if len(token) > 5 else ''.join(d*2 for d in token[1:]) for token in hex_tokens]
+        hex_colors = np.frombuffer(bytes.fromhex(''.join(digits[:6] for digits in hex_digits)), dtype=np.uint8)
+        other_colors = np.array([self.parsed_tokens[token][0] for token in other_tokens], dtype=np.uint8)
+        colors = np.concatenate([hex_colors.reshape(-1, 3), other_colors.reshape(-1, 3)])
+
+        unique_colors, inverse = np.unique(colors, axis=0, return_inverse=True)
+        new_colors = np.asarray(transform(unique_colors), dtype=np.uint8)[inverse.reshape(-1)]
+
+        new_hex = new_colors[:len(hex_tokens)].tobytes().hex()
+        replacements = {token: '#' + new_hex[6*i:6*i+6] + digits[6:] for i, (token, digits) in enumerate(zip(hex_tokens, hex_digits))}
+        for token, rgb in zip(other_tokens, new_colors[len(hex_tokens):]):
+            replacements[token] = _format_color(token, rgb, self.parsed_tokens[token][1])
+
+        self.spans.sort()
+        chunks = []
+        last_end = 0
+        for start, end, token in self.spans:
+            chunks.append(self.text[last_end:start])
+            chunks.append(replacements[token])
+            last_end = end
+        chunks.append(self.text[last_end:])
+        return ''.join(chunks)
+
+def transform_css_colors(css: str, transform):
+    """Rewrite the colors of a CSS stylesheet.
+
+    Parameters
+    ==========
+    css : str
+        The stylesheet.
+
+    transform : callable
+        Takes an array of shape (N,3) with dtype uint8 with the unique sRGB
+        colors of the document, and returns the new colors with the same
+        shape.
+
+    Returns
+    =======
+    css : str
+        The stylesheet with the transformed colors.
+    """
+    rewriter = _Rewriter(css)
+    rewriter.add_stylesheet(0, css)
+    return rewriter.rewrite(transform)
+
+def transform_svg_colors(svg: str, transform):
+    """Rewrite the colors of an SVG document.
+
+    The colors are taken from the presentation attributes (fill, stroke,
+    stop-color, ...), the style attributes and the <style> elements.
+
+    Parameters
+    ==========
+    svg : str
+        The SVG document.
+
+    transform : callable
+        See transform_css_colors.
+
+    Returns
+    =======
+    svg : str
+        The SVG document with the transformed colors.
+    """
+    rewriter = _Rewriter(svg)
+    style_elements = [(m.start(2), m.end(2)) for m in _style_element_regex.finditer(svg)]
+    for start, end in style_elements:
+        rewriter.add_stylesheet(start, svg[start:end])
+    for attribute in _attribute_regex.finditer(svg):
+        if style_elements and any(start <= attribute.start() < end for start, end in style_elements):
+            continue
+        group = 'dq' if attribute.start('dq') >= 0 else 'sq'
+        property_name = attribute.group('property')
+        if property_name == 'style':
+            rewriter.add_declarations(attribute.start(group), attribute.group(group))
+        else:
+            rewriter.add_value(attribute.start(group), attribute.group(group), property_name)
+    return rewriter.rewrite(transform)
+
+def simulate_cvd_css(css: str, simulator: simulate.Simulator, deficiency: simulate.Deficiency, severity: float):
+    """Simulate all the colors of a CSS stylesheet, see transform_css_colors."""
+    return transform_css_colors(css, lambda colors: simulator.simulate_cvd_palette(colors, deficiency, severity))
+
+def simulate_cvd_svg(svg: str, simulator: simulate.Simulator, deficiency: simulate.Deficiency, severity: float):
+    """Simulate all the colors of an SVG document, see transform_svg_colors."""
+    return transform_svg_colors(svg, lambda colors: simulator.simulate_cvd_palette(colors, deficiency, severity))
+
+def simulate_cvd_document(text: str, suffix: str, simulator: simulate.Simulator, deficiency: simulate.Deficiency, severity: float):
+    """Simulate an SVG or CSS document, depending on its file extension (see DOCUMENT_SUFFIXES)."""
+    suffix = suffix.lower()
+    if suffix == '.svg':
+        return simulate_cvd_svg(text, simulator, deficiency, severity)
+    if suffix == '.css':
+        return simulate_cvd_css(text, simulator, deficiency, severity)
+    raise ValueError(f"Unsupported document type '{suffix}', expected one of {DOCUMENT_SUFFIXES}")
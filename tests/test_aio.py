@@ -0,0 +1,66 @@
+#!/usr/bin/env python3
+
+import asyncio
+import io
+import unittest
+
+import numpy as np
+from PIL import Image
+
+from daltonlens import aio, generate, simulate
+
+class TestAsyncSimulator(unittest.TestCase):
+
+    def test_simulate(self):
+        im = generate.rgb_span(128, 100)
+        simulator = simulate.Simulator_Brettel1997()
+        async_simulator = aio.AsyncSimulator(simulator, max_concurrency=2, tile_rows=32)
+        expected = [simulator.simulate_cvd(im, d, 0.6) for d in simulate.Deficiency]
+
+        async def run():
+            single = await async_simulator.simulate_cvd(im, simulate.Deficiency.PROTAN, 0.6)
+            batch = await asyncio.gather(*[async_simulator.simulate_cvd_batch([im, im], d, 0.6) for d in simulate.Deficiency])
+            png = io.BytesIO()
+            Image.fromarray(im).save(png, format='PNG')
+            encoded = await async_simulator.simulate_cvd_file(png.getvalue(), simulate.Deficiency.TRITAN, 0.6)
+            return single, batch, encoded
+
+        single, batch, encoded = asyncio.run(run())
+        np.testing.assert_array_equal(single, expected[0])
+        for outputs, expected_out in zip(batch, expected):
+            self.assertEqual(len(outputs), 2)
+            for out in outputs:
+                np.testing.assert_array_equal(out, expected_out)
+        np.testing.assert_array_equal(np.asarray(Image.open(io.BytesIO(encoded))), expected[2])
+
+    def test_several_loops(self):
+        # A long-lived instance works across event loops.
+        im = generate.rgb_span(64, 16)
+        async_simulator = aio.AsyncSimulator(simulate.Simulator_Machado2009(), max_concurrency=1)
+        expected = simulate.Simulator_Machado2009().simulate_cvd(im, simulate.Deficiency.DEUTAN, 0.5)
+
+        async def run():
+            return await asyncio.gather(*[async_simulator.simulate_cvd(im, simulate.Deficiency.DEUTAN, 0.5) for _ in range(4)])
+
+        for _ in range(2):
+            for out in asyncio.run(run()):
+                np.testing.assert_array_equal(out, expected)
+
+    def test_cancel(self):
+        im = generate.rgb_span(256, 1024)
+        async_simulator = aio.AsyncSimulator(simulate.Simulator_Machado2009(), tile_rows=1)
+
+        async def run():
+            task = asyncio.ensure_future(async_simulator.simulate_cvd(im, simulate.Deficiency.DEUTAN, 1.0))
+            await asyncio.sleep(0.01)
+            task.cancel()
+            with self.assertRaises(asyncio.CancelledError):
+                await task
+            # The semaphore was released.
+            out = await async_simulator.simulate_cvd(im[:4], simulate.Deficiency.DEUTAN, 1.0)
+            self.assertEqual(out.shape, (4, 256, 3))
+
+        asyncio.run(run())
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,43 @@
+#!/usr/bin/env python3
+
+import unittest
+
+import numpy as np
+
+from daltonlens import analyze, simulate, generate
+
+def two_color_image(c1, c2):
+    im = np.zeros((64, 64, 3), dtype=np.uint8)
+    im[:, :32] = c1
+    im[:, 32:] = c2
+    return im
+
+class TestConfusionScore(unittest.TestCase):
+
+    def test_scores(self):
+        simulator = simulate.Simulator_Vienot1999()
+        red_green = two_color_image((200, 60, 40), (60, 160, 40))
+        blue_yellow = two_color_image((240, 220, 40), (40, 60, 220))
+        gray_ramp = np.repeat(np.repeat(np.arange(0, 256, 4, dtype=np.uint8)[:,np.newaxis,np.newaxis], 64, 1), 3, 2)
+
+        red_green_score = analyze.confusion_score(red_green, simulator, simulate.Deficiency.DEUTAN)
+        self.assertGreater(red_green_score.score, 0.8)
+        self.assertLess(analyze.confusion_score(blue_yellow, simulator, simulate.Deficiency.DEUTAN).score, 0.05)
+        self.assertLess(analyze.confusion_score(gray_ramp, simulator, simulate.Deficiency.PROTAN).score, 0.05)
+        # Red/green is fine for tritans.
+        self.assertLess(analyze.confusion_score(red_green, simulator, simulate.Deficiency.TRITAN).contrast_loss, red_green_score.contrast_loss)
+
+        # Severity 0 is normal vision.
+        span = generate.rgb_span(27*4, 27*4)
+        self.assertLess(analyze.confusion_score(span, simulator, simulate.Deficiency.PROTAN, severity=0.0).score, 0.01)
+        self.assertGreater(analyze.confusion_score(span, simulator, simulate.Deficiency.PROTAN).distinct_color_loss, 0.2)
+
+    def test_batch(self):
+        simulator = simulate.Simulator_Machado2009()
+        images = [generate.rgb_span(27, 27), two_color_image((200, 60, 40), (60, 160, 40))]
+        scores = analyze.confusion_scores(images, simulator, simulate.Deficiency.PROTAN, max_samples=1000)
+        self.assertEqual(len(scores), 2)
+        self.assertEqual(scores[1], analyze.confusion_score(images[1], simulator, simulate.Deficiency.PROTAN, max_samples=1000))
+
+if __name__ == '__main__':
+    unittest.main()
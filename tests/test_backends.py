@@ -0,0 +1,84 @@
+#!/usr/bin/env python3
+
+import unittest
+from concurrent.futures import ThreadPoolExecutor
+
+import numpy as np
+
+from daltonlens import backends, convert, generate, simulate
+
+try:
+    import numba
+    has_numba = True
+except ImportError:
+    has_numba = False
+
+class TestBackends(unittest.TestCase):
+
+    def test_registry(self):
+        self.assertIs(backends.current(), backends.get_backend('numpy'))
+        self.assertIn('numpy', backends.available_backends())
+        with self.assertRaises(ValueError):
+            backends.set_backend('nonexistent')
+
+        class ScaledBackend(backends.NumpyBackend):
+            """Deliberately wrong backend."""
+            def apply_color_matrix(self, im, m):
+                return convert.apply_color_matrix(im, m) * 0.5
+
+        backends.register_backend('scaled', ScaledBackend)
+        self.addCleanup(backends.unregister_backend, 'scaled')
+        with self.assertRaises(RuntimeError):
+            backends.set_backend('scaled')
+        self.assertIs(backends.current(), backends.get_backend('numpy'))
+
+        with backends.use_backend('scaled', validate=False):
+            self.assertIsInstance(backends.current(), ScaledBackend)
+            # Only for the current thread.
+            with ThreadPoolExecutor(1) as executor:
+                self.assertIs(executor.submit(backends.current).result(), backends.get_backend('numpy'))
+        self.assertIs(backends.current(), backends.get_backend('numpy'))
+
+        # Validating never changes the selection, and the tolerance is up to the caller.
+        self.assertGreater(backends.validate_backend(ScaledBackend()), 1)
+        self.assertIs(backends.current(), backends.get_backend('numpy'))
+        with backends.use_backend('scaled', tolerance=255):
+            self.assertIsInstance(backends.current(), ScaledBackend)
+        with self.assertRaises(RuntimeError):
+            backends.set_backend('scaled', tolerance=1)
+
+        backends.set_backend('scaled', validate=False)
+        backends.unregister_backend('scaled')
+        self.assertNotIn('scaled', backends.available_backends())
+        self.assertIs(backends.current(), backends.get_backend('numpy'))
+        with self.assertRaises(ValueError):
+            backends.unregister_backend('numpy')
+
+    @unittest.skipUnless(has_numba, "numba is not installed")
+    def test_numba(self):
+        reference = backends.get_backend('numpy')
+        numba_backend = backends.get_backend('numba')
+        self.assertLessEqual(backends.validate_backend(numba_backend), 1)
+
+        rng = np.random.default_rng(0)
+        im = rng.random((17, 23, 3)).astype(np.float32)
+        for encoding in convert.ImageEncoding:
+            np.testing.assert_allclose(numba_backend.linearRGB_from_encoding(im, encoding),
+                                       reference.linearRGB_from_encoding(im, encoding), rtol=1e-5, atol=1e-6)
+            np.testing.assert_allclose(numba_backend.encoding_from_linearRGB(im, encoding),
+                                       reference.encoding_from_linearRGB(im, encoding), rtol=1e-5, atol=1e-6)
+        m = rng.random((3, 3))
+        np.testing.assert_allclose(numba_backend.apply_color_matrix(im, m), reference.apply_color_matrix(im, m), rtol=1e-6)
+
+        model = convert.LMSModel_sRGB_SmithPokorny75()
+        brettel_data = simulate.Simulator_Brettel1997(model).compile(simulate.Deficiency.TRITAN, 1.0).inspection
+        args = (im, model.LMS_from_linearRGB, brettel_data['H1'], brettel_data['H2'], brettel_data['n_sep_plane'], model.linearRGB_from_LMS)
+        np.testing.assert_allclose(numba_backend.brettel_projection(*args), reference.brettel_projection(*args), atol=1e-6)
+
+        im = convert.linearRGB_from_gamma22(convert.as_float32(generate.rgb_span(27*4, 27*4)))
+        for c in simulate.coblis_v2_constants.values():
+            args = (im, c['cpu'], c['cpv'], c['am'], c['ayi'])
+            np.testing.assert_allclose(numba_backend.coblis_v2_dichromacy(*args), reference.coblis_v2_dichromacy(*args), rtol=1e-5, atol=1e-6)
+
+if __name__ == '__main__':
+    unittest.main()
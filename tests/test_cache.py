@@ -0,0 +1,98 @@
+#!/usr/bin/env python3
+
+import os
+import tempfile
+import time
+import unittest
+from pathlib import Path
+
+import numpy as np
+
+from daltonlens import backends, cache, generate, lut, simulate
+
+class TestResultCache(unittest.TestCase):
+
+    def test_keys(self):
+        im = generate.rgb_span(27, 27)
+        c = cache.ResultCache()
+        vienot = simulate.Simulator_Vienot1999()
+        key = c.key(im, vienot, simulate.Deficiency.PROTAN, 1.0)
+        self.assertEqual(key, c.key(im.copy(), simulate.Simulator_Vienot1999(), simulate.Deficiency.PROTAN, 1.0))
+        self.assertNotEqual(key, c.key(im[:, ::-1], vienot, simulate.Deficiency.PROTAN, 1.0))
+        self.assertNotEqual(key, c.key(im.reshape(27*27, 1, 3), vienot, simulate.Deficiency.PROTAN, 1.0))
+        self.assertNotEqual(key, c.key(im, vienot, simulate.Deficiency.PROTAN, 0.9))
+        self.assertNotEqual(key, c.key(im, vienot, simulate.Deficiency.DEUTAN, 1.0))
+        self.assertNotEqual(key, c.key(im, simulate.Simulator_Machado2009(), simulate.Deficiency.PROTAN, 1.0))
+        self.assertNotEqual(key, c.key(im, vienot, simulate.Deficiency.PROTAN, 1.0, precision='fixed'))
+        self.assertNotEqual(key, c.key(im.tobytes(), vienot, simulate.Deficiency.PROTAN, 1.0))
+
+    def test_memory_tier(self):
+        c = cache.ResultCache(max_memory_bytes=250)
+        for i in range(3):
+            c.put(f"key{i}", bytes(100))
+        self.assertIsNone(c.get("key0"))
+        self.assertIsNotNone(c.get("key1"))
+        c.put("key3", bytes(100))
+        # key1 was used more recently than key2.
+        self.assertIsNone(c.get("key2"))
+        self.assertIsNotNone(c.get("key1"))
+        c.put("too_big", bytes(1000))
+        self.assertIsNone(c.get("too_big"))
+        stats = c.stats()
+        self.assertEqual((stats['hits'], stats['misses'], stats['evictions']), (2, 3, 2))
+        self.assertEqual((stats['memory_entries'], stats['memory_bytes']), (2, 200))
+
+    def test_disk_tier(self):
+        with tempfile.TemporaryDirectory() as cache_dir:
+            array = np.arange(60, dtype=np.uint8).reshape(4, 5, 3)
+            c = cache.ResultCache(cache_dir=cache_dir, max_disk_bytes=4096)
+            c.put("array", array)
+            c.put("bytes", b"content")
+            self.assertFalse(array.flags.writeable)
+
+            # A new instance, e.g. in another process, only has the disk tier.
+            c = cache.ResultCache(cache_dir=cache_dir, max_disk_bytes=4096)
+            np.testing.assert_array_equal(c.get("array"), array)
+            self.assertEqual(c.get("bytes"), b"content")
+            self.assertEqual(c.get("bytes"), b"content")
+            stats = c.stats()
+            self.assertEqual((stats['disk_hits'], stats['memory_hits']), (2, 1))
+
+            c.put("large", bytes(4000))
+            self.assertIsNone(cache.ResultCache(cache_dir=cache_dir).get("array"))
+            c.clear()
+            self.assertIsNone(c.get("large"))
+
+            # The folders of other versions are deleted once unused for a while.
+            old = time.time() - lut.STALE_VERSION_SECONDS - 60
+            stale_dir, recent_dir = Path(cache_dir) / "results-v0.0-0", Path(cache_dir) / "results-v0.1-0"
+            for path in [stale_dir, recent_dir]:
+                path.mkdir()
+                (path / "entry.bin").write_bytes(b"")
+            for path in [stale_dir / "entry.bin", stale_dir]:
+                os.utime(path, (old, old))
+            cache.ResultCache(cache_dir=cache_dir)
+            self.assertFalse(stale_dir.exists())
+            self.assertTrue(recent_dir.exists())
+
+    def test_cached_simulator(self):
+        im = generate.rgb_span(27*4, 27*4)
+        simulator = simulate.Simulator_Brettel1997()
+        cached_simulator = cache.CachedSimulator(simulator)
+        expected = simulator.simulate_cvd(im, simulate.Deficiency.TRITAN, 0.7)
+        for _ in range(3):
+            out = cached_simulator.simulate_cvd(im, simulate.Deficiency.TRITAN, 0.7)
+            np.testing.assert_array_equal(out, expected)
+            out[:] = 0
+        stats = cached_simulator.cache.stats()
+        self.assertEqual((stats['hits'], stats['misses']), (2, 1))
+
+        # Other backends can differ from the reference by 1 level, they get their own entries.
+        if 'numba' in backends.available_backends():
+            with backends.use_backend('numba'):
+                expected = simulator.simulate_cvd(im, simulate.Deficiency.TRITAN, 0.7)
+                np.testing.assert_array_equal(cached_simulator.simulate_cvd(im, simulate.Deficiency.TRITAN, 0.7), expected)
+            self.assertEqual(cached_simulator.cache.stats()['misses'], 2)
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,44 @@
+#!/usr/bin/env python3
+
+import unittest
+
+import numpy as np
+
+from daltonlens import generate, simulate
+
+try:
+    import dask.array as da
+    from dask.distributed import Client, LocalCluster
+    has_dask = True
+except ImportError:
+    has_dask = False
+
+@unittest.skipUnless(has_dask, "dask[array,distributed] is not installed")
+class TestChunked(unittest.TestCase):
+
+    def test_graph(self):
+        im = generate.rgb_span(27*4, 27*4)
+        simulator = simulate.Simulator_Brettel1997()
+        out = simulator.simulate_cvd(da.from_array(im, chunks=(50, 40, 1)), simulate.Deficiency.TRITAN, 0.7)
+        self.assertEqual(out.chunks[-1], (3,))
+        # The compiled simulation is a single node shared by all the blocks.
+        graph = dict(out.__dask_graph__())
+        self.assertEqual(len([k for k in graph if str(k).startswith('CompiledSimulation')]), 1)
+        compiled = simulator.compile(simulate.Deficiency.TRITAN, 0.7)
+        np.testing.assert_array_equal(out.compute(scheduler='sync'), compiled.simulate_cvd(im))
+
+        chw = np.moveaxis(im, -1, 0)
+        out = simulator.simulate_cvd(da.from_array(chw, chunks=(1, 50, 40)), simulate.Deficiency.TRITAN, 0.7, layout='CHW')
+        self.assertEqual(out.chunks[0], (3,))
+        np.testing.assert_array_equal(out.compute(scheduler='sync'), compiled.simulate_cvd(chw, layout='CHW'))
+
+    def test_local_cluster(self):
+        images = np.stack([generate.rgb_span(27*4, 27*4)] * 3)
+        chunked_images = da.from_array(images, chunks=(1, 64, 64, 3))
+        with LocalCluster(n_workers=2, threads_per_worker=1, processes=True, dashboard_address=None) as cluster, Client(cluster):
+            for simulator in [simulate.Simulator_Vienot1999(), simulate.Simulator_Machado2009(), simulate.Simulator_CoblisV2()]:
+                out = simulator.simulate_cvd(chunked_images, simulate.Deficiency.DEUTAN, 0.8).compute()
+                np.testing.assert_array_equal(out, simulator.compile(simulate.Deficiency.DEUTAN, 0.8).simulate_cvd(images))
+
+if __name__ == '__main__':
+    unittest.main()
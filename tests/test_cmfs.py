@@ -0,0 +1,45 @@
+#!/usr/bin/env python3
+
+import unittest
+
+import numpy as np
+
+from daltonlens import cmfs
+
+try:
+    import colour
+except ImportError:
+    colour = None
+
+class TestCMFs(unittest.TestCase):
+
+    def test_dense_tables(self):
+        self.assertEqual(cmfs.CMF_XYZ_JuddVos.shape, (825 - 380 + 1, 3))
+        self.assertEqual(cmfs.CMF_XYZ_CIE1931.shape, (830 - 360 + 1, 3))
+        # Sprague interpolation goes through the tabulated samples.
+        for wavelength, xyz in cmfs.XYZ_JuddVos_DATA_CMF.items():
+            self.assertTrue(np.allclose(cmfs.wavelength_to_XYZ_JuddVos(wavelength), xyz, rtol=1e-12, atol=0))
+
+        xyz = cmfs.wavelength_to_XYZ_JuddVos(np.array([[475.0, 575.0], [485.0, 660.0]]))
+        self.assertEqual(xyz.shape, (2, 2, 3))
+        self.assertTrue(np.allclose(xyz[1,1], [0.16161, 0.061, 1.1906e-05]))
+        with self.assertRaises(ValueError):
+            cmfs.wavelength_to_XYZ(300)
+
+    @unittest.skipIf(colour is None, "colour-science is not installed")
+    def test_against_colour(self):
+        cie1931 = colour.MSDS_CMFS['CIE 1931 2 Degree Standard Observer']
+        juddvos = colour.colorimetry.XYZ_ColourMatchingFunctions(cmfs.XYZ_JuddVos_DATA_CMF, name='Judd-Vos')
+
+        # Integer wavelengths are exactly the tables of colour.
+        wavelengths = np.arange(380, 826)
+        self.assertTrue(np.allclose(cmfs.wavelength_to_XYZ(wavelengths), colour.wavelength_to_XYZ(wavelengths, cie1931), atol=1e-12))
+        self.assertTrue(np.allclose(cmfs.wavelength_to_XYZ_JuddVos(wavelengths), colour.wavelength_to_XYZ(wavelengths, juddvos), atol=1e-12))
+
+        # colour uses Sprague in between, we use linear interpolation on the 1 nm table.
+        wavelengths = np.linspace(380, 825, 4451)
+        self.assertTrue(np.allclose(cmfs.wavelength_to_XYZ(wavelengths), colour.wavelength_to_XYZ(wavelengths, cie1931), atol=1e-3))
+        self.assertTrue(np.allclose(cmfs.wavelength_to_XYZ_JuddVos(wavelengths), colour.wavelength_to_XYZ(wavelengths, juddvos), atol=1e-3))
+
+if __name__ == '__main__':
+    unittest.main()
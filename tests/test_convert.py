@@ -0,0 +1,98 @@
+#!/usr/bin/env python3
+
+import unittest
+
+import numpy as np
+
+from daltonlens import convert
+
+try:
+    import colour
+except ImportError:
+    colour = None
+
+# A few pairs of the CIEDE2000 test data of Sharma et al. (2005)
+sharma_2005_pairs = [
+    ([50.0000,  2.6772, -79.7751], [50.0000,  0.0000, -82.7485],  2.0425),
+    ([50.0000, -1.3802, -84.2814], [50.0000,  0.0000, -82.7485],  1.0000),
+    ([50.0000,  0.0000,   0.0000], [50.0000, -1.0000,   2.0000],  2.3669),
+    ([50.0000,  2.4900,  -0.0010], [50.0000, -2.4900,   0.0009],  7.1792),
+    ([50.0000,  2.5000,   0.0000], [73.0000, 25.0000, -18.0000], 27.1492),
+    ([90.8027, -2.0831,   1.4410], [91.1528, -1.6435,   0.0447],  1.4441),
+    ([ 2.0776,  0.0795,  -1.1350], [ 0.9033, -0.0636,  -0.5514],  0.9082),
+]
+
+class TestColorSpaces(unittest.TestCase):
+
+    def test_hdr_transfer_functions(self):
+        # 100 cd/m² and 1000 cd/m² in PQ, and the reference points of HLG.
+        self.assertAlmostEqual(float(convert.pq_from_linearRGB(0.01)), 0.5081, places=4)
+        self.assertAlmostEqual(float(convert.pq_from_linearRGB(0.1)), 0.7518, places=4)
+        self.assertAlmostEqual(float(convert.linearRGB_from_hlg(0.5)), 1.0/12.0)
+        self.assertAlmostEqual(float(convert.linearRGB_from_hlg(1.0)), 1.0, places=6)
+
+        v = np.linspace(0, 1, 1001, dtype=np.float32)
+        u = np.arange(256, dtype=np.uint8)
+        for encoding in convert.HDR_ENCODINGS:
+            linear = convert.linearRGB_from_encoding(v, encoding)
+            self.assertEqual(linear.dtype, np.float32)
+            self.assertTrue(np.all(np.diff(linear) >= 0))
+            np.testing.assert_allclose(convert.encoding_from_linearRGB(linear, encoding), v, atol=1e-4)
+            np.testing.assert_allclose(convert.linearRGB_table_from_uint16(encoding)[u.astype(np.uint16) * 257],
+                                       convert.linearRGB_table_from_uint8(encoding), rtol=1e-5, atol=1e-7)
+            linear = convert.linearRGB_table_from_uint8(encoding)[u]
+            reference = convert.as_uint8(convert.encoding_from_linearRGB(linear, encoding))
+            self.assertLessEqual(np.max(np.abs(convert.uint8_from_linearRGB_float16_table(linear, encoding).astype(int) - reference)), 1)
+
+    def test_primaries(self):
+        # Display P3 matrix from the ICC profile of Apple.
+        np.testing.assert_allclose(convert.XYZ_from_linearRGB_DisplayP3, [[0.4866, 0.2657, 0.1982],
+                                                                         [0.2290, 0.6917, 0.0793],
+                                                                         [0.0000, 0.0451, 1.0439]], atol=1e-4)
+        np.testing.assert_allclose(convert.XYZ_from_linearRGB_BT2020 @ [1, 1, 1], convert.XYZ_D65)
+        bt709 = convert.LMSModel_SmithPokorny75_WithPrimaries(*convert.RGB_PRIMARIES_BT709)
+        np.testing.assert_allclose(bt709.LMS_from_linearRGB, convert.LMSModel_sRGB_SmithPokorny75().LMS_from_linearRGB, atol=1e-5)
+
+class TestLab(unittest.TestCase):
+
+    def test_Lab(self):
+        Lab = convert.Lab_from_linearRGB(np.array([[1.0, 1.0, 1.0], [0.0, 0.0, 0.0], [0.18, 0.18, 0.18]]))
+        self.assertTrue(np.allclose(Lab[:,0], [100.0, 0.0, 49.5], atol=0.1))
+        self.assertTrue(np.allclose(Lab[:,1:], 0.0, atol=0.05))
+
+        rgb = np.random.default_rng(0).random((16, 16, 3))
+        Lab = convert.Lab_from_linearRGB(rgb)
+        Lab32 = convert.Lab_from_linearRGB(rgb.astype(np.float32))
+        self.assertEqual(Lab32.dtype, np.float32)
+        self.assertTrue(np.allclose(Lab, Lab32, atol=1e-3))
+        out = np.empty_like(Lab)
+        self.assertIs(convert.Lab_from_linearRGB(rgb, out=out), out)
+        self.assertTrue(np.array_equal(out, Lab))
+
+    def test_delta_E(self):
+        Lab1 = np.array([p[0] for p in sharma_2005_pairs])
+        Lab2 = np.array([p[1] for p in sharma_2005_pairs])
+        expected = np.array([p[2] for p in sharma_2005_pairs])
+        self.assertTrue(np.allclose(convert.delta_E2000(Lab1, Lab2), expected, atol=1e-4))
+        self.assertTrue(np.allclose(convert.delta_E2000(Lab2, Lab1), expected, atol=1e-4))
+        self.assertTrue(np.allclose(convert.delta_E2000(Lab1.astype(np.float32), Lab2.astype(np.float32)), expected, atol=1e-3))
+        self.assertTrue(np.allclose(convert.delta_E76(Lab1, Lab2), np.linalg.norm(Lab1 - Lab2, axis=-1)))
+
+        # Pairwise distances with broadcasting.
+        dE = convert.delta_E2000(Lab1[:,np.newaxis,:], Lab1[np.newaxis,:,:])
+        self.assertEqual(dE.shape, (len(Lab1), len(Lab1)))
+        self.assertTrue(np.allclose(np.diag(dE), 0.0))
+
+    @unittest.skipIf(colour is None, "colour-science is not installed")
+    def test_against_colour(self):
+        rng = np.random.default_rng(1)
+        rgb1, rgb2 = rng.random((2, 1000, 3))
+        Lab1 = convert.Lab_from_linearRGB(rgb1)
+        Lab2 = convert.Lab_from_linearRGB(rgb2)
+        # Small differences due to the precision of the sRGB matrix.
+        self.assertTrue(np.allclose(Lab1, colour.XYZ_to_Lab(colour.sRGB_to_XYZ(rgb1, apply_cctf_decoding=False)), atol=0.05))
+        self.assertTrue(np.allclose(convert.delta_E2000(Lab1, Lab2), colour.delta_E(Lab1, Lab2, method='CIE 2000'), atol=1e-8))
+        self.assertTrue(np.allclose(convert.delta_E76(Lab1, Lab2), colour.delta_E(Lab1, Lab2, method='CIE 1976'), atol=1e-8))
+
+if __name__ == '__main__':
+    unittest.main()
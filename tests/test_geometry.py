@@ -0,0 +1,46 @@
+#!/usr/bin/env python3
+
+import unittest
+
+import numpy as np
+
+from daltonlens import convert, simulate, geometry
+
+class TestConfusionSegments(unittest.TestCase):
+
+    def test_segments(self):
+        lms_model = convert.LMSModel_sRGB_SmithPokorny75()
+        rng = np.random.default_rng(42)
+        rgb = rng.random((1000, 3))
+        lms = convert.apply_color_matrix(rgb, lms_model.LMS_from_linearRGB)
+        for deficiency in simulate.Deficiency:
+            segments, valid = geometry.lms_confusion_segments(lms, lms_model, deficiency)
+            self.assertEqual(segments.shape, (1000, 2, 3))
+            self.assertTrue(np.all(valid))
+
+            # Both endpoints are on the boundary of the RGB gamut.
+            rgb_endpoints = convert.apply_color_matrix(segments, lms_model.linearRGB_from_LMS)
+            self.assertTrue(np.all(rgb_endpoints > -1e-9) and np.all(rgb_endpoints < 1.0 + 1e-9))
+            distance_to_boundary = np.minimum(np.abs(rgb_endpoints), np.abs(rgb_endpoints - 1.0)).min(axis=-1)
+            self.assertTrue(np.all(distance_to_boundary < 1e-9))
+
+            # The input color is on the segment, which is along the confusion axis.
+            axis = simulate.lms_confusion_axis(deficiency)
+            t = (lms - segments[:,0]) @ axis
+            length = (segments[:,1] - segments[:,0]) @ axis
+            self.assertTrue(np.allclose(segments[:,0] + t[:,np.newaxis]*axis, lms))
+            self.assertTrue(np.all((t >= -1e-9) & (t <= length + 1e-9)))
+
+            p1, p2 = geometry.lms_confusion_segment(lms[0], lms_model, deficiency)
+            self.assertTrue(np.allclose(p1, segments[0,0]) and np.allclose(p2, segments[0,1]))
+
+    def test_outside_gamut(self):
+        lms_model = convert.LMSModel_sRGB_SmithPokorny75()
+        # Negative along an axis orthogonal to the confusion one, the line never enters the cube.
+        lms = lms_model.LMS_from_linearRGB @ np.array([-0.5, -0.5, -0.5])
+        segments, valid = geometry.lms_confusion_segments(lms, lms_model, simulate.Deficiency.TRITAN)
+        self.assertFalse(valid[0])
+        self.assertTrue(np.all(np.isnan(segments[0])))
+
+if __name__ == '__main__':
+    unittest.main()
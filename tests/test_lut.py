@@ -0,0 +1,115 @@
+#!/usr/bin/env python3
+
+import os
+import time
+import unittest
+import tempfile
+from pathlib import Path
+
+import numpy as np
+
+from daltonlens import __version__, convert, simulate, generate, lut
+
+class TestLUT(unittest.TestCase):
+
+    def test_full_lut(self):
+        simulator = simulate.Simulator_Machado2009()
+        table = lut.compute_lut(simulator, simulate.Deficiency.DEUTAN, 0.6)
+        im = generate.rgb_span(27*8, 27*8)
+        out = lut.apply_lut(table, im)
+        self.assertTrue(np.array_equal(out, simulator.simulate_cvd(im, simulate.Deficiency.DEUTAN, 0.6)))
+
+    def test_fingerprint(self):
+        fp = lut.simulator_fingerprint
+        vienot = simulate.Simulator_Vienot1999()
+        self.assertEqual(fp(vienot), fp(simulate.Simulator_Vienot1999()))
+        self.assertNotEqual(fp(vienot), fp(simulate.Simulator_Vienot1999(convert.LMSModel_sRGB_HuntPointerEstevez())))
+        self.assertNotEqual(fp(simulate.Simulator_Brettel1997()), fp(simulate.Simulator_Brettel1997(use_white_as_neutral=False)))
+        # Running a simulation must not change the fingerprint.
+        before = fp(vienot)
+        vienot.simulate_cvd(generate.rgb_span(27, 27), simulate.Deficiency.PROTAN, 1.0)
+        self.assertEqual(fp(vienot), before)
+
+    def test_cache(self):
+        simulator = simulate.Simulator_CoblisV1()
+        with tempfile.TemporaryDirectory() as cache_dir:
+            # Other versions are only removed when they were not used for a while.
+            old = time.time() - lut.STALE_VERSION_SECONDS - 60
+            stale_dir = Path(cache_dir) / "luts-v0.0-0"
+            stale_dir.mkdir()
+            (stale_dir / "table.npy").write_bytes(b"")
+            for path in [stale_dir / "table.npy", stale_dir]:
+                os.utime(path, (old, old))
+            recent_dir = Path(cache_dir) / "luts-v0.0.1-0"
+            recent_dir.mkdir()
+            (recent_dir / "table.npy").write_bytes(b"")
+            os.utime(recent_dir, (old, old))
+            cache = lut.LUTCache(cache_dir, max_size_bytes=(256**3)*3 + 1024)
+            self.assertFalse(stale_dir.exists())
+            self.assertTrue(recent_dir.exists())
+            self.assertIn(__version__, cache.cache_dir.name)
+
+            table = cache.get(simulator, simulate.Deficiency.PROTAN, 1.0)
+            self.assertEqual(len(list(cache.cache_dir.glob('*.npy'))), 1)
+            cached_table = cache.get(simulator, simulate.Deficiency.PROTAN, 1.0)
+            self.assertIsInstance(cached_table, np.memmap)
+            self.assertTrue(np.array_equal(table, cached_table))
+
+            # Only room for one table, the first one gets evicted.
+            cache.get(simulator, simulate.Deficiency.DEUTAN, 1.0)
+            self.assertEqual(len(list(cache.cache_dir.glob('*.npy'))), 1)
+            self.assertEqual(len(list(cache.cache_dir.glob('*.tmp'))), 0)
+
+            # Temporary files of killed writers get deleted, the others count in the total size.
+            leftover = cache.cache_dir / "killed.tmp"
+            leftover.write_bytes(b"\0" * 2048)
+            os.utime(leftover, (old, old))
+            in_progress = cache.cache_dir / "writing.tmp"
+            in_progress.write_bytes(b"\0" * 2048)
+            lut.LUTCache(cache_dir, max_size_bytes=(256**3)*3 + 1024)
+            self.assertFalse(leftover.exists())
+            self.assertTrue(in_progress.exists())
+            self.assertEqual(len(list(cache.cache_dir.glob('*.npy'))), 0)
+
+    def test_compact_lut(self):
+        vienot = simulate.Simulator_Vienot1999()
+        machado = simulate.Simulator_Machado2009()
+        for size in [17, 33]:
+            table = lut.compute_compact_lut(vienot, simulate.Deficiency.PROTAN, 1.0, size)
+            self.assertEqual(table.shape, (size, size, size, 3))
+            for method in ['trilinear', 'tetrahedral']:
+                self.assertLessEqual(lut.compact_lut_max_error(table, vienot, simulate.Deficiency.PROTAN, 1.0, method), 1)
+        table = lut.compute_compact_lut(machado, simulate.Deficiency.DEUTAN, 0.4, 33)
+        self.assertLessEqual(lut.compact_lut_max_error(table, machado, simulate.Deficiency.DEUTAN, 0.4), 3)
+
+        # Grid nodes are reproduced exactly, whatever the input bit depth.
+        nodes = (np.array([[0, 8, 16], [32, 0, 32]]) / 32.0)
+        for im in [nodes, (nodes*65535).astype(np.uint16)]:
+            out = lut.apply_compact_lut(table, im, 'tetrahedral')
+            self.assertEqual(out.dtype, im.dtype)
+            expected = table[(nodes[:,0]*32).astype(int), (nodes[:,1]*32).astype(int), (nodes[:,2]*32).astype(int)]
+            self.assertTrue(np.allclose(lut._as_unit_float32(out), expected, atol=1e-4))
+
+    def test_cube_file(self):
+        table = lut.compute_compact_lut(simulate.Simulator_Brettel1997(), simulate.Deficiency.TRITAN, 1.0, 17)
+        with tempfile.TemporaryDirectory() as tmp_dir:
+            path = Path(tmp_dir) / "tritan.cube"
+            lut.save_cube_file(table, path)
+            self.assertTrue(np.allclose(lut.load_cube_file(path), table, atol=1e-6))
+
+    def test_pil_filter(self):
+        from PIL import Image
+        im = generate.rgb_span(27*4, 27*4)
+        for simulator, deficiency in [(simulate.Simulator_Vienot1999(), simulate.Deficiency.PROTAN),
+                                      (simulate.Simulator_Brettel1997(), simulate.Deficiency.TRITAN),
+                                      (simulate.Simulator_Machado2009(), simulate.Deficiency.DEUTAN)]:
+            pil_filter = simulator.compile(deficiency, 0.8).pil_filter(size=33)
+            self.assertEqual(pil_filter.size, (33, 33, 33))
+            report = lut.pil_filter_accuracy(pil_filter, simulator, deficiency, 0.8, image=im)
+            self.assertLessEqual(report['max_error'], 3)
+            self.assertLess(report['mean_error'], 0.15)
+            out = np.asarray(Image.fromarray(im).filter(pil_filter))
+            self.assertLessEqual(np.max(np.abs(out.astype(int) - simulator.simulate_cvd(im, deficiency, 0.8))), report['max_error'])
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,56 @@
+#!/usr/bin/env python3
+
+import argparse
+import tempfile
+import unittest
+from pathlib import Path
+
+import numpy as np
+from PIL import Image
+
+from daltonlens import backends, generate, simulate
+from daltonlens.main import composite_grid, encoder_options, load_image, rgb_array, severity_list, simulate_variants, simulator_from_str
+
+class TestMain(unittest.TestCase):
+
+    def test_variants(self):
+        im = generate.rgb_span(64, 64)
+        args = argparse.Namespace(max_unique_colors=0, precision='float32', lut_cache=False, lut_cache_dir=None)
+        variants = [(m, d, s) for m in ['vienot', 'coblisV2'] for s in [0.5, 1.0] for d in ['protan', 'tritan']]
+        def check_variants():
+            outputs = simulate_variants(im, variants, args)
+            for (model, deficiency, severity), out in zip(variants, outputs):
+                deficiency = simulate.Deficiency.PROTAN if deficiency == 'protan' else simulate.Deficiency.TRITAN
+                np.testing.assert_array_equal(out, simulator_from_str[model].simulate_cvd(im, deficiency, severity))
+            return outputs
+
+        outputs = check_variants()
+        # Same result as simulate_cvd with the fused kernels of the other backends.
+        for name in backends.available_backends():
+            with backends.use_backend(name):
+                check_variants()
+
+        grid = composite_grid(outputs, [str(v) for v in variants], n_per_row=2)
+        self.assertEqual(grid.size, (2*64, 4*(64 + 24)))
+
+    def test_severity_list(self):
+        self.assertEqual(severity_list("0.5,1"), [0.5, 1.0])
+        for value in ["0.5,high", "1.5"]:
+            with self.assertRaises(argparse.ArgumentTypeError):
+                severity_list(value)
+
+    def test_io(self):
+        with tempfile.TemporaryDirectory() as tmpdir:
+            path = Path(tmpdir) / "input.jpg"
+            Image.fromarray(generate.rgb_span(64, 64)).resize((1000, 800)).save(path)
+            im = rgb_array(load_image(path, max_size=300))
+            self.assertEqual(im.shape, (240, 300, 3))
+            self.assertEqual(rgb_array(load_image(path)).shape, (800, 1000, 3))
+
+        args = argparse.Namespace(png_compress_level=1, jpeg_quality=90, webp_quality=None, webp_lossless=True)
+        self.assertEqual(encoder_options(Path("out.png"), args), {'compress_level': 1})
+        self.assertEqual(encoder_options(Path("out.JPG"), args), {'quality': 90})
+        self.assertEqual(encoder_options(Path("out.webp"), args), {'lossless': True})
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,63 @@
+#!/usr/bin/env python3
+
+import unittest
+
+import numpy as np
+
+from daltonlens import convert, generate, pipeline, simulate
+
+class TestPipeline(unittest.TestCase):
+
+    def test_simulation(self):
+        im = generate.rgb_span(27*8, 27*8)
+        for simulator in [simulate.Simulator_Brettel1997(), simulate.Simulator_Machado2009(), simulate.Simulator_CoblisV2()]:
+            for deficiency in [simulate.Deficiency.PROTAN, simulate.Deficiency.TRITAN]:
+                p = pipeline.Pipeline(simulator.imageEncoding).add_simulation(simulator, deficiency, 0.7)
+                out = p.apply(im)
+                expected = simulator.simulate_cvd(im, deficiency, 0.7)
+                self.assertLessEqual(np.max(np.abs(out.astype(np.int16) - expected)), 1)
+
+    def test_fusion(self):
+        brettel = simulate.Simulator_Brettel1997()
+        p = pipeline.Pipeline(tile_pixels=1000)
+        p.add_color_space_conversion(convert.XYZ_from_linearRGB_DisplayP3)
+        p.add_simulation(brettel, simulate.Deficiency.PROTAN, 0.8)
+        p.add_matrix(np.eye(3) * 0.9, "dim")
+        p.add_simulation(brettel, simulate.Deficiency.DEUTAN, 0.5)
+        p.add_gamut_fitting()
+        p.add_simulation(simulate.Simulator_Vienot1999(), simulate.Deficiency.TRITAN, 1.0)
+
+        fused = p.fused_stages()
+        self.assertEqual([stage.kind for stage in fused], ['piecewise linear', 'opaque', 'linear'])
+        self.assertEqual(pipeline.count_regions(fused[0].tree), 4)
+        self.assertIn("6 stages fused into 3 passes", p.explain())
+
+        # Same as running all the stages one after the other on the whole image.
+        im = generate.rgb_span(27*8, 27*8)
+        colors = convert.linearRGB_table_from_uint8(convert.ImageEncoding.SRGB)[im].reshape(-1, 3)
+        for stage in p.stages:
+            colors = stage(colors)
+        expected = convert.as_uint8(convert.sRGB_from_linearRGB(colors)).reshape(im.shape)
+        np.testing.assert_array_equal(p.apply(im), expected)
+
+        # In place, with tiles that don't divide the image.
+        out = im.copy()
+        p.apply(out, out=out)
+        np.testing.assert_array_equal(out, expected)
+
+    def test_trees(self):
+        n = np.array([1.0, -1.0, 0.0])
+        T1, T2 = np.diag([1.0, 2.0, 3.0]), np.diag([3.0, 2.0, 1.0])
+        tree = pipeline.tree_from_piecewise_linear_rgb_matrices(T1, T2, n)
+        colors = np.array([[0.2, 0.5, 0.1], [0.5, 0.2, 0.1]])
+        np.testing.assert_allclose(pipeline.apply_tree(tree, colors), [T2 @ colors[0], T1 @ colors[1]])
+
+        # Matrices that make the split degenerate remove it.
+        swap_to_gray = np.ones((3, 3)) / 3
+        self.assertEqual(pipeline.count_regions(pipeline.compose_trees(tree, swap_to_gray)), 1)
+        self.assertEqual(pipeline.count_regions(pipeline.compose_trees(tree, tree)), 4)
+        composed = pipeline.compose_trees(tree, tree)
+        np.testing.assert_allclose(pipeline.apply_tree(composed, colors), pipeline.apply_tree(tree, pipeline.apply_tree(tree, colors)))
+
+if __name__ == '__main__':
+    unittest.main()
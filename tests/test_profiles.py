@@ -0,0 +1,71 @@
+#!/usr/bin/env python3
+
+import unittest
+
+import numpy as np
+
+from daltonlens import generate, lut, profiles, simulate
+
+class TestProfileStore(unittest.TestCase):
+
+    def test_simulate(self):
+        im = generate.rgb_span(27*8, 27*8)
+        store = profiles.ProfileStore(severity_buckets=10, lut_size=33)
+        store.set_profile("alice", "machado", simulate.Deficiency.DEUTAN, 0.63)
+        store.set_profile("bob", "coblisV2", simulate.Deficiency.PROTAN, 1.0)
+
+        expected = simulate.Simulator_Machado2009().simulate_cvd(im, simulate.Deficiency.DEUTAN, 0.6)
+        np.testing.assert_array_equal(store.simulate_cvd("alice", im), expected)
+        self.assertIsNotNone(store.compiled("machado", simulate.Deficiency.DEUTAN, 0.6).compiled)
+
+        # Simulating only uses the memory accounted in the store.
+        simulator = store.simulators['machado']
+        simulator._cvd_matrix_cache.clear()
+        simulator._typed_matrix_cache.clear()
+        store.simulate_cvd("alice", im)
+        self.assertEqual((len(simulator._cvd_matrix_cache), len(simulator._typed_matrix_cache)), (0, 0))
+
+        # Not piecewise linear, so it goes through a compact table.
+        compiled = store.compiled("coblisV2", simulate.Deficiency.PROTAN, 1.0)
+        self.assertEqual(compiled.lut.shape, (33, 33, 33, 3))
+        out = store.simulate_cvd("bob", im)
+        np.testing.assert_array_equal(out, lut.apply_compact_lut(compiled.lut, im))
+        expected = simulate.Simulator_CoblisV2().simulate_cvd(im, simulate.Deficiency.PROTAN, 1.0)
+        self.assertLess(np.mean(np.abs(out.astype(np.int16) - expected)), 1.0)
+
+        with self.assertRaises(KeyError):
+            store.simulate_cvd("carol", im)
+        with self.assertRaises(ValueError):
+            store.set_profile("carol", "unknown", simulate.Deficiency.PROTAN, 1.0)
+
+    def test_buckets(self):
+        store = profiles.ProfileStore(severity_buckets=10)
+        for i, severity in enumerate([0.61, 0.63, 0.58, 0.64]):
+            store.set_profile(f"user{i}", "brettel", simulate.Deficiency.PROTAN, severity)
+            store.compiled(*store.profile(f"user{i}"))
+        stats = store.stats()
+        self.assertEqual((stats['users'], stats['entries'], stats['hits'], stats['misses']), (4, 1, 3, 1))
+        self.assertEqual(stats['hit_rate'], 0.75)
+        self.assertEqual(store.quantize_severity(1.2), 1.0)
+        self.assertEqual(profiles.ProfileStore(severity_buckets=0).quantize_severity(0.63), 0.63)
+
+    def test_memory_budget(self):
+        lut_bytes = 17**3 * 3 * 4
+        store = profiles.ProfileStore(max_memory_bytes=lut_bytes + 1000, lut_size=17)
+        store.compiled("coblisV2", simulate.Deficiency.PROTAN, 1.0)
+        store.compiled("vienot", simulate.Deficiency.PROTAN, 1.0)
+        self.assertEqual(store.stats()['entries'], 2)
+        # The table does not fit with the other one, the least recently used is evicted.
+        store.compiled("vienot", simulate.Deficiency.PROTAN, 1.0)
+        store.compiled("coblisV2", simulate.Deficiency.TRITAN, 1.0)
+        stats = store.stats()
+        self.assertEqual((stats['entries'], stats['evictions']), (2, 1))
+        self.assertLessEqual(stats['memory_bytes'], store.max_memory_bytes)
+        store.compiled("vienot", simulate.Deficiency.PROTAN, 1.0)
+        self.assertEqual(store.stats()['hits'], 2)
+
+        store.clear()
+        self.assertEqual(store.stats()['memory_bytes'], 0)
+
+if __name__ == '__main__':
+    unittest.main()
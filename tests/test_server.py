@@ -0,0 +1,108 @@
+#!/usr/bin/env python3
+
+import http.client
+import io
+import json
+import threading
+import unittest
+import urllib.error
+import urllib.request
+from concurrent.futures import ThreadPoolExecutor
+
+import numpy as np
+from PIL import Image
+
+from daltonlens import generate, server, simulate
+from daltonlens.simulate import deficiency_from_str, simulator_from_str
+
+def encode_png(im):
+    output = io.BytesIO()
+    Image.fromarray(im).save(output, format='PNG')
+    return output.getvalue()
+
+class TestSimulationServer(unittest.TestCase):
+
+    def setUp(self):
+        self.server = server.SimulationServer('127.0.0.1', 0, num_workers=2, max_queue_size=2, max_body_bytes=1 << 16)
+        self.thread = threading.Thread(target=self.server.serve_forever, daemon=True)
+        self.thread.start()
+        host, port = self.server.server_address[:2]
+        self.url = f"http://{host}:{port}"
+
+    def tearDown(self):
+        self.server.shutdown()
+        self.thread.join()
+
+    def post(self, image_bytes, query):
+        request = urllib.request.Request(f"{self.url}/simulate?{query}", data=image_bytes, method='POST')
+        with urllib.request.urlopen(request) as response:
+            return response.headers['Content-Type'], response.read()
+
+    def test_simulate(self):
+        im = generate.rgb_span(64, 64)
+        content_type, output = self.post(encode_png(im), "deficiency=deutan&severity=0.7&model=machado")
+        self.assertEqual(content_type, 'image/png')
+        expected = simulator_from_str['machado'].simulate_cvd(im, simulate.Deficiency.DEUTAN, 0.7)
+        np.testing.assert_array_equal(np.asarray(Image.open(io.BytesIO(output))), expected)
+
+        # Concurrent requests with different simulators.
+        queries = [f"deficiency={d}&model={m}" for d in ['protan', 'tritan'] for m in ['vienot', 'brettel', 'coblisV2']]
+        with ThreadPoolExecutor(4) as clients:
+            outputs = list(clients.map(lambda q: self.post(encode_png(im), q)[1], queries))
+        for query, output in zip(queries, outputs):
+            params = dict(p.split('=') for p in query.split('&'))
+            expected = simulator_from_str[params['model']].simulate_cvd(im, deficiency_from_str[params['deficiency']], 1.0)
+            np.testing.assert_array_equal(np.asarray(Image.open(io.BytesIO(output))), expected)
+
+        with urllib.request.urlopen(f"{self.url}/metrics") as response:
+            metrics = json.loads(response.read())
+        self.assertEqual(metrics['requests'], 1 + len(queries))
+        self.assertEqual(metrics['latency']['count'], 1 + len(queries))
+        self.assertEqual(sum(metrics['latency']['buckets_ms'].values()), 1 + len(queries))
+        self.assertEqual(metrics['in_flight'], 0)
+
+    def test_errors(self):
+        im = encode_png(generate.rgb_span(8, 8))
+        with self.assertRaises(urllib.error.HTTPError) as cm:
+            self.post(im, "deficiency=achromat")
+        self.assertEqual(cm.exception.code, 400)
+        with self.assertRaises(urllib.error.HTTPError) as cm:
+            self.post(im, "format=notaformat")
+        self.assertEqual(cm.exception.code, 400)
+        with self.assertRaises(urllib.error.HTTPError) as cm:
+            self.post(b'not an image', "deficiency=protan")
+        self.assertEqual(cm.exception.code, 400)
+        with self.assertRaises(urllib.error.HTTPError) as cm:
+            self.post(bytes((1 << 16) + 1), "deficiency=protan")
+        self.assertEqual(cm.exception.code, 413)
+
+        host, port = self.server.server_address[:2]
+        connection = http.client.HTTPConnection(host, port)
+        connection.putrequest('POST', '/simulate')
+        connection.putheader('Content-Length', 'abc')
+        connection.endheaders()
+        self.assertEqual(connection.getresponse().status, 400)
+        connection.close()
+
+        # Failures that are not about the input are server errors.
+        def failing_process(*args):
+            raise RuntimeError("bug")
+        self.server.process = failing_process
+        with self.assertRaises(urllib.error.HTTPError) as cm:
+            self.post(im, "deficiency=protan")
+        self.assertEqual(cm.exception.code, 500)
+        del self.server.process
+
+        # Backpressure: when all the slots are taken new requests get rejected right away.
+        for _ in range(4):
+            self.server._slots.acquire()
+        with self.assertRaises(urllib.error.HTTPError) as cm:
+            self.post(im, "deficiency=protan")
+        self.assertEqual(cm.exception.code, 503)
+        self.assertEqual(self.server.metrics()['rejected'], 1)
+        for _ in range(4):
+            self.server._slots.release()
+        self.post(im, "deficiency=protan")
+
+if __name__ == '__main__':
+    unittest.main()
@@ -2,7 +2,9 @@
 
 import unittest
 import os
+import pickle
 import sys
+from concurrent.futures import ThreadPoolExecutor
 from pathlib import Path
 
 import numpy as np
@@ -14,9 +16,9 @@ test_images_path = Path(__file__).parent.absolute() / "images"
 
 class TestCVD(unittest.TestCase):
 
-    def checkModels(self, im, models_to_test, tolerance=1e-8):        
+    def checkModels(self, im, models_to_test, tolerance=1e-8, precision='float32'):        
         for simulator, deficiency, severity, gt_im in models_to_test:
-            out = simulator.simulate_cvd(im, deficiency=deficiency, severity=severity)
+            out = simulator.simulate_cvd(im, deficiency=deficiency, severity=severity, precision=precision)
             # Uncomment to generate a new ground truth.
             # Image.fromarray(out).save(test_images_path / ('generated_' + str(gt_im)))
             gt = np.asarray(Image.open(test_images_path / gt_im).convert('RGB'))
@@ -130,5 +132,279 @@ class TestCVD(unittest.TestCase):
         out_ref = vienot1999.simulate_cvd(im, simulate.Deficiency.DEUTAN, severity=1.0)
         self.assertTrue(np.allclose(out_auto, out_ref))
 
+    def test_palette(self):
+        simulators = [
+            simulate.Simulator_Vienot1999(),
+            simulate.Simulator_Brettel1997(),
+            simulate.Simulator_Machado2009(),
+            simulate.Simulator_CoblisV1(),
+            simulate.Simulator_CoblisV2(),
+        ]
+        im = generate.rgb_span(27, 27)
+        palette = im.reshape(-1,3)
+        hexstrings = convert.hexstrings_from_sRGB_uint8(palette)
+        self.assertEqual(hexstrings[-1], '#ffffff')
+        self.assertTrue(np.array_equal(convert.sRGB_uint8_from_hexstrings(hexstrings), palette))
+        self.assertTrue(np.array_equal(convert.sRGB_uint8_from_hexstrings(['#f80', 'ff8800']), [[255,136,0]]*2))
+        for simulator in simulators:
+            for deficiency in simulate.Deficiency:
+                for severity in [0.55, 1.0]:
+                    out_ref = simulator.simulate_cvd(im, deficiency, severity).reshape(-1,3)
+                    out = simulator.simulate_cvd_palette(palette, deficiency, severity)
+                    self.assertLessEqual(np.max(np.abs(out.astype(int) - out_ref)), 1)
+                    out_hex = simulator.simulate_cvd_palette(hexstrings, deficiency, severity)
+                    self.assertEqual(out_hex, convert.hexstrings_from_sRGB_uint8(out))
+
+        # Sweeping through severities keeps a bounded number of matrices.
+        machado = simulate.Simulator_Machado2009()
+        for severity in np.random.default_rng(0).random(simulate.MATRIX_CACHE_SIZE*4):
+            machado.simulate_cvd_palette(['#ff8000'], simulate.Deficiency.PROTAN, severity)
+            machado.simulate_cvd(im[:1, :1], simulate.Deficiency.PROTAN, severity)
+        self.assertEqual(len(machado._cvd_matrix_cache), simulate.MATRIX_CACHE_SIZE)
+        self.assertEqual(len(machado._typed_matrix_cache), simulate.MATRIX_CACHE_SIZE)
+        copy = pickle.loads(pickle.dumps(machado))
+        self.assertEqual(copy.simulate_cvd_palette(['#ff8000'], simulate.Deficiency.PROTAN, 0.5),
+                         machado.simulate_cvd_palette(['#ff8000'], simulate.Deficiency.PROTAN, 0.5))
+
+    def test_model_parameters(self):
+        # Changing the parameters of a simulator does not reuse the cached matrices.
+        im = generate.rgb_span(27, 27)
+        for simulator, name, value in [(simulate.Simulator_Vienot1999(), 'color_model', convert.LMSModel_DisplayP3_SmithPokorny75()),
+                                       (simulate.Simulator_Brettel1997(), 'color_model', convert.LMSModel_DisplayP3_SmithPokorny75()),
+                                       (simulate.Simulator_Brettel1997(), 'use_white_as_neutral', False)]:
+            simulator.simulate_cvd(im, simulate.Deficiency.PROTAN, 0.7)
+            simulator.simulate_cvd_palette(im[0], simulate.Deficiency.PROTAN, 0.7)
+            setattr(simulator, name, value)
+            fresh = type(simulator)(**{name: value})
+            np.testing.assert_array_equal(simulator.simulate_cvd(im, simulate.Deficiency.PROTAN, 0.7),
+                                          fresh.simulate_cvd(im, simulate.Deficiency.PROTAN, 0.7))
+            np.testing.assert_array_equal(simulator.simulate_cvd_palette(im[0], simulate.Deficiency.PROTAN, 0.7),
+                                          fresh.simulate_cvd_palette(im[0], simulate.Deficiency.PROTAN, 0.7))
+
+    def test_unique_colors(self):
+        simulator = simulate.Simulator_Brettel1997()
+        im = generate.rgb_span(27*8, 27*8)
+        out_ref = simulator.simulate_cvd(im, simulate.Deficiency.DEUTAN, 0.7)
+        out = simulator.simulate_cvd(im, simulate.Deficiency.DEUTAN, 0.7, max_unique_colors=1024)
+        self.assertLessEqual(np.max(np.abs(out.astype(int) - out_ref)), 1)
+        # Too many colors, falls back to the full image path.
+        out = simulator.simulate_cvd(im, simulate.Deficiency.DEUTAN, 0.7, max_unique_colors=16)
+        self.assertTrue(np.array_equal(out, out_ref))
+
+        # Large images go through tables over the RGB space instead of sorting the pixels.
+        large_im = np.tile(im, (4, 4, 1))
+        self.assertGreater(large_im.shape[0]*large_im.shape[1], simulate._MAX_PIXELS_TO_SORT)
+        out = simulator.simulate_cvd(large_im, simulate.Deficiency.DEUTAN, 0.7, max_unique_colors=1024)
+        self.assertTrue(np.array_equal(out, np.tile(simulator.simulate_cvd(im, simulate.Deficiency.DEUTAN, 0.7, max_unique_colors=1024), (4, 4, 1))))
+        with self.assertRaises(ValueError):
+            simulator.simulate_cvd(im, simulate.Deficiency.DEUTAN, 0.7, max_unique_colors=65537)
+
+    def test_precision(self):
+        im = generate.rgb_span(27*8, 27*8)
+        vienot1999 = simulate.Simulator_Vienot1999(convert.LMSModel_sRGB_SmithPokorny75(ignoreJuddVosCorrection=False))
+        brettel1997 = simulate.Simulator_Brettel1997(convert.LMSModel_sRGB_SmithPokorny75(ignoreJuddVosCorrection=False))
+        machado2009 = simulate.Simulator_Machado2009()
+        models_to_test = [
+            (vienot1999, simulate.Deficiency.PROTAN, 1.0, "vienot1999_protan_1.0.png"),
+            (vienot1999, simulate.Deficiency.DEUTAN, 0.55, "vienot1999_deutan_0.55.png"),
+            (brettel1997, simulate.Deficiency.DEUTAN, 1.0, "brettel1997_deutan_wn_1.0.png"),
+            (brettel1997, simulate.Deficiency.TRITAN, 0.55, "brettel1997_tritan_wn_0.55.png"),
+            (machado2009, simulate.Deficiency.PROTAN, 0.55, "machado2009_protan_0.55.png"),
+            (machado2009, simulate.Deficiency.TRITAN, 1.0, "machado2009_tritan_1.0.png"),
+        ]
+        for precision in ['fixed', 'float16']:
+            self.checkModels (im, models_to_test, tolerance=3, precision=precision)
+
+    def test_precision_vs_float32(self):
+        # Synthetic images only, so this runs without the reference images:
+        # the RGB span, random pixels and the extreme values of each channel.
+        rng = np.random.default_rng(0)
+        extremes = np.array(np.meshgrid([0, 1, 254, 255], [0, 1, 254, 255], [0, 1, 254, 255]), dtype=np.uint8).reshape(3, 8, 8)
+        images = [generate.rgb_span(27*8, 27*8),
+                  rng.integers(0, 256, size=(64, 64, 3), dtype=np.uint8),
+                  np.ascontiguousarray(np.moveaxis(extremes, 0, -1))]
+        im = np.concatenate([im.reshape(-1, 3) for im in images]).reshape(-1, 8, 3)
+        vienot1999 = simulate.Simulator_Vienot1999()
+        simulators = [vienot1999, simulate.Simulator_Brettel1997(), simulate.Simulator_Machado2009(), simulate.Simulator_Vischeck(),
+                      simulate.Simulator_CoblisV1(), simulate.Simulator_CoblisV2()]
+        for simulator in simulators:
+            for deficiency in simulate.Deficiency:
+                for severity in [0.55, 1.0]:
+                    out_ref = simulator.simulate_cvd(im, deficiency, severity)
+                    for precision in ['fixed', 'float16']:
+                        out = simulator.simulate_cvd(im, deficiency, severity, precision=precision)
+                        self.assertLessEqual(np.max(np.abs(out.astype(int) - out_ref)), 1)
+
+        with self.assertRaises(ValueError):
+            vienot1999.simulate_cvd(im, simulate.Deficiency.PROTAN, 1.0, precision='float64')
+
+    def test_region(self):
+        simulator = simulate.Simulator_Brettel1997()
+        im = generate.rgb_span(27*8, 27*4)
+        out_ref = simulator.simulate_cvd(im, simulate.Deficiency.PROTAN, 1.0)
+
+        out = np.zeros_like(im)
+        simulator.simulate_cvd_region(im, simulate.Deficiency.PROTAN, 1.0, rois=[(10, 5, 30, 20), (200, 100, 100, 100)], out=out)
+        np.testing.assert_array_equal(out[5:25, 10:40], out_ref[5:25, 10:40])
+        np.testing.assert_array_equal(out[100:, 200:], out_ref[100:, 200:])
+        self.assertEqual(np.count_nonzero(np.any(out != 0, axis=-1)), 30*20 + 16*8)
+
+        mask = np.zeros(im.shape[:2], dtype=bool)
+        mask[::3, ::7] = True
+        out = simulator.simulate_cvd_region(im, simulate.Deficiency.PROTAN, 1.0, mask=mask)
+        np.testing.assert_array_equal(out[mask], out_ref[mask])
+        np.testing.assert_array_equal(out[~mask], im[~mask])
+
+    def test_incremental(self):
+        simulator = simulate.Simulator_Machado2009()
+        incremental = simulate.IncrementalSimulator(simulator, simulate.Deficiency.DEUTAN, 0.8, tile_size=16)
+        im = generate.rgb_span(27*8, 27*4).copy()
+        np.testing.assert_array_equal(incremental.update(im), simulator.simulate_cvd(im, simulate.Deficiency.DEUTAN, 0.8))
+
+        im[20:30, 40:70] = (255, 0, 0)
+        im[100, 5] = (0, 255, 0)
+        self.assertEqual(incremental.dirty_rectangles(im), [(32, 16, 48, 16), (0, 96, 16, 16)])
+        np.testing.assert_array_equal(incremental.update(im), simulator.simulate_cvd(im, simulate.Deficiency.DEUTAN, 0.8))
+        self.assertEqual(incremental.dirty_rectangles(im), [])
+
+    def test_compile(self):
+        vienot1999 = simulate.Simulator_Vienot1999()
+        compiled = vienot1999.compile(simulate.Deficiency.DEUTAN, 1.0)
+        np.testing.assert_array_equal(compiled.inspection['cvd_linear_rgb'], compiled.linear_rgb_matrices[0])
+        self.assertEqual(compiled.inspection['lms_projection_matrix'][1,1], 0.0)
+
+        brettel1997 = simulate.Simulator_Brettel1997()
+        compiled = brettel1997.compile(simulate.Deficiency.TRITAN, 1.0)
+        T1, T2, n = compiled.linear_rgb_matrices
+        np.testing.assert_allclose(T1, compiled.inspection['T1'])
+        np.testing.assert_allclose(n, compiled.inspection['n_sep_plane_rgb'])
+        im = generate.rgb_span(27, 27)
+        # The compiled matrices are applied directly, without the caches of the simulator.
+        for simulator, deficiency, severity in [(brettel1997, simulate.Deficiency.TRITAN, 1.0), (vienot1999, simulate.Deficiency.DEUTAN, 0.6),
+                                                (simulate.Simulator_Machado2009(), simulate.Deficiency.PROTAN, 0.3)]:
+            compiled = simulator.compile(deficiency, severity)
+            self.assertGreater(compiled.nbytes, 0)
+            simulator._cvd_matrix_cache.clear()
+            out, palette_out = compiled.simulate_cvd(im), compiled.simulate_cvd_palette(im[0])
+            self.assertEqual(len(simulator._cvd_matrix_cache), 0)
+            self.assertLessEqual(np.max(np.abs(out.astype(int) - simulator.simulate_cvd(im, deficiency, severity))), 1)
+            np.testing.assert_array_equal(palette_out, simulator.simulate_cvd_palette(im[0], deficiency, severity))
+
+        self.assertIsNone(simulate.Simulator_CoblisV2().compile(simulate.Deficiency.PROTAN, 1.0).linear_rgb_matrices)
+        auto = simulate.Simulator_AutoSelect().compile(simulate.Deficiency.PROTAN, 0.5)
+        self.assertIsInstance(auto.inspection['selected_simulator'], simulate.Simulator_Machado2009)
+
+        # Simulating does not modify the simulators.
+        for simulator in [vienot1999, brettel1997]:
+            attributes = set(vars(simulator))
+            simulator.simulate_cvd(im, simulate.Deficiency.PROTAN, 1.0)
+            self.assertEqual(set(vars(simulator)), attributes)
+
+    def test_wide_gamut(self):
+        # The anchors and the neutral axis of Brettel 1997 do not depend on the display,
+        # so simulating on Display P3 must match simulating on sRGB, up to the change of primaries.
+        srgb_model = convert.LMSModel_SmithPokorny75_WithPrimaries(*convert.RGB_PRIMARIES_BT709)
+        p3_model = convert.LMSModel_DisplayP3_SmithPokorny75()
+        p3_from_srgb = p3_model.linearRGB_from_LMS @ srgb_model.LMS_from_linearRGB
+        srgb_colors = np.random.default_rng(0).random((500, 3)).astype(np.float32)
+        for deficiency in simulate.Deficiency:
+            srgb_out = simulate.Simulator_Brettel1997(srgb_model)._simulate_cvd_linear_rgb(srgb_colors, deficiency, 0.7)
+            p3_out = simulate.Simulator_Brettel1997(p3_model)._simulate_cvd_linear_rgb(convert.apply_color_matrix(srgb_colors, p3_from_srgb), deficiency, 0.7)
+            np.testing.assert_allclose(p3_out, convert.apply_color_matrix(srgb_out, p3_from_srgb), atol=1e-4)
+
+        # HDR images go through lookup tables, within 1 level of evaluating the transfer functions.
+        im = generate.rgb_span(27*4, 27*4)
+        for encoding in convert.HDR_ENCODINGS:
+            for simulator in [simulate.Simulator_Vienot1999(convert.LMSModel_BT2020_SmithPokorny75(), image_encoding=encoding),
+                              simulate.Simulator_Brettel1997(convert.LMSModel_BT2020_SmithPokorny75(), image_encoding=encoding)]:
+                for deficiency in simulate.Deficiency:
+                    out = simulator.simulate_cvd(im, deficiency, 0.8, precision='fixed')
+                    im_linear_rgb = convert.linearRGB_from_encoding(convert.as_float32(im), encoding)
+                    im_cvd_linear_rgb = simulator._simulate_cvd_linear_rgb(im_linear_rgb, deficiency, 0.8)
+                    out_ref = convert.as_uint8(convert.encoding_from_linearRGB(im_cvd_linear_rgb, encoding))
+                    self.assertLessEqual(np.max(np.abs(out.astype(int) - out_ref)), 1)
+
+                    # 16-bit images, e.g. 10-bit code values scaled to [0,65535].
+                    im16 = (im.astype(np.uint16) << 2) * 64
+                    out = simulator.simulate_cvd(im16, deficiency, 0.8, max_unique_colors=256)
+                    self.assertEqual(out.dtype, np.uint16)
+                    im_cvd_linear_rgb = simulator._simulate_cvd_linear_rgb(convert.linearRGB_from_encoding(im16 / np.float32(65535.0), encoding), deficiency, 0.8)
+                    out_ref = convert.as_uint16(convert.encoding_from_linearRGB(im_cvd_linear_rgb, encoding))
+                    self.assertLessEqual(np.max(np.abs(out.astype(int) - out_ref)), 1)
+                    chw = np.moveaxis(im16, -1, 0)
+                    np.testing.assert_array_equal(simulator.simulate_cvd(chw, deficiency, 0.8, layout='CHW'), np.moveaxis(out, -1, 0))
+                with self.assertRaises(ValueError):
+                    simulator.simulate_cvd(im.astype(np.float32), simulate.Deficiency.PROTAN, 0.8)
+
+    def test_layouts(self):
+        im = generate.rgb_span(27*4, 27*4)
+        chw = np.ascontiguousarray(np.moveaxis(im, -1, 0))
+        batch = np.stack([chw, chw[:, ::-1]])
+        for simulator in [simulate.Simulator_Vienot1999(), simulate.Simulator_Brettel1997(), simulate.Simulator_CoblisV2()]:
+            for deficiency in simulate.Deficiency:
+                for precision in ['float32', 'fixed']:
+                    out_ref = simulator.simulate_cvd(im, deficiency, 0.8, precision=precision)
+                    def check(out, expected):
+                        self.assertEqual(out.shape, expected.shape)
+                        self.assertLessEqual(np.max(np.abs(out.astype(int) - expected)), 1)
+                    check(simulator.simulate_cvd(chw, deficiency, 0.8, precision=precision, layout='CHW'), np.moveaxis(out_ref, -1, 0))
+                    # OpenCV order, and flipped views with negative strides.
+                    check(simulator.simulate_cvd(im[..., ::-1], deficiency, 0.8, precision=precision, channel_order='BGR'), out_ref[..., ::-1])
+                    check(simulator.simulate_cvd(chw[::-1, ::-1], deficiency, 0.8, precision=precision, layout='CHW', channel_order='BGR'),
+                          np.moveaxis(out_ref, -1, 0)[::-1, ::-1])
+                    out = simulator.simulate_cvd(batch, deficiency, 0.8, precision=precision, layout='CHW')
+                    check(out[1], np.moveaxis(out_ref, -1, 0)[:, ::-1])
+
+        np.testing.assert_allclose(convert.apply_color_matrix(chw.astype(np.float32), np.diag([1, 2, 3]), channel_axis=0),
+                                   np.moveaxis(im.astype(np.float32) * [1, 2, 3], -1, 0))
+        with self.assertRaises(ValueError):
+            simulate.Simulator_Vienot1999().simulate_cvd(im, simulate.Deficiency.PROTAN, 1.0, layout='WHC')
+        with self.assertRaises(ValueError):
+            simulate.Simulator_Vienot1999().simulate_cvd(im, simulate.Deficiency.PROTAN, 1.0, channel_order='GRB')
+
+    def test_threads(self):
+        """One instance of each simulator shared by a thread pool gives the sequential results."""
+        simulators = [
+            simulate.Simulator_Vienot1999(),
+            simulate.Simulator_Brettel1997(),
+            simulate.Simulator_Vischeck(),
+            simulate.Simulator_Machado2009(),
+            simulate.Simulator_CoblisV1(),
+            simulate.Simulator_CoblisV2(),
+            simulate.Simulator_AutoSelect(),
+        ]
+        im = generate.rgb_span(27*2, 27*2)
+        jobs = [(simulator, deficiency, severity, precision)
+                for simulator in simulators
+                for deficiency in simulate.Deficiency
+                for severity in [0.3, 1.0]
+                for precision in ['float32', 'fixed']]
+        def run(job):
+            simulator, deficiency, severity, precision = job
+            return simulator.simulate_cvd(im, deficiency, severity, precision=precision)
+        expected = [run(job) for job in jobs]
+        with ThreadPoolExecutor(8) as pool:
+            for _ in range(4):
+                for out, out_ref in zip(pool.map(run, jobs*2), expected*2):
+                    np.testing.assert_array_equal(out, out_ref)
+
+    def test_no_float64_promotion(self):
+        """Float32 images are simulated without any float64 intermediate."""
+        class Float32Only(np.ndarray):
+            def __array_finalize__(self, obj):
+                if self.dtype == np.float64:
+                    raise AssertionError("float32 image promoted to float64")
+
+        im = convert.as_float32(generate.rgb_span(27*2, 27*2)).view(Float32Only)
+        for simulator in [simulate.Simulator_Vienot1999(), simulate.Simulator_Brettel1997(), simulate.Simulator_Vischeck(),
+                          simulate.Simulator_Machado2009(), simulate.Simulator_CoblisV1(), simulate.Simulator_CoblisV2(),
+                          simulate.Simulator_AutoSelect()]:
+            for deficiency in simulate.Deficiency:
+                for severity in [np.float64(0.55), 1.0]:
+                    im_linear = convert.linearRGB_from_encoding(im, simulator.imageEncoding)
+                    out = simulator._simulate_cvd_linear_rgb(im_linear, deficiency, severity)
+                    out = convert.encoding_from_linearRGB(out, simulator.imageEncoding)
+                    self.assertEqual(out.dtype, np.float32)
+
 if __name__ == '__main__':
     unittest.main()
@@ -0,0 +1,53 @@
+#!/usr/bin/env python3
+
+import unittest
+
+import numpy as np
+
+from daltonlens import simulate, vector
+
+def invert(colors):
+    return 255 - colors
+
+class TestVector(unittest.TestCase):
+
+    def test_svg(self):
+        svg = ('<svg xmlns="http://www.w3.org/2000/svg">'
+               '<style>/* #123456 */ #abc, .a { fill: red; stroke: #00FF0080 } @media print { .b { color: rgb(10%, 20%, 30%) } }</style>'
+               '<stop offset="0" stop-color="#f00"/><stop stop-color="rgba(0 0 255 / 0.5)"/><stop stop-color=\'#f008\'/>'
+               '<rect fill="url(#abc)" stroke="orange" style="fill:Blue;opacity:0.5" href="#abc"/>'
+               '<text fill="green" font-family="red">red #ff0000</text></svg>')
+        expected = ('<svg xmlns="http://www.w3.org/2000/svg">'
+                    '<style>/* #123456 */ #abc, .a { fill: #00ffff; stroke: #ff00ff80 } @media print { .b { color: rgb(229, 204, 179) } }</style>'
+                    '<stop offset="0" stop-color="#00ffff"/><stop stop-color="rgba(255, 255, 0, 0.5)"/><stop stop-color=\'#00ffff88\'/>'
+                    '<rect fill="url(#abc)" stroke="#005aff" style="fill:#ffff00;opacity:0.5" href="#abc"/>'
+                    '<text fill="#ff7fff" font-family="red">red #ff0000</text></svg>')
+        self.assertEqual(vector.transform_svg_colors(svg, invert), expected)
+        self.assertEqual(vector.transform_svg_colors('<svg/>', invert), '<svg/>')
+
+    def test_css(self):
+        css = "body { color: black; font-family: Red Hat; } a:hover, #abc { border: 1px solid #ABCDEF !important; box-shadow: 0 0 2px rgba(0,0,0,.3) }"
+        expected = "body { color: #ffffff; font-family: Red Hat; } a:hover, #abc { border: 1px solid #543210 !important; box-shadow: 0 0 2px rgba(255, 255, 255, .3) }"
+        self.assertEqual(vector.transform_css_colors(css, invert), expected)
+
+    def test_simulate(self):
+        colors = [(255, 0, 0), (0, 128, 255), (12, 200, 99)]
+        svg = ''.join(f'<rect fill="#{r:02x}{g:02x}{b:02x}" stroke="rgb({r},{g},{b})"/>' for r, g, b in colors)
+        simulator = simulate.Simulator_Machado2009()
+        out = vector.simulate_cvd_document(svg, '.SVG', simulator, simulate.Deficiency.DEUTAN, 0.7)
+        simulated = simulator.simulate_cvd_palette(np.array(colors, dtype=np.uint8), simulate.Deficiency.DEUTAN, 0.7)
+        self.assertEqual(out, ''.join(f'<rect fill="#{r:02x}{g:02x}{b:02x}" stroke="rgb({r}, {g}, {b})"/>' for r, g, b in simulated))
+
+        # All the unique colors are simulated in a single call.
+        calls = []
+        def transform(colors):
+            calls.append(colors.shape)
+            return colors
+        vector.transform_svg_colors(svg * 100, transform)
+        self.assertEqual(calls, [(3, 3)])
+
+        with self.assertRaises(ValueError):
+            vector.simulate_cvd_document(svg, '.png', simulator, simulate.Deficiency.DEUTAN, 0.7)
+
+if __name__ == '__main__':
+    unittest.main()